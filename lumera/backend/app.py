@@ -104,14 +104,23 @@ from flask import Flask
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from config import Config
-from models import db
+from models import db, upgrade_schema, ShadowPrediction
 from routes.auth import auth_bp
 from routes.analysis import analysis_bp
+from routes.admin import admin_bp
+from services.shadow import get_shadow_runner
+from commands import register_commands
+from services.recommendations import get_catalogue
+from utils.serialization import FastJSONProvider, register_compression
+from services.storage import start_compactor
+from services.archive import start_archiver
+from services.degradation import start_rescorer
 import os
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.json = FastJSONProvider(app)
     
     # CRITICAL JWT Configuration
     app.config['PROPAGATE_EXCEPTIONS'] = True
@@ -150,20 +159,53 @@ def create_app():
     
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(analysis_bp, url_prefix='/api/analysis')
+    app.register_blueprint(admin_bp, url_prefix='/api/admin')
     
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
     with app.app_context():
         db.create_all()
+        upgrade_schema()
         print("✓ Database initialized")
     
+    # Shadow predictions are produced on a background thread, outside any request
+    def record_shadow_prediction(record):
+        with app.app_context():
+            db.session.add(ShadowPrediction(**record))
+            db.session.commit()
+    
+    get_shadow_runner().sink = record_shadow_prediction
+    
+    register_commands(app)
+    
+    # Load the recommendation catalogue now rather than on the first upload
+    get_catalogue()
+    
+    register_compression(app)
+    
     @app.route('/api/health', methods=['GET'])
     def health_check():
         return {'status': 'healthy', 'message': 'Luméra API running on port 3001'}, 200
     
     return app
 
+def start_background_jobs(app):
+    """
+    Maintenance threads for a serving process only (serve.py, python app.py).
+    CLI commands and scripts that build the app must not run them: the
+    rescorer would rewrite rows that `flask reanalyze` is rewriting.
+    """
+    # Old originals are transcoded and orphaned files removed in the background
+    start_compactor(app, Config.STORAGE_COMPACT_INTERVAL_HOURS)
+    
+    # Analyses past ARCHIVE_AFTER_DAYS move to monthly archive databases
+    start_archiver(app, Config.ARCHIVE_INTERVAL_HOURS)
+    
+    # Provisional (overload) results are re-scored by the model when load drops
+    start_rescorer(app, Config.RESCORE_INTERVAL_SECONDS)
+
 if __name__ == '__main__':
     app = create_app()
+    start_background_jobs(app)
     print("🚀 Starting Luméra Backend on port 3001...")
     app.run(debug=True, host='0.0.0.0', port=3001)
\ No newline at end of file
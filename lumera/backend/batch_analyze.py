@@ -0,0 +1,213 @@
+"""
+Offline batch analyzer for a directory of images
+
+    python batch_analyze.py /data/partner_set -o results.ndjson [--mode model|features] [--workers 8]
+
+Scans the directory recursively and writes one JSON line per image:
+    {"path": "sub/img.jpg", "skin_type": "Oily", "confidence": 91.2, "model_version": "v2025...", "scores": {...}}
+
+Images are decoded on a process pool, a few batches ahead of the model, and
+scored in batched predict calls. Results are appended and flushed after
+every batch. Re-running the same command skips every path already in the
+output file, so an interrupted run resumes where it stopped. Files that
+failed to decode get an "error" line and are retried on the next run.
+
+--mode model uses the active registry version (or --version, or the legacy
+model file). --mode features uses the rule-based classify_by_features()
+fallback and loads no model. The default, auto, picks the model when one
+is available, as the API does.
+"""
+from collections import deque, Counter
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+from config import Config
+from services.preprocessing import decode_pixels, skin_features
+from utils.helpers import available_cores
+
+_INV_255 = np.float32(1.0 / 255.0)
+
+
+def scan(root, extensions=None):
+    """Image paths under root, relative to it, in a stable order"""
+    extensions = extensions or Config.ALLOWED_EXTENSIONS
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.rsplit('.', 1)[-1].lower() in extensions:
+                yield os.path.relpath(os.path.join(dirpath, filename), root)
+
+
+def load_done(output_path):
+    """Paths already written to output_path; a torn last line from a crash is cut off"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if 'error' not in record:
+            done.add(record['path'])
+    return done
+
+
+def _decode(path, size, mode):
+    """Process-pool task: uint8 pixels for the model, or the rule-based features"""
+    try:
+        if mode == 'features':
+            return skin_features(path), None
+        return decode_pixels(path, size), None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+
+
+def load_analyzer(version=None):
+    """A SkinAnalyzer serving `version` (default: whatever the API would serve), without the watcher"""
+    from services.ml_service import SkinAnalyzer
+    if version is None:
+        return SkinAnalyzer()
+    # Only the requested version; the active one is never loaded
+    analyzer = SkinAnalyzer(load=False)
+    analyzer.active = analyzer.load_version(version)
+    return analyzer
+
+
+def run(root, output_path, mode='auto', version=None, batch_size=64, workers=None, restart=False):
+    """Analyze every image under root into output_path; returns a summary dict"""
+    workers = workers or available_cores()
+    analyzer, size = None, None
+    if mode != 'features':
+        analyzer = load_analyzer(version)
+        if analyzer.active is None:
+            if mode == 'model':
+                raise RuntimeError("No ML model loaded; use --mode features")
+            print("⚠ No ML model loaded. Using feature-based analysis.")
+            mode = 'features'
+        else:
+            mode = 'model'
+            size = analyzer.input_size()
+    if mode == 'features':
+        from services.ml_service import SkinAnalyzer
+        classify_by_features = SkinAnalyzer.classify_by_features
+
+    if restart and os.path.exists(output_path):
+        os.remove(output_path)
+    done = load_done(output_path)
+    paths = [path for path in scan(root) if path not in done]
+    if done:
+        print(f"↻ Resuming: {len(done):,} images already analyzed")
+    print(f"🔍 Analyzing {len(paths):,} images with {mode} ({workers} decode processes)")
+
+    summary = {'analyzed': 0, 'errors': 0, 'skin_types': Counter(), 'mode': mode}
+    started = time.perf_counter()
+    last_report = started
+
+    # spawn keeps TensorFlow and the model out of the decode processes
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    pending = iter(paths)
+    window = deque()
+
+    def refill():
+        # Decode runs at most a few batches ahead, so memory stays bounded
+        while len(window) < batch_size * 3:
+            path = next(pending, None)
+            if path is None:
+                return
+            window.append((path, pool.submit(_decode, os.path.join(root, path), size, mode)))
+
+    try:
+        with open(output_path, 'a') as out:
+            refill()
+            while window:
+                batch_paths, items, records = [], [], []
+                while window and len(batch_paths) < batch_size:
+                    path, future = window.popleft()
+                    item, error = future.result()
+                    if error is not None:
+                        records.append({'path': path, 'error': error})
+                        summary['errors'] += 1
+                        continue
+                    batch_paths.append(path)
+                    items.append(item)
+                refill()
+
+                if items and mode == 'model':
+                    active = analyzer.active
+                    batch = np.multiply(np.stack(items), _INV_255, dtype=np.float32)
+                    probabilities, _ = analyzer.forward(active, batch)
+                    for path, row in zip(batch_paths, probabilities):
+                        predicted = int(np.argmax(row))
+                        records.append({
+                            'path': path,
+                            'skin_type': active.class_names[predicted],
+                            'confidence': round(float(row[predicted]) * 100, 2),
+                            'model_version': active.version,
+                            'scores': {name: round(float(p), 4) for name, p in zip(active.class_names, row)},
+                        })
+                elif items:
+                    for path, features in zip(batch_paths, items):
+                        skin_type, confidence = classify_by_features(features)
+                        records.append({'path': path, 'skin_type': skin_type, 'confidence': confidence,
+                                        'model_version': 'features'})
+
+                for record in records:
+                    out.write(json.dumps(record) + '\n')
+                    if 'error' not in record:
+                        summary['analyzed'] += 1
+                        summary['skin_types'][record['skin_type']] += 1
+                out.flush()
+
+                now = time.perf_counter()
+                if now - last_report >= 10:
+                    last_report = now
+                    processed = summary['analyzed'] + summary['errors']
+                    print(f"  {processed:,}/{len(paths):,} images  {processed / (now - started):,.1f} img/s")
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - started
+    summary['seconds'] = round(elapsed, 2)
+    summary['images_per_sec'] = round((summary['analyzed'] + summary['errors']) / elapsed, 1) if elapsed else 0.0
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Classify every image in a directory')
+    parser.add_argument('directory')
+    parser.add_argument('-o', '--output', default='batch_results.ndjson', help='NDJSON file, appended to')
+    parser.add_argument('--mode', choices=['auto', 'model', 'features'], default='auto')
+    parser.add_argument('--version', default=None, help='registry version (default: the active one)')
+    parser.add_argument('--batch-size', type=int, default=64, help='images per predict call')
+    parser.add_argument('--workers', type=int, default=None, help='decode processes (default: one per core)')
+    parser.add_argument('--restart', action='store_true', help='start over instead of resuming')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        sys.exit(f"❌ Not a directory: {args.directory}")
+    try:
+        summary = run(args.directory, args.output, args.mode, args.version, args.batch_size,
+                      args.workers, args.restart)
+    except RuntimeError as e:
+        sys.exit(f"❌ {e}")
+
+    print(f"✓ {summary['analyzed']:,} images analyzed with {summary['mode']}, {summary['errors']:,} errors, "
+          f"{summary['images_per_sec']:,.1f} img/s")
+    for skin_type, count in summary['skin_types'].most_common():
+        print(f"  {skin_type:<12} {count:>8,}")
+    print(f"✓ Results in {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Allocations and RSS of image preprocessing, before and after the tensor pool
+
+    python benchmarks/bench_buffer_pool.py [--images 200] [--size 1600x1200]
+
+Runs the old preprocess_image / extract_skin_features code (copied below)
+and the pooled decode_into / skin_features path over the same synthetic
+JPEGs, then reports the bytes each image allocates at its high-water mark
+(tracemalloc, which includes NumPy buffers), blocks still alive afterwards,
+wall time and the process RSS growth for each path. Only
+TensorFlow-free modules are imported, so it runs without the model.
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+import cv2
+import numpy as np
+from services.buffer_pool import TensorPool
+from services.preprocessing import decode_into, skin_features
+
+
+def old_preprocess(image_path):
+    img = Image.open(image_path).convert('RGB')
+    img = img.resize((224, 224))
+    img_array = np.array(img)
+    img_array = img_array / 255.0
+    return np.expand_dims(img_array, axis=0)
+
+
+def old_features(image_path):
+    img = cv2.imread(image_path)
+    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    height, width = img.shape[:2]
+    center_region = img_rgb[int(height*0.3):int(height*0.7), int(width*0.3):int(width*0.7)]
+    return {
+        'brightness': float(np.mean(center_region)),
+        'variance': float(np.var(center_region)),
+        'saturation': float(np.mean(img_hsv[:, :, 1]))
+    }
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except OSError:
+        # ru_maxrss is a high-water mark (KB on Linux), the best available elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def make_images(directory, count, width, height):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        base = rng.integers(60, 200, size=3)
+        noise = rng.integers(-40, 40, size=(height // 8, width // 8, 3))
+        pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+        path = os.path.join(directory, f'{i}.jpg')
+        Image.fromarray(pixels).resize((width, height)).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def measure(label, paths, step):
+    step(paths[0])  # warm caches and lazily created buffers outside the measurement
+    rss_before = rss_mb()
+    transient = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    for path in paths:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        step(path)
+        transient.append(tracemalloc.get_traced_memory()[1] - baseline)
+    elapsed = time.perf_counter() - start
+    retained = tracemalloc.take_snapshot().statistics('filename')
+    tracemalloc.stop()
+
+    n = len(paths)
+    print(f"{label:<28} {elapsed / n * 1000:7.2f} ms/img  "
+          f"allocated {np.mean(transient) / 1e6:6.2f} MB/img (max {max(transient) / 1e6:6.2f})  "
+          f"retained {sum(s.count for s in retained):4d} blocks  RSS {rss_before:.1f} -> {rss_mb():.1f} MB")
+    return np.mean(transient)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pooled image preprocessing')
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--size', default='1600x1200', help='WIDTHxHEIGHT of the synthetic uploads')
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.split('x'))
+
+    tmp = tempfile.mkdtemp()
+    paths = make_images(tmp, args.images, width, height)
+    print(f"{args.images} JPEGs at {width}x{height}\n")
+
+    pool = TensorPool(4, (224, 224, 3), shared=True)
+
+    def pooled_preprocess(path):
+        with pool.acquire() as tensor:
+            decode_into(path, tensor[0])
+
+    old_peak = measure('old preprocess_image', paths, old_preprocess)
+    new_peak = measure('pooled decode_into', paths, pooled_preprocess)
+    old_feat_peak = measure('old extract_skin_features', paths, old_features)
+    new_feat_peak = measure('skin_features', paths, skin_features)
+
+    print(f"\nBytes allocated per image: preprocess {old_peak / max(new_peak, 1):.1f}x lower, "
+          f"features {old_feat_peak / max(new_feat_peak, 1):.1f}x lower")
+    print(f"Pool: {pool.acquired} slot uses, {pool.misses} misses")
+    pool.close(unlink=True)
+    for path in paths:
+        os.remove(path)
+    os.rmdir(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Per-call cost of model.predict vs the compiled, bucketed predictor
+
+    python benchmarks/bench_compiled.py [--model path.h5] [--calls 200] [--sizes 1,3,8,17,32]
+
+For each batch size it times model.predict, a direct model(x) call, and
+CompiledPredictor with XLA off, on and auto. Sizes that are not a bucket
+show the cost of padding. The "overhead" column is the time per call above
+the direct model(x) call, which does the same math without a predict loop.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from services.compiled_model import CompiledPredictor
+
+
+def time_calls(fn, batch, calls):
+    fn(batch)
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn(batch)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+
+def default_model_path():
+    from services import model_registry
+    version = model_registry.current_version()
+    if version:
+        return model_registry.read_manifest(version)['artifact_path']
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ml_model', 'skin_type_model.h5')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare model.predict with compiled bucketed graphs')
+    parser.add_argument('--model', default=None, help='model file (default: the serving model)')
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--sizes', default='1,3,8,17,32', help='batch sizes to time')
+    parser.add_argument('--buckets', default='1,4,8,32')
+    args = parser.parse_args()
+
+    model_path = args.model or default_model_path()
+    if not os.path.exists(model_path):
+        sys.exit(f"❌ Model not found: {model_path}")
+    model = keras.models.load_model(model_path)
+    height, width = model.input_shape[1:3]
+    buckets = tuple(int(b) for b in args.buckets.split(','))
+
+    predictors = {}
+    for xla in ('off', 'on', 'auto'):
+        start = time.perf_counter()
+        predictor = CompiledPredictor(model, buckets, xla)
+        try:
+            predictor.warmup()
+        except Exception as e:
+            print(f"⚠ XLA={xla} unavailable: {e}")
+            continue
+        predictors[xla] = predictor
+        print(f"✓ Traced buckets {buckets} with XLA={xla} in {time.perf_counter() - start:.1f}s")
+    if 'auto' in predictors:
+        chosen = ', '.join(f"{b}:{'xla' if on else 'graph'}" for b, on in sorted(predictors['auto'].xla.items()))
+        print(f"  auto picked {chosen}")
+
+    direct = tf.function(lambda x: model(x, training=False), reduce_retracing=True)
+    print(f"\n{'batch':>5} {'variant':<14} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'overhead':>9}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        batch = np.random.rand(size, height, width, 3).astype(np.float32)
+        baseline = time_calls(direct, batch, args.calls)
+        results = [('model(x)', baseline),
+                   ('model.predict', time_calls(lambda b: model.predict(b, verbose=0, batch_size=size), batch, args.calls))]
+        results += [(f'compiled/{xla}', time_calls(p, batch, args.calls)) for xla, p in predictors.items()]
+        for name, result in results:
+            print(f"{size:>5} {name:<14} {result['mean_ms']:>9.2f} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                  f"{result['mean_ms'] - baseline['mean_ms']:>+9.2f}")
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Serialization throughput of a 10k-row analysis history
+
+    python benchmarks/bench_serialization.py [--rows 10000] [--repeat 5]
+
+Compares the old path (ORM objects -> to_dict() -> stdlib json, with
+recommendations double-encoded) against query-tuple projections serialized
+with each available backend, and reports gzip/brotli sizes and costs.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import select
+from models import db, User, Analysis
+from services.recommendations import get_catalogue, encode_ids
+from utils import serialization
+from utils.serialization import analysis_projection, analysis_row_to_dict
+
+
+def best_of(repeat, fn):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark history serialization')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(tmp, "bench.db")}'
+    db.init_app(app)
+
+    catalogue = get_catalogue()
+    skin_types = ['Normal', 'Oily', 'Dry', 'Combination', 'Sensitive']
+
+    with app.app_context():
+        db.create_all()
+        user = User(email='bench@example.com', username='bench', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+
+        now = datetime.utcnow()
+        db.session.execute(Analysis.__table__.insert(), [{
+            'user_id': user.id,
+            'image_path': f'{i:064x}.jpg',
+            'skin_type': skin_types[i % 5],
+            'confidence': 50 + (i % 50),
+            'recommendations': '',
+            'recommendation_ids': encode_ids(catalogue.recommend(skin_types[i % 5], 50 + (i % 50))),
+            'model_version': 'v20250101120000',
+            'created_at': now - timedelta(minutes=i),
+        } for i in range(args.rows)])
+        db.session.commit()
+
+        def old_path():
+            analyses = Analysis.query.filter_by(user_id=user.id).order_by(Analysis.created_at.desc()).all()
+            items = []
+            for analysis in analyses:
+                item = analysis.to_dict()
+                item['recommendations'] = json.dumps(item['recommendations'])  # old double encoding
+                items.append(item)
+            db.session.expunge_all()
+            return json.dumps({'analyses': items}).encode('utf-8')
+
+        def projection_rows():
+            rows = db.session.execute(
+                select(*analysis_projection())
+                .where(Analysis.user_id == user.id)
+                .order_by(Analysis.created_at.desc())
+            )
+            return {'analyses': [analysis_row_to_dict(row) for row in rows]}
+
+        results = []
+        seconds, body = best_of(args.repeat, old_path)
+        results.append(('ORM + to_dict + json (old)', seconds, len(body)))
+
+        backends = ['stdlib'] + (['orjson'] if serialization.orjson is not None else [])
+        for backend in backends:
+            serialization.Config.JSON_BACKEND = backend
+            seconds, body = best_of(args.repeat, lambda: serialization.dumps_bytes(projection_rows()))
+            results.append((f'projection + {backend}', seconds, len(body)))
+
+        payload = projection_rows()
+        seconds, _ = best_of(args.repeat, lambda: serialization.dumps_bytes(payload))
+        results.append((f'dumps only ({serialization.backend_name()})', seconds, len(body)))
+
+        gz_seconds, gz = best_of(args.repeat, lambda: gzip.compress(body, compresslevel=5))
+        results.append(('gzip level 5', gz_seconds, len(gz)))
+        if serialization.brotli is not None:
+            br_seconds, br = best_of(args.repeat, lambda: serialization.brotli.compress(body, quality=5))
+            results.append(('brotli quality 5', br_seconds, len(br)))
+
+    print(f"\nHistory of {args.rows:,} rows (best of {args.repeat})")
+    print("=" * 72)
+    print(f"{'path':<34}{'ms':>10}{'rows/s':>14}{'bytes':>14}")
+    print("=" * 72)
+    for name, seconds, size in results:
+        print(f"{name:<34}{seconds * 1000:>10.1f}{args.rows / seconds:>14,.0f}{size:>14,}")
+
+
+if __name__ == '__main__':
+    main()
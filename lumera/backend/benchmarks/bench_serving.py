@@ -0,0 +1,153 @@
+"""
+Requests/sec of the production server (serve.py --mode prod) against the
+Flask development server (app.run(debug=True)).
+
+    python benchmarks/bench_serving.py --concurrency 32 --duration 10
+
+Each server is started in a subprocess against a throwaway SQLite database,
+then hammered with keep-alive HTTP clients on the I/O-bound endpoints.
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPLOAD_DIR = os.path.join(BACKEND_DIR, 'uploads')
+BENCH_IMAGE = 'bench_serving.jpg'
+
+
+def wait_for_server(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/api/health')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f"server on port {port} did not come up")
+
+
+def start_server(mode, port, db_path, workers):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}')
+    cmd = [sys.executable, 'serve.py', '--mode', mode, '--port', str(port), '--host', '127.0.0.1']
+    if mode == 'prod' and workers:
+        cmd += ['--workers', str(workers)]
+    return subprocess.Popen(
+        cmd, cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+
+
+def stop_server(proc):
+    # The dev server's reloader forks a child, so signal the whole group
+    os.killpg(proc.pid, signal.SIGTERM)
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+
+
+def get_token(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    body = json.dumps({'email': 'bench@example.com', 'username': 'bench', 'password': 'bench-password'})
+    headers = {'Content-Type': 'application/json'}
+    conn.request('POST', '/api/auth/register', body, headers)
+    resp = conn.getresponse()
+    data = json.loads(resp.read())
+    if resp.status != 201:
+        conn.request('POST', '/api/auth/login', body, headers)
+        data = json.loads(conn.getresponse().read())
+    return data['access_token']
+
+
+def hammer(port, path, token, concurrency, duration):
+    """Return (requests/sec, error count) for `path` under `concurrency` clients"""
+    counts = [0] * concurrency
+    errors = [0] * concurrency
+    stop_at = time.perf_counter() + duration
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def client(i):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.perf_counter() < stop_at:
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status == 200:
+                    counts[i] += 1
+                else:
+                    errors[i] += 1
+            except (OSError, http.client.HTTPException):
+                errors[i] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return sum(counts) / elapsed, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=None, help='prod workers (default: per core)')
+    args = parser.parse_args()
+
+    endpoints = [
+        ('health', '/api/health'),
+        ('auth/me', '/api/auth/me'),
+        ('history', '/api/analysis/history'),
+        ('image', f'/api/analysis/uploads/{BENCH_IMAGE}'),
+    ]
+
+    # A ~200 KB file so the image endpoint exercises the sendfile path
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    image_path = os.path.join(UPLOAD_DIR, BENCH_IMAGE)
+    with open(image_path, 'wb') as f:
+        f.write(os.urandom(200 * 1024))
+
+    results = {}
+    try:
+        for mode, port in (('dev', 3101), ('prod', 3102)):
+            with tempfile.TemporaryDirectory() as tmp:
+                proc = start_server(mode, port, os.path.join(tmp, 'bench.db'), args.workers)
+                try:
+                    wait_for_server(port)
+                    token = get_token(port)
+                    for name, path in endpoints:
+                        rps, errs = hammer(port, path, token, args.concurrency, args.duration)
+                        results[(mode, name)] = rps
+                        print(f"  {mode:<4} {name:<8} {rps:>9.1f} req/s  ({errs} errors)")
+                finally:
+                    stop_server(proc)
+    finally:
+        os.remove(image_path)
+
+    print("\n" + "=" * 60)
+    print(f"{'endpoint':<10}{'dev req/s':>14}{'prod req/s':>14}{'speedup':>10}")
+    print("=" * 60)
+    for name, _ in endpoints:
+        dev, prod = results[('dev', name)], results[('prod', name)]
+        speedup = prod / dev if dev else float('inf')
+        print(f"{name:<10}{dev:>14.1f}{prod:>14.1f}{speedup:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
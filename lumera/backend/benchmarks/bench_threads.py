@@ -0,0 +1,154 @@
+"""
+Sweep worker / thread settings for model inference on this host
+
+    python benchmarks/bench_threads.py [--seconds 10] [--model path.h5] [--no-pin]
+
+For each configuration it starts `workers` processes, as gunicorn would.
+Each process sets TensorFlow's intra/inter-op pools, is optionally pinned to
+its own slice of cores, and runs `analysis threads` concurrent single-image
+predicts, like concurrent uploads. It reports host-wide images/sec and
+p50/p95/p99 latency, then prints the environment variables of the best
+configuration: highest throughput among those within 20% of the best p99.
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.helpers import available_cores
+
+
+def _worker(slot, config, model_path, seconds, start_at, results):
+    from services import runtime
+    if config['pin']:
+        runtime.pin_to_cores(runtime.worker_cores(slot, config['workers']))
+    for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[name] = str(config['intra_op'])
+
+    import numpy as np
+    import tensorflow as tf
+    from tensorflow import keras
+    runtime.configure_tensorflow(tf, {'intra_op': config['intra_op'], 'inter_op': config['inter_op'], 'opencv': 1})
+
+    model = keras.models.load_model(model_path)
+    height, width = model.input_shape[1:3]
+    image = np.random.rand(1, height, width, 3).astype(np.float32)
+    model.predict(image, verbose=0)
+
+    latencies = []
+    lock = threading.Lock()
+
+    def client():
+        mine = []
+        while time.time() < start_at + seconds:
+            began = time.perf_counter()
+            model.predict(image, verbose=0)
+            mine.append(time.perf_counter() - began)
+        with lock:
+            latencies.extend(mine)
+
+    # All workers start measuring at the same wall-clock moment
+    time.sleep(max(0.0, start_at - time.time()))
+    clients = [threading.Thread(target=client) for _ in range(config['threads'])]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    results.put(latencies)
+
+
+def run_config(config, model_path, seconds):
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    # Leave time for every worker to import TensorFlow and load the model
+    start_at = time.time() + 15 + 2 * config['workers']
+    processes = [
+        ctx.Process(target=_worker, args=(slot, config, model_path, seconds, start_at, results))
+        for slot in range(config['workers'])
+    ]
+    for process in processes:
+        process.start()
+    latencies = []
+    for _ in processes:
+        latencies.extend(results.get())
+    for process in processes:
+        process.join()
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        'images_per_sec': len(latencies) / seconds,
+        'p50_ms': pct(0.50), 'p95_ms': pct(0.95), 'p99_ms': pct(0.99),
+    }
+
+
+def candidate_configs(cores, pin_options):
+    """Worker counts that divide the host; per worker, split its share between TF and request threads"""
+    worker_counts = sorted({1, 2, 4, cores // 2, cores} - {0})
+    for workers, pin in itertools.product(worker_counts, pin_options):
+        share = max(1, cores // workers)
+        if pin and workers == 1:
+            continue  # pinning one worker to every core changes nothing
+        for intra_op in sorted({1, max(1, share // 2), share}):
+            for inter_op in (1, 2):
+                yield {
+                    'workers': workers,
+                    'threads': max(1, share // intra_op),
+                    'intra_op': intra_op,
+                    'inter_op': inter_op,
+                    'pin': pin,
+                }
+
+
+def default_model_path():
+    from services import model_registry
+    version = model_registry.current_version()
+    if version:
+        return model_registry.read_manifest(version)['artifact_path']
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ml_model', 'skin_type_model.h5')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep TensorFlow thread settings for serving')
+    parser.add_argument('--model', default=None, help='model file (default: the serving model)')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--no-pin', action='store_true', help='skip the core-pinning variants')
+    args = parser.parse_args()
+
+    model_path = args.model or default_model_path()
+    if not os.path.exists(model_path):
+        sys.exit(f"❌ Model not found: {model_path}")
+    cores = available_cores()
+    pin_options = (False,) if args.no_pin or not hasattr(os, 'sched_setaffinity') else (False, True)
+    configs = list(candidate_configs(cores, pin_options))
+    print(f"{cores} cores, {len(configs)} configurations, {args.seconds:g}s each\n")
+    print(f"{'workers':>7} {'threads':>7} {'intra':>5} {'inter':>5} {'pin':>4} "
+          f"{'img/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+
+    measured = []
+    for config in configs:
+        result = run_config(config, model_path, args.seconds)
+        measured.append((config, result))
+        print(f"{config['workers']:>7} {config['threads']:>7} {config['intra_op']:>5} {config['inter_op']:>5} "
+              f"{'yes' if config['pin'] else 'no':>4} {result['images_per_sec']:>8.1f} "
+              f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f}")
+
+    best_tail = min(result['p99_ms'] for _, result in measured)
+    eligible = [(c, r) for c, r in measured if r['p99_ms'] <= best_tail * 1.2]
+    config, result = max(eligible, key=lambda item: item[1]['images_per_sec'])
+    print(f"\nRecommended ({result['images_per_sec']:.1f} img/s, p99 {result['p99_ms']:.1f} ms):")
+    print(f"  WEB_CONCURRENCY={config['workers']} ANALYSIS_THREADS={config['threads']} "
+          f"TF_INTRA_OP_THREADS={config['intra_op']} TF_INTER_OP_THREADS={config['inter_op']} "
+          f"PIN_WORKER_CORES={int(config['pin'])}")
+
+
+if __name__ == '__main__':
+    main()
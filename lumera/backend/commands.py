@@ -0,0 +1,250 @@
+"""
+Flask CLI commands
+
+    flask --app app reanalyze [--batch-size 128] [--workers 8] [--restart]
+    flask --app app rebuild-stats
+    flask --app app embedding-index [--rebuild] [--version v2025...]
+    flask --app app storage-compact [--dry-run] [--transcode-after-days 30]
+    flask --app app archive [--older-than-days 180] [--batch-size 500] [--vacuum]
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import update, or_, func
+from models import db, Analysis, ArchivePartition, iter_analysis_chunks, rebuild_daily_stats
+from services.ml_service import get_analyzer, load_image_tensor
+from services.recommendations import encode_ids
+from services.embedding_index import IVFIndex, encode_embedding, snapshot_path, sync_from_db, new_index, embedded_versions
+from services.storage import upload_dir, compact, format_report
+from utils.helpers import try_lock
+from services import archive
+from config import Config
+import click
+import json
+import os
+import time
+import numpy as np
+
+
+def register_commands(app):
+    app.cli.add_command(reanalyze_command)
+    app.cli.add_command(rebuild_stats_command)
+    app.cli.add_command(embedding_index_command)
+    app.cli.add_command(storage_compact_command)
+    app.cli.add_command(archive_command)
+
+
+def _read_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_checkpoint(path, state):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _load_or_none(image_path, size):
+    try:
+        return load_image_tensor(os.path.join(upload_dir(), image_path), size)
+    except (OSError, ValueError):
+        return None
+
+
+@click.command('reanalyze')
+@click.option('--batch-size', default=128, show_default=True, help='Images per model predict call')
+@click.option('--flush-every', default=2048, show_default=True, help='Rows scanned per bulk UPDATE + checkpoint')
+@click.option('--checkpoint-seconds', default=30, show_default=True, help='Checkpoint at least this often')
+@click.option('--workers', default=8, show_default=True, help='Image decode threads')
+@click.option('--checkpoint', default=None, help='Checkpoint file (default: instance/reanalyze_checkpoint.json)')
+@click.option('--restart', is_flag=True, help='Ignore an existing checkpoint')
+@click.option('--all-rows', is_flag=True, help='Also re-score rows already produced by the serving model')
+@with_appcontext
+def reanalyze_command(batch_size, flush_every, checkpoint_seconds, workers, checkpoint, restart, all_rows):
+    """Re-run every Analysis in the main database through the serving model.
+
+    Archived analyses (see `archive`) are not re-scored. They keep the skin
+    types, recommendations and daily-stats totals of the model that produced them.
+    """
+    analyzer = get_analyzer()
+    if analyzer.model is None:
+        raise click.ClickException("No ML model loaded; nothing to re-analyze with")
+    target_version = analyzer.model_version
+    size = analyzer.input_size()
+
+    checkpoint = checkpoint or os.path.join(current_app.instance_path, 'reanalyze_checkpoint.json')
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint)), exist_ok=True)
+    state = _read_checkpoint(checkpoint)
+    if restart or not state or state.get('model_version') != target_version:
+        state = {'model_version': target_version, 'last_id': 0, 'updated': 0, 'missing': 0}
+    else:
+        click.echo(f"↻ Resuming after analysis id {state['last_id']}")
+
+    criteria = () if all_rows else (
+        or_(Analysis.model_version.is_(None), Analysis.model_version != target_version),
+    )
+    total = db.session.query(func.count(Analysis.id)).filter(Analysis.id > state['last_id'], *criteria).scalar()
+    click.echo(f"🔁 Re-analyzing {total:,} analyses with model {target_version}")
+
+    chunks = iter_analysis_chunks(
+        (Analysis.id, Analysis.image_path), criteria, state['last_id'], flush_every
+    )
+    rows = (row for chunk in chunks for row in chunk)
+
+    # Decode runs ahead of the model by at most two batches, so memory stays
+    # bounded no matter how many rows there are
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode')
+    window = deque()
+
+    def refill():
+        while len(window) < batch_size * 2:
+            row = next(rows, None)
+            if row is None:
+                return
+            window.append((row.id, pool.submit(_load_or_none, row.image_path, size)))
+
+    updates = []
+    last_id = state['last_id']
+    done = 0
+    started = time.perf_counter()
+    checkpointed = {'done': 0, 'at': started}
+
+    def flush():
+        if updates:
+            db.session.execute(update(Analysis), updates)
+        state['last_id'] = last_id
+        db.session.commit()
+        _write_checkpoint(checkpoint, state)
+        updates.clear()
+        checkpointed['done'], checkpointed['at'] = done, time.perf_counter()
+        elapsed = checkpointed['at'] - started
+        click.echo(f"  {done:,}/{total:,} rows  {done / elapsed:,.1f} img/s  "
+                   f"({state['updated']:,} updated, {state['missing']:,} missing files)")
+
+    try:
+        refill()
+        while window:
+            ids, tensors = [], []
+            while window and len(ids) < batch_size:
+                analysis_id, future = window.popleft()
+                tensor = future.result()
+                last_id = analysis_id
+                done += 1
+                if tensor is None:
+                    state['missing'] += 1
+                    continue
+                ids.append(analysis_id)
+                tensors.append(tensor)
+            refill()
+
+            if tensors:
+                skin_types, confidences, _, embeddings = analyzer.predict_batch(np.stack(tensors), batch_size)
+                for i, (analysis_id, skin_type, confidence) in enumerate(zip(ids, skin_types, confidences)):
+                    values = {
+                        'id': analysis_id,
+                        'skin_type': skin_type,
+                        'confidence': confidence,
+                        'recommendations': '',
+                        'recommendation_ids': encode_ids(analyzer.get_recommendations(skin_type, confidence)),
+                        'model_version': target_version,
+                        'provisional': False,
+                    }
+                    if embeddings is not None:
+                        values['embedding'] = encode_embedding(embeddings[i])
+                    updates.append(values)
+                state['updated'] += len(ids)
+
+            # By rows scanned, not updated, so a long run of missing files still advances the checkpoint
+            if done - checkpointed['done'] >= flush_every or time.perf_counter() - checkpointed['at'] >= checkpoint_seconds:
+                flush()
+        flush()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    # Skin types changed underneath the per-day aggregates
+    rebuild_daily_stats()
+    db.session.commit()
+    if state['updated']:
+        click.echo("↻ Embeddings changed; rebuilding the similarity index")
+        _build_embedding_index(rebuild=True, versions=[target_version])
+    click.echo(f"✓ Re-analysis complete: {state['updated']:,} updated, {state['missing']:,} missing files")
+    archived = db.session.query(func.coalesce(func.sum(ArchivePartition.row_count), 0)).scalar()
+    if archived:
+        click.echo(f"⚠ {archived:,} archived analyses were not re-scored and keep their earlier results")
+
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats_command():
+    """Recompute the per-user daily aggregates behind /api/analysis/stats."""
+    rebuild_daily_stats()
+    db.session.commit()
+    click.echo("✓ Daily analysis stats rebuilt")
+
+
+def _build_embedding_index(rebuild, versions=None):
+    """One snapshot per model version; embeddings of different networks are never mixed"""
+    for version in versions or embedded_versions():
+        path = snapshot_path(version)
+        if rebuild or not os.path.exists(path):
+            index = new_index(version)
+        else:
+            index = IVFIndex.load(path)
+        started = time.perf_counter()
+        added = sync_from_db(index, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        index.save(path)
+        click.echo(f"✓ Embedding index {version}: {len(index):,} vectors ({added:,} added in "
+                   f"{time.perf_counter() - started:.1f}s, {'IVF' if index.trained else 'flat'}) -> {path}")
+
+
+@click.command('embedding-index')
+@click.option('--rebuild', is_flag=True, help='Start from scratch instead of the last snapshot')
+@click.option('--version', 'versions', multiple=True, help='Model version to index (default: every version with embeddings)')
+@with_appcontext
+def embedding_index_command(rebuild, versions):
+    """Bring the similar-analysis indexes up to date and snapshot them to disk."""
+    _build_embedding_index(rebuild, list(versions) or None)
+
+
+@click.command('storage-compact')
+@click.option('--transcode-after-days', type=int, default=None,
+              help=f'Transcode originals whose newest analysis is older than this [default: {Config.STORAGE_TRANSCODE_AFTER_DAYS}]')
+@click.option('--orphan-grace-hours', type=float, default=None,
+              help=f'Keep unreferenced files younger than this [default: {Config.STORAGE_ORPHAN_GRACE_HOURS:g}]')
+@click.option('--dry-run', is_flag=True, help='Report what would be reclaimed without changing anything')
+@with_appcontext
+def storage_compact_command(transcode_after_days, orphan_grace_hours, dry_run):
+    """Transcode old uploads, delete orphaned files and report the bytes reclaimed."""
+    started = time.perf_counter()
+    report = compact(transcode_after_days, orphan_grace_hours, dry_run, log=click.echo)
+    click.echo(f"✓ Storage compaction in {time.perf_counter() - started:.1f}s: {format_report(report)}")
+
+
+@click.command('archive')
+@click.option('--older-than-days', type=int, default=None,
+              help=f'Archive analyses older than this [default: {Config.ARCHIVE_AFTER_DAYS}]')
+@click.option('--batch-size', type=int, default=None,
+              help=f'Rows moved per transaction [default: {Config.ARCHIVE_BATCH_SIZE}]')
+@click.option('--vacuum', is_flag=True, help='VACUUM the main database afterwards (locks it while it runs)')
+@with_appcontext
+def archive_command(older_than_days, batch_size, vacuum):
+    """Move old analyses into monthly archive databases."""
+    handle = try_lock(os.path.join(current_app.instance_path, 'archiver.lock'))
+    if handle is None:
+        raise click.ClickException('Another archival run is in progress')
+    try:
+        started = time.perf_counter()
+        report = archive.run_archival(older_than_days, batch_size, log=click.echo)
+        click.echo(f"✓ Archival in {time.perf_counter() - started:.1f}s: {archive.format_report(report)}")
+    finally:
+        handle.close()
+    if vacuum and report['archived']:
+        db.session.execute(db.text('VACUUM'))
+        click.echo("✓ Main database vacuumed")
@@ -16,10 +16,118 @@ from datetime import timedelta
 
 class Config:
     SECRET_KEY = 'lumera-super-secret-key-12345'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///lumera.db'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///lumera.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     JWT_SECRET_KEY = 'lumera-super-secret-key-12345'  # MUST match SECRET_KEY
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
\ No newline at end of file
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+
+    # Production serving (see serve.py)
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 0))  # 0 = derive from CPU cores
+    ANALYSIS_THREADS = int(os.environ.get('ANALYSIS_THREADS', 0))  # 0 = cores / workers
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', '0') == '1'  # only behind nginx/apache
+
+    # Model registry (see services/model_registry.py)
+    MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR') or 'ml_model/registry'
+    MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', 5))  # seconds, 0 disables
+    ADMIN_EMAILS = {e.strip() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()}
+
+    # Shadow inference (see services/shadow.py)
+    SHADOW_MODEL_VERSIONS = [v.strip() for v in os.environ.get('SHADOW_MODEL_VERSIONS', '').split(',') if v.strip()]
+    SHADOW_SAMPLE_RATE = float(os.environ.get('SHADOW_SAMPLE_RATE', 0.1))
+
+    # Test-time augmentation: 'off', 'adaptive' (only below the threshold) or 'always'
+    TTA_MODE = os.environ.get('TTA_MODE', 'adaptive')
+    TTA_CONFIDENCE_THRESHOLD = float(os.environ.get('TTA_CONFIDENCE_THRESHOLD', 60))  # percent
+    TTA_VARIANTS = min(max(int(os.environ.get('TTA_VARIANTS', 8)), 0), 9)  # 9 distinct variants exist; 0 disables TTA
+
+    # Recommendations (see services/recommendations.py)
+    RECOMMENDATION_LIMIT = int(os.environ.get('RECOMMENDATION_LIMIT', 3))
+
+    # Response serialization (see utils/serialization.py)
+    JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')  # 'auto' uses orjson when installed, or 'stdlib'
+    COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 5))
+
+    # Near-duplicate uploads (see services/duplicates.py)
+    PHASH_DUPLICATE_POLICY = os.environ.get('PHASH_DUPLICATE_POLICY', 'reuse')  # 'reuse', 'warn' or 'off'
+    PHASH_MAX_DISTANCE = int(os.environ.get('PHASH_MAX_DISTANCE', 10))  # differing bits out of 64
+    PHASH_LOOKBACK_DAYS = int(os.environ.get('PHASH_LOOKBACK_DAYS', 7))
+    PHASH_CACHE_USERS = int(os.environ.get('PHASH_CACHE_USERS', 10000))
+
+    # Similar-case retrieval (see services/embedding_index.py)
+    EMBEDDING_DIM = 128
+    EMBEDDING_NLIST = int(os.environ.get('EMBEDDING_NLIST', 256))
+    EMBEDDING_NPROBE = int(os.environ.get('EMBEDDING_NPROBE', 8))
+    EMBEDDING_INDEX_PATH = os.environ.get('EMBEDDING_INDEX_PATH') or 'instance/embedding_index.npz'
+    EMBEDDING_SYNC_SECONDS = float(os.environ.get('EMBEDDING_SYNC_SECONDS', 10))  # how stale the in-process index may get
+    SIMILAR_NEIGHBOURHOOD = int(os.environ.get('SIMILAR_NEIGHBOURHOOD', 50))  # nearest analyses, all users, summarised by skin type
+    SIMILAR_MIN_NEIGHBOURHOOD = int(os.environ.get('SIMILAR_MIN_NEIGHBOURHOOD', 20))  # fewer pooled than this: no summary
+
+    # Pre-allocated model input tensors (see services/buffer_pool.py)
+    TENSOR_POOL_SLOTS = int(os.environ.get('TENSOR_POOL_SLOTS', 8))  # per worker process
+    TENSOR_POOL_SHARED = os.environ.get('TENSOR_POOL_SHARED', '1') == '1'  # one shared-memory pool for all prod workers
+    MODEL_INPUT_SIZE = int(os.environ.get('MODEL_INPUT_SIZE', 224))  # shape the shared pool is created for
+
+    # Upload storage lifecycle (see services/storage.py)
+    STORAGE_TRANSCODE_AFTER_DAYS = int(os.environ.get('STORAGE_TRANSCODE_AFTER_DAYS', 30))
+    STORAGE_TRANSCODE_FORMAT = os.environ.get('STORAGE_TRANSCODE_FORMAT', 'webp')  # webp (falls back to jpeg) | jpeg
+    STORAGE_TRANSCODE_QUALITY = int(os.environ.get('STORAGE_TRANSCODE_QUALITY', 80))
+    STORAGE_TRANSCODE_MAX_SIDE = int(os.environ.get('STORAGE_TRANSCODE_MAX_SIDE', 1600))  # px, longest side
+    STORAGE_ORPHAN_GRACE_HOURS = float(os.environ.get('STORAGE_ORPHAN_GRACE_HOURS', 24))
+    STORAGE_COMPACT_INTERVAL_HOURS = float(os.environ.get('STORAGE_COMPACT_INTERVAL_HOURS', 24))  # 0 disables
+
+    # Two-stage inference: a low-resolution fast model answers when confident
+    INFERENCE_MODE = os.environ.get('INFERENCE_MODE', 'adaptive')  # adaptive | full
+    EARLY_EXIT_CONFIDENCE = float(os.environ.get('EARLY_EXIT_CONFIDENCE', 0))  # %, 0 = threshold calibrated at training
+
+    # Thread budget per worker process (see services/runtime.py)
+    TF_INTRA_OP_THREADS = int(os.environ.get('TF_INTRA_OP_THREADS', 0))  # 0 = this worker's share of cores
+    TF_INTER_OP_THREADS = int(os.environ.get('TF_INTER_OP_THREADS', 0))  # 0 = 1
+    OPENCV_THREADS = int(os.environ.get('OPENCV_THREADS', 1))
+    PIN_WORKER_CORES = os.environ.get('PIN_WORKER_CORES', '0') == '1'  # give each prod worker its own cores
+
+    # Compiled inference graphs (see services/compiled_model.py)
+    INFERENCE_COMPILED = os.environ.get('INFERENCE_COMPILED', '1') == '1'  # 0 = plain model.predict
+    INFERENCE_BUCKETS = tuple(int(b) for b in os.environ.get('INFERENCE_BUCKETS', '1,4,8,32').split(','))
+    INFERENCE_XLA = os.environ.get('INFERENCE_XLA', 'auto')  # auto | on | off
+
+    # Two-phase uploads: preview first, original in chunks (see services/storage.py)
+    UPLOAD_CHUNK_BYTES = int(os.environ.get('UPLOAD_CHUNK_BYTES', 1024 * 1024))  # size suggested to clients
+    UPLOAD_CHUNK_MAX_BYTES = int(os.environ.get('UPLOAD_CHUNK_MAX_BYTES', 8 * 1024 * 1024))
+
+    # Video clip / burst analysis (see services/frames.py)
+    VIDEO_EXTENSIONS = {'mp4', 'mov', 'webm', 'avi', 'm4v'}
+    VIDEO_SAMPLE_FPS = float(os.environ.get('VIDEO_SAMPLE_FPS', 4))  # frames looked at per second of video
+    VIDEO_MAX_SECONDS = float(os.environ.get('VIDEO_MAX_SECONDS', 15))
+    BURST_MAX_UPLOADS = int(os.environ.get('BURST_MAX_UPLOADS', 32))
+    FRAME_MAX_SELECTED = int(os.environ.get('FRAME_MAX_SELECTED', 16))
+    FRAME_BATCH_SIZE = int(os.environ.get('FRAME_BATCH_SIZE', 8))
+    FRAME_MIN_SHARPNESS = float(os.environ.get('FRAME_MIN_SHARPNESS', 50))  # Laplacian variance at 256px wide
+    FRAME_MIN_MOTION = float(os.environ.get('FRAME_MIN_MOTION', 3))  # mean abs difference (0-255) on a 32x32 thumbnail
+
+    # Archival of old analyses into monthly databases (see services/archive.py)
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 180))
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR') or 'instance/archive'
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))  # rows per short delete transaction
+    ARCHIVE_BATCH_PAUSE = float(os.environ.get('ARCHIVE_BATCH_PAUSE', 0.05))  # seconds between batches
+    ARCHIVE_INTERVAL_HOURS = float(os.environ.get('ARCHIVE_INTERVAL_HOURS', 24))  # 0 disables the background job
+
+    # Streaming history export (see services/export.py)
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))  # rows read and flushed at a time
+    EXPORT_URL_MAX_AGE = int(os.environ.get('EXPORT_URL_MAX_AGE', 7 * 24 * 3600))  # seconds signed image URLs stay valid
+
+    # Graceful degradation under overload (see services/degradation.py)
+    DEGRADE_ENABLED = os.environ.get('DEGRADE_ENABLED', '1') == '1'
+    DEGRADE_QUEUE_HIGH = int(os.environ.get('DEGRADE_QUEUE_HIGH', 0))  # analyses in flight; 0 = 2 x analysis threads
+    DEGRADE_QUEUE_LOW = int(os.environ.get('DEGRADE_QUEUE_LOW', 0))  # 0 = analysis threads
+    DEGRADE_LATENCY_SLO_MS = float(os.environ.get('DEGRADE_LATENCY_SLO_MS', 2000))  # p95, queue wait included
+    DEGRADE_RECOVER_RATIO = float(os.environ.get('DEGRADE_RECOVER_RATIO', 0.7))  # p95 must drop below SLO x this
+    DEGRADE_WINDOW_SECONDS = float(os.environ.get('DEGRADE_WINDOW_SECONDS', 30))
+    DEGRADE_MIN_SAMPLES = int(os.environ.get('DEGRADE_MIN_SAMPLES', 10))
+    DEGRADE_MIN_DWELL_SECONDS = float(os.environ.get('DEGRADE_MIN_DWELL_SECONDS', 15))
+    DEGRADE_FAST_THREADS = int(os.environ.get('DEGRADE_FAST_THREADS', 2))  # threads for the rule-based path, apart from the model's
+    RESCORE_INTERVAL_SECONDS = float(os.environ.get('RESCORE_INTERVAL_SECONDS', 30))  # 0 disables re-scoring
+    RESCORE_BATCH_SIZE = int(os.environ.get('RESCORE_BATCH_SIZE', 16))
\ No newline at end of file
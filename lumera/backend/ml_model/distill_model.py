@@ -0,0 +1,243 @@
+"""
+Knowledge distillation of the skin type classifier into a compact student
+
+    python ml_model/distill_model.py [--teacher v20250101120000] [--img-size 160] [--activate]
+
+The teacher is the production MobileNetV2 model (CURRENT registry version,
+or the legacy skin_type_model.h5). The student is a small separable-conv
+network. It is trained on the teacher's temperature-softened predictions
+for the same augmented batches from training_data, mixed with the hard
+labels. It keeps the Dense(128) -> Dense(5) softmax head, so the analyzer
+loads it like any other version and stores embeddings for it. Those live in
+a separate space from the teacher's: similarity search covers the student's
+own analyses, and older ones join it once `flask reanalyze` re-scores them.
+
+The student is saved as ml_model/skin_type_model_student.h5 and published
+to the registry (not activated unless --activate is given). Its manifest
+records validation accuracy, agreement with the teacher and single-core
+throughput for both models.
+"""
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+from keras import ops
+from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
+import numpy as np
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services import model_registry
+from ml_model.train_kaggle_model import build_generators
+
+
+def build_student(img_size=160, num_classes=5, width=32):
+    """
+    Depthwise-separable conv stack with the same Dense(128) -> Dense(classes)
+    head as the teacher. Returns (student, logits_model): they share weights,
+    the first ends in softmax for serving and the second is trained.
+    """
+    inputs = keras.Input(shape=(img_size, img_size, 3))
+    x = layers.Conv2D(width, 3, strides=2, padding='same', use_bias=False)(inputs)
+    x = layers.BatchNormalization()(x)
+    x = layers.ReLU(6.0)(x)
+    for filters, strides in [(width * 2, 2), (width * 4, 2), (width * 4, 1), (width * 8, 2), (width * 8, 2)]:
+        x = layers.SeparableConv2D(filters, 3, strides=strides, padding='same', use_bias=False)(x)
+        x = layers.BatchNormalization()(x)
+        x = layers.ReLU(6.0)(x)
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dropout(0.3)(x)
+    x = layers.Dense(128, activation='relu', name='embedding')(x)
+    logits = layers.Dense(num_classes, name='logits')(x)
+    probabilities = layers.Activation('softmax', name='probabilities')(logits)
+    return keras.Model(inputs, probabilities, name='student'), keras.Model(inputs, logits, name='student_logits')
+
+
+class Distiller(keras.Model):
+    """
+    Trains `student` (logits) against hard labels and the teacher's softened
+    distribution. The loss is (1 - soft_weight) * CE(y, student) +
+    soft_weight * T^2 * KL(teacher_T || student_T). Inputs arrive at the
+    teacher's resolution and are resized for the student when the two differ.
+    """
+
+    def __init__(self, student_logits, teacher, temperature=4.0, soft_weight=0.9):
+        super().__init__()
+        self.student_logits = student_logits
+        self.teacher = teacher
+        self.temperature = temperature
+        self.soft_weight = soft_weight
+        self.student_size = tuple(student_logits.input_shape[1:3])
+        self.hard_loss = keras.losses.CategoricalCrossentropy(from_logits=True)
+        self.soft_loss = keras.losses.KLDivergence()
+
+    def call(self, x, training=False):
+        if tuple(x.shape[1:3]) != self.student_size:
+            x = ops.image.resize(x, self.student_size)
+        return self.student_logits(x, training=training)
+
+    def compute_loss(self, x=None, y=None, y_pred=None, sample_weight=None, allow_empty=False):
+        # The teacher ends in softmax; its log-probabilities act as logits
+        teacher_logits = ops.log(self.teacher(x, training=False) + 1e-7)
+        t = self.temperature
+        soft = self.soft_loss(
+            ops.softmax(teacher_logits / t, axis=1),
+            ops.softmax(y_pred / t, axis=1)
+        ) * (t * t)
+        hard = self.hard_loss(y, y_pred)
+        return (1 - self.soft_weight) * hard + self.soft_weight * soft + ops.sum(self.student_logits.losses)
+
+
+def _throughput_worker(model_path, batch_size, seconds, results):
+    # Runs in a fresh process so TensorFlow can be limited to one thread and one core
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    model = keras.models.load_model(model_path)
+    height, width = model.input_shape[1:3]
+    batch = np.random.rand(batch_size, height, width, 3).astype(np.float32)
+    model.predict(batch, verbose=0)
+    images = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        model.predict(batch, verbose=0, batch_size=batch_size)
+        images += batch_size
+    results.put(images / (time.perf_counter() - start))
+
+
+def images_per_sec_per_core(model_path, batch_size=32, seconds=10):
+    """Steady-state predict throughput of one single-threaded process pinned to one core"""
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    process = ctx.Process(target=_throughput_worker, args=(model_path, batch_size, seconds, results))
+    process.start()
+    value = results.get()
+    process.join()
+    return float(value)
+
+
+def compare_with_teacher(student, teacher, val_generator):
+    """Validation accuracy of both models and how often the student agrees with the teacher"""
+    student_size = tuple(student.input_shape[1:3])
+    labels, teacher_pred, student_pred = [], [], []
+    for i in range(len(val_generator)):
+        x, y = val_generator[i]
+        labels.append(y.argmax(axis=1))
+        teacher_pred.append(teacher.predict(x, verbose=0).argmax(axis=1))
+        if tuple(x.shape[1:3]) != student_size:
+            x = tf.image.resize(x, student_size).numpy()
+        student_pred.append(student.predict(x, verbose=0).argmax(axis=1))
+    labels, teacher_pred, student_pred = (np.concatenate(a) for a in (labels, teacher_pred, student_pred))
+    return {
+        'teacher_val_accuracy': round(float((teacher_pred == labels).mean()), 4),
+        'val_accuracy': round(float((student_pred == labels).mean()), 4),
+        'teacher_agreement': round(float((student_pred == teacher_pred).mean()), 4),
+    }
+
+
+def distill_with_kaggle_dataset(teacher_version=None, img_size=160, temperature=4.0, soft_weight=0.9,
+                                epochs=60, activate=False):
+    """
+    Distill the serving model into a compact student, publish it and return
+    (student, version, report)
+    """
+    print("=" * 60)
+    print("🎓 DISTILLING SKIN TYPE CLASSIFIER")
+    print(f"   Student input: {img_size}x{img_size}, T={temperature}, soft weight {soft_weight}")
+    print("=" * 60)
+
+    BATCH_SIZE = 32
+    DATA_DIR = 'training_data'
+    MODEL_DIR = 'ml_model'
+
+    teacher_version = teacher_version or model_registry.current_version()
+    if teacher_version:
+        teacher_path = model_registry.read_manifest(teacher_version)['artifact_path']
+    else:
+        teacher_path = os.path.join(MODEL_DIR, 'skin_type_model.h5')
+    teacher = keras.models.load_model(teacher_path)
+    teacher.trainable = False
+    teacher_size = teacher.input_shape[1]
+    print(f"✓ Teacher: {teacher_version or 'legacy'} ({teacher.count_params():,} parameters)")
+
+    # Batches come at the teacher's resolution; the distiller resizes them for the student
+    print("\n📁 Loading dataset...")
+    train_generator, val_generator = build_generators(DATA_DIR, teacher_size, teacher_size, BATCH_SIZE)
+
+    student, student_logits = build_student(img_size, train_generator.num_classes)
+    print(f"✓ Student: {student.count_params():,} parameters")
+
+    distiller = Distiller(student_logits, teacher, temperature, soft_weight)
+    distiller.compile(
+        optimizer=keras.optimizers.Adam(learning_rate=0.002),
+        metrics=[keras.metrics.CategoricalAccuracy(name='accuracy')]
+    )
+
+    early_stop = EarlyStopping(monitor='val_accuracy', mode='max', patience=12, restore_best_weights=True, verbose=1)
+    reduce_lr = ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=5, min_lr=1e-6, verbose=1)
+
+    print(f"\n🚀 Distilling for up to {epochs} epochs...")
+    distiller.fit(
+        train_generator,
+        epochs=epochs,
+        validation_data=val_generator,
+        callbacks=[early_stop, reduce_lr],
+        verbose=1
+    )
+
+    print("\n📊 Comparing with the teacher...")
+    report = compare_with_teacher(student, teacher, val_generator)
+
+    student_path = os.path.join(MODEL_DIR, 'skin_type_model_student.h5')
+    student.save(student_path)
+    print(f"✓ Student saved to {student_path}")
+
+    print("\n⏱️ Measuring single-core throughput...")
+    report['images_per_sec_per_core'] = round(images_per_sec_per_core(student_path), 1)
+    report['teacher_images_per_sec_per_core'] = round(images_per_sec_per_core(teacher_path), 1)
+    report.update({
+        'distilled_from': teacher_version or 'legacy',
+        'parameters': int(student.count_params()),
+        'teacher_parameters': int(teacher.count_params()),
+        'temperature': temperature,
+        'soft_weight': soft_weight,
+    })
+
+    print(f"✓ Validation accuracy: student {report['val_accuracy'] * 100:.2f}%, "
+          f"teacher {report['teacher_val_accuracy'] * 100:.2f}%")
+    print(f"✓ Agreement with teacher: {report['teacher_agreement'] * 100:.2f}%")
+    print(f"✓ Throughput per core: student {report['images_per_sec_per_core']:.1f} img/s, "
+          f"teacher {report['teacher_images_per_sec_per_core']:.1f} img/s "
+          f"({report['images_per_sec_per_core'] / max(report['teacher_images_per_sec_per_core'], 1e-9):.1f}x)")
+
+    version = model_registry.publish(
+        student_path,
+        os.path.join(MODEL_DIR, 'class_indices.json'),
+        activate_now=activate,
+        extra=report
+    )
+    print(f"✓ Published as {version}" + (" (active)" if activate else
+          f" (compare live with SHADOW_MODEL_VERSIONS={version}, then activate)"))
+
+    with open(os.path.join(MODEL_DIR, 'distillation_report.json'), 'w') as f:
+        json.dump(dict(report, version=version), f, indent=2)
+    return student, version, report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Distill the serving model into a compact student')
+    parser.add_argument('--teacher', help='registry version to distill (default: CURRENT, else the legacy model)')
+    parser.add_argument('--img-size', type=int, default=160)
+    parser.add_argument('--temperature', type=float, default=4.0)
+    parser.add_argument('--soft-weight', type=float, default=0.9, help='weight of the teacher term vs hard labels')
+    parser.add_argument('--epochs', type=int, default=60)
+    parser.add_argument('--activate', action='store_true')
+    args = parser.parse_args()
+
+    distill_with_kaggle_dataset(args.teacher, args.img_size, args.temperature, args.soft_weight,
+                                args.epochs, args.activate)
@@ -0,0 +1,420 @@
+"""
+Multi-worker data-parallel training on CPU
+
+    python ml_model/distributed_train.py launch --workers 4 [--pin] [--no-publish]
+    python ml_model/distributed_train.py scale --workers 1,2,4 [--epochs 3]
+
+`launch` starts N local worker processes, each with a TF_CONFIG naming the
+whole cluster, and waits for them. To train across several machines, set
+TF_CONFIG on each box yourself and run `distributed_train.py worker` there;
+every worker must see training_data at the same relative path.
+
+Workers train the same model as train_kaggle_model.py under
+MultiWorkerMirroredStrategy. Gradients are all-reduced every step, so the
+global batch is batch_size x workers. Each worker reads only its own shard of
+training_data: the file list (with the same 80/20 split as build_generators)
+is sharded before any image is decoded.
+
+Checkpoints: worker 0 writes the same best_model.keras as single-process
+training, with the same ModelCheckpoint callback and monitor. Other workers
+write theirs under their work directory. Every worker also keeps a
+BackupAndRestore checkpoint per phase, plus the weights at the end of phase
+1. Re-running the same command after a crash resumes from the last
+completed epoch.
+
+`scale` trains a few epochs at each worker count on this host, with the
+cores split evenly between workers. It saves images/sec and scaling
+efficiency (throughput / (workers x single-worker throughput)) to
+ml_model/scaling_report.json and ml_model/scaling_efficiency.png.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from utils.helpers import available_cores
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm', '.tif', '.tiff')
+
+
+def split_files(data_dir, validation_split=0.2):
+    """
+    (class_names, train, val) as lists of (path, class index). As with
+    flow_from_directory's validation_split, the first 20% of each class's
+    sorted files are validation.
+    """
+    class_names = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    train, val = [], []
+    for index, name in enumerate(class_names):
+        class_dir = os.path.join(data_dir, name)
+        files = sorted(
+            os.path.join(root, f)
+            for root, _, names in os.walk(class_dir)
+            for f in names if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        cut = int(validation_split * len(files))
+        val += [(path, index) for path in files[:cut]]
+        train += [(path, index) for path in files[cut:]]
+    return class_names, train, val
+
+
+def make_dataset_fn(samples, num_classes, img_size, global_batch, training):
+    """dataset_fn for distribute_datasets_from_function: each input pipeline reads its own shard"""
+    import tensorflow as tf
+    from tensorflow.keras import layers
+
+    paths = [path for path, _ in samples]
+    labels = [label for _, label in samples]
+    # Same augmentations as build_generators, as preprocessing layers
+    augment = tf.keras.Sequential([
+        layers.RandomRotation(25 / 360, fill_mode='nearest'),
+        layers.RandomTranslation(0.25, 0.25, fill_mode='nearest'),
+        layers.RandomZoom(0.25, fill_mode='nearest'),
+        layers.RandomFlip('horizontal'),
+        layers.RandomBrightness((-0.3, 0.3), value_range=(0, 1)),
+    ]) if training else None
+
+    def load(path, label):
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        image = tf.image.resize(image, (img_size, img_size)) / 255.0
+        return image, tf.one_hot(label, num_classes)
+
+    def dataset_fn(input_context):
+        ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+        ds = ds.shard(input_context.num_input_pipelines, input_context.input_pipeline_id)
+        if training:
+            ds = ds.shuffle(len(paths), seed=input_context.input_pipeline_id, reshuffle_each_iteration=True)
+        ds = ds.map(load, num_parallel_calls=tf.data.AUTOTUNE)
+        if training:
+            ds = ds.map(lambda x, y: (augment(x, training=True), y), num_parallel_calls=tf.data.AUTOTUNE)
+        # Repeat so every worker runs the same number of steps whatever its shard size
+        return ds.repeat().batch(input_context.get_per_replica_batch_size(global_batch)).prefetch(tf.data.AUTOTUNE)
+
+    return dataset_fn
+
+
+def throughput_callback(global_batch):
+    """Records training images/sec for each epoch, excluding validation"""
+    from tensorflow import keras
+
+    class Throughput(keras.callbacks.Callback):
+        def __init__(self):
+            super().__init__()
+            self.images_per_sec = []
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self.started = time.perf_counter()
+            self.last_batch = None
+            self.steps = 0
+
+        def on_train_batch_end(self, batch, logs=None):
+            self.last_batch = time.perf_counter()
+            self.steps += 1
+
+        def on_epoch_end(self, epoch, logs=None):
+            if self.last_batch is not None:
+                self.images_per_sec.append(self.steps * global_batch / (self.last_batch - self.started))
+
+    return Throughput()
+
+
+def run_worker(args):
+    """One member of the cluster described by TF_CONFIG"""
+    tf_config = json.loads(os.environ['TF_CONFIG'])
+    num_workers = len(tf_config['cluster']['worker'])
+    index = tf_config['task']['index']
+    is_chief = index == 0
+
+    from services import runtime
+    if args.pin:
+        runtime.pin_to_cores(runtime.worker_cores(index, num_workers))
+    import tensorflow as tf
+    from tensorflow import keras
+    from services import model_registry
+    from ml_model.train_kaggle_model import DEFAULT_PARAMS, build_model, unfreeze_for_fine_tuning, build_callbacks
+    runtime.configure_tensorflow(tf, {'intra_op': args.threads, 'inter_op': 1, 'opencv': 1})
+
+    # Must exist before any other TensorFlow op runs
+    strategy = tf.distribute.MultiWorkerMirroredStrategy(
+        communication_options=tf.distribute.experimental.CommunicationOptions(
+            implementation=tf.distribute.experimental.CommunicationImplementation.RING
+        )
+    )
+
+    params = dict(DEFAULT_PARAMS, **json.loads(args.params or '{}'))
+    if args.epochs is not None:
+        params['epochs'] = args.epochs
+    if args.fine_tune_epochs is not None:
+        params['fine_tune_epochs'] = args.fine_tune_epochs
+    global_batch = params['batch_size'] * num_workers
+    work_dir = os.path.join(args.model_dir, 'distributed', f'worker_{index}')
+    os.makedirs(work_dir, exist_ok=True)
+
+    class_names, train, val = split_files(args.data_dir)
+    num_classes = len(class_names)
+    if is_chief:
+        print(f"✓ {num_workers} workers, {args.threads} threads each, global batch {global_batch}")
+        print(f"✓ Training samples: {len(train)}, validation samples: {len(val)}, classes: {class_names}")
+    train_ds = strategy.distribute_datasets_from_function(
+        make_dataset_fn(train, num_classes, args.img_size, global_batch, training=True))
+    val_ds = strategy.distribute_datasets_from_function(
+        make_dataset_fn(val, num_classes, args.img_size, global_batch, training=False))
+    steps_per_epoch = max(1, len(train) // global_batch)
+    validation_steps = max(1, -(-len(val) // global_batch))
+
+    with strategy.scope():
+        model, base_model = build_model(args.img_size, args.img_size, args.alpha, params, num_classes)
+
+    # Worker 0 owns the usual best_model.keras; the others write theirs locally
+    checkpoint_dir = args.model_dir if is_chief else work_dir
+    callbacks = build_callbacks(os.path.join(checkpoint_dir, 'best_model.keras'), params)
+    throughput = throughput_callback(global_batch)
+
+    def fit_phase(phase, epochs):
+        """Run one phase, or load its final weights if an earlier run already finished it"""
+        done = os.path.join(work_dir, f'{phase}.weights.h5')
+        if os.path.exists(done):
+            model.load_weights(done)
+            if is_chief:
+                print(f"↻ {phase} already complete, loaded its weights")
+            return
+        backup = keras.callbacks.BackupAndRestore(os.path.join(work_dir, f'backup_{phase}'))
+        model.fit(
+            train_ds,
+            epochs=epochs,
+            steps_per_epoch=steps_per_epoch,
+            validation_data=val_ds,
+            validation_steps=validation_steps,
+            callbacks=[backup, *callbacks, throughput],
+            verbose=1 if is_chief else 0
+        )
+        model.save_weights(done)
+
+    if is_chief:
+        print(f"\n🚀 Training for {params['epochs']} epochs...")
+    fit_phase('phase1', params['epochs'])
+    if params['fine_tune_epochs'] > 0:
+        if is_chief:
+            print("\n🔧 Fine-tuning...")
+        with strategy.scope():
+            unfreeze_for_fine_tuning(model, base_model, params)
+        fit_phase('phase2', params['fine_tune_epochs'])
+
+    # Collective: every worker evaluates, worker 0 reports
+    results = model.evaluate(val_ds, steps=validation_steps, verbose=0)
+    # The first epoch includes graph building; leave it out when there are others
+    measured = throughput.images_per_sec[1:] or throughput.images_per_sec
+    report = {
+        'workers': num_workers,
+        'threads_per_worker': args.threads,
+        'global_batch': global_batch,
+        'images_per_sec': round(sorted(measured)[len(measured) // 2], 1) if measured else None,
+        'val_loss': float(results[0]),
+        'val_accuracy': float(results[1]),
+    }
+    if not is_chief:
+        return report
+
+    print(f"✓ Validation Loss: {results[0]:.4f}")
+    print(f"✓ Validation Accuracy: {results[1]:.4f}")
+    if report['images_per_sec']:
+        print(f"✓ Throughput: {report['images_per_sec']:.1f} images/sec")
+
+    if args.save:
+        model_path = os.path.join(args.model_dir, f'{args.model_name}.h5')
+        model.save(model_path)
+        class_indices_path = os.path.join(args.model_dir, 'class_indices.json')
+        with open(class_indices_path, 'w') as f:
+            json.dump({name: i for i, name in enumerate(class_names)}, f)
+        print(f"✓ Model saved to {model_path}")
+        if args.publish:
+            version = model_registry.publish(model_path, class_indices_path, extra={
+                'val_accuracy': report['val_accuracy'],
+                'val_loss': report['val_loss'],
+                'workers': num_workers,
+            })
+            print(f"✓ Published as {version} (activate with: python -m services.model_registry activate {version})")
+    # Phase markers and backups have done their job once the run is complete
+    shutil.rmtree(os.path.join(args.model_dir, 'distributed'), ignore_errors=True)
+    os.makedirs(os.path.join(args.model_dir, 'distributed'), exist_ok=True)
+    with open(os.path.join(args.model_dir, 'distributed', 'throughput.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def free_ports(count):
+    sockets = [socket.socket() for _ in range(count)]
+    for s in sockets:
+        s.bind(('localhost', 0))
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def prefetch_weights(img_size, alpha):
+    """Download the ImageNet weights once, so the workers do not race to write the cache"""
+    from tensorflow.keras.applications import MobileNetV2
+    MobileNetV2(input_shape=(img_size, img_size, 3), alpha=alpha, include_top=False, weights='imagenet')
+
+
+def launch(num_workers, worker_args, model_dir, threads=None):
+    """Run a local cluster of num_workers processes; returns worker 0's throughput report"""
+    threads = threads or max(1, available_cores() // num_workers)
+    cluster = {'worker': [f'localhost:{port}' for port in free_ports(num_workers)]}
+    logs_dir = os.path.join(model_dir, 'distributed_logs')
+    os.makedirs(logs_dir, exist_ok=True)
+    print(f"🚀 Starting {num_workers} workers x {threads} threads (logs: {logs_dir})")
+
+    processes, logs = [], []
+    for index in range(num_workers):
+        env = dict(os.environ, TF_CONFIG=json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': index}}))
+        for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+            env[name] = str(threads)
+        log = None if index == 0 else open(os.path.join(logs_dir, f'worker_{index}.log'), 'w')
+        logs.append(log)
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'worker', '--threads', str(threads),
+             '--model-dir', model_dir, *worker_args],
+            env=env, stdout=log, stderr=subprocess.STDOUT if log else None
+        ))
+
+    # One failed worker blocks the collectives of the others; stop them all
+    while True:
+        codes = [p.poll() for p in processes]
+        failed = next((i for i, code in enumerate(codes) if code not in (None, 0)), None)
+        if failed is not None or all(code == 0 for code in codes):
+            break
+        time.sleep(1)
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+        process.wait()
+    for log in logs:
+        if log is not None:
+            log.close()
+    if failed is not None:
+        sys.exit(f"❌ Worker {failed} exited with code {processes[failed].returncode}; "
+                 f"re-run the same command to resume")
+
+    with open(os.path.join(model_dir, 'distributed', 'throughput.json')) as f:
+        return json.load(f)
+
+
+def scale(worker_counts, worker_args, model_dir, report_path, chart_path):
+    """Short runs at each worker count on this host, then images/sec and efficiency vs workers"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    results = []
+    for count in worker_counts:
+        run_dir = os.path.join(model_dir, 'scaling', f'workers_{count}')
+        shutil.rmtree(run_dir, ignore_errors=True)
+        results.append(launch(count, worker_args, run_dir))
+    base = results[0]['images_per_sec'] / results[0]['workers']
+    for result in results:
+        result['efficiency'] = round(result['images_per_sec'] / (result['workers'] * base), 3)
+
+    print(f"\n{'workers':>7} {'threads':>7} {'img/s':>8} {'speedup':>8} {'efficiency':>10}")
+    for result in results:
+        print(f"{result['workers']:>7} {result['threads_per_worker']:>7} {result['images_per_sec']:>8.1f} "
+              f"{result['images_per_sec'] / results[0]['images_per_sec']:>7.2f}x {result['efficiency'] * 100:>9.1f}%")
+    with open(report_path, 'w') as f:
+        json.dump({'cores': available_cores(), 'runs': results}, f, indent=2)
+
+    workers = [r['workers'] for r in results]
+    plt.figure(figsize=(12, 4))
+    plt.subplot(1, 2, 1)
+    plt.plot(workers, [r['images_per_sec'] for r in results], marker='o')
+    plt.plot(workers, [base * w for w in workers], linestyle='--')
+    plt.title('Training Throughput')
+    plt.xlabel('Workers')
+    plt.ylabel('Images/sec')
+    plt.legend(['Measured', 'Linear'])
+    plt.grid(True)
+    plt.subplot(1, 2, 2)
+    plt.plot(workers, [r['efficiency'] * 100 for r in results], marker='o')
+    plt.title('Scaling Efficiency')
+    plt.xlabel('Workers')
+    plt.ylabel('Efficiency (%)')
+    plt.ylim(0, 110)
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig(chart_path)
+    print(f"✓ Report saved to {report_path}, chart to {chart_path}")
+
+
+def add_training_args(parser):
+    parser.add_argument('--data-dir', default='training_data')
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--alpha', type=float, default=1.0)
+    parser.add_argument('--epochs', type=int, default=None, help='phase 1 epochs (default: DEFAULT_PARAMS)')
+    parser.add_argument('--fine-tune-epochs', type=int, default=None)
+    parser.add_argument('--params', help='JSON object overriding DEFAULT_PARAMS; batch_size is per worker')
+    parser.add_argument('--pin', action='store_true', help='pin each local worker to its own cores')
+
+
+def training_args(args):
+    """Flags passed through from launch/scale to every worker"""
+    forwarded = ['--data-dir', args.data_dir, '--img-size', str(args.img_size), '--alpha', str(args.alpha)]
+    if args.epochs is not None:
+        forwarded += ['--epochs', str(args.epochs)]
+    if args.fine_tune_epochs is not None:
+        forwarded += ['--fine-tune-epochs', str(args.fine_tune_epochs)]
+    if args.params:
+        forwarded += ['--params', args.params]
+    if args.pin:
+        forwarded.append('--pin')
+    return forwarded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-worker training of the skin type classifier')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    launch_parser = sub.add_parser('launch', help='train with N local worker processes')
+    launch_parser.add_argument('--workers', type=int, default=2)
+    launch_parser.add_argument('--threads', type=int, default=None, help='threads per worker (default: cores / workers)')
+    launch_parser.add_argument('--model-dir', default='ml_model')
+    launch_parser.add_argument('--no-publish', action='store_true')
+    add_training_args(launch_parser)
+
+    scale_parser = sub.add_parser('scale', help='measure images/sec against worker count')
+    scale_parser.add_argument('--workers', default='1,2,4', help='worker counts to try')
+    scale_parser.add_argument('--model-dir', default='ml_model')
+    add_training_args(scale_parser)
+    scale_parser.set_defaults(epochs=3, fine_tune_epochs=0)
+
+    worker_parser = sub.add_parser('worker', help='one cluster member (TF_CONFIG must be set)')
+    worker_parser.add_argument('--threads', type=int, default=None)
+    worker_parser.add_argument('--model-dir', default='ml_model')
+    worker_parser.add_argument('--model-name', default='skin_type_model')
+    worker_parser.add_argument('--no-save', dest='save', action='store_false')
+    worker_parser.add_argument('--no-publish', dest='publish', action='store_false')
+    add_training_args(worker_parser)
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        args.threads = args.threads or available_cores()
+        run_worker(args)
+    elif args.command == 'launch':
+        prefetch_weights(args.img_size, args.alpha)
+        worker_args = training_args(args) + (['--no-publish'] if args.no_publish else [])
+        launch(args.workers, worker_args, args.model_dir, args.threads)
+    else:
+        prefetch_weights(args.img_size, args.alpha)
+        counts = sorted(int(c) for c in args.workers.split(','))
+        scale(counts, training_args(args) + ['--no-save'], args.model_dir,
+              os.path.join(args.model_dir, 'scaling_report.json'),
+              os.path.join(args.model_dir, 'scaling_efficiency.png'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Latency saving vs accuracy of two-stage (early-exit) inference
+
+    python ml_model/early_exit_report.py [--version v20250101120000] [--max-accuracy-drop 1.0]
+
+Scores the validation split (the same 20% split the trainer holds out) with
+the full model and the fast model. For each confidence threshold it reports:
+- how often the fast model would answer on its own
+- the accuracy of the combined answers against the full model's accuracy
+- the average per-image latency against always running the full model
+
+Latency is measured with single-image predict calls, the way the API makes
+them. The recommended threshold is the lowest one whose accuracy drop stays
+within --max-accuracy-drop points.
+"""
+from tensorflow import keras
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+import numpy as np
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services import model_registry
+
+DEFAULT_THRESHOLDS = (50, 60, 70, 75, 80, 85, 90, 95, 98)
+
+
+def validation_batches(data_dir, img_size, batch_size=32):
+    datagen = ImageDataGenerator(rescale=1./255, validation_split=0.2)
+    return datagen.flow_from_directory(
+        data_dir,
+        target_size=(img_size, img_size),
+        batch_size=batch_size,
+        class_mode='categorical',
+        subset='validation',
+        shuffle=False
+    )
+
+
+def single_image_latency_ms(model, batches, samples):
+    """Median wall time of predict() on one image, after a warm-up call"""
+    images = np.concatenate([batches[i][0] for i in range(min(len(batches), -(-samples // batches.batch_size)))])
+    images = images[:samples]
+    model.predict(images[:1], verbose=0)
+    timings = []
+    for image in images:
+        start = time.perf_counter()
+        model.predict(image[None], verbose=0)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def early_exit_report(full_model, fast_model, data_dir='training_data', thresholds=DEFAULT_THRESHOLDS,
+                      max_accuracy_drop=1.0, latency_samples=50):
+    full_batches = validation_batches(data_dir, full_model.input_shape[1])
+    fast_batches = validation_batches(data_dir, fast_model.input_shape[1])
+    if full_batches.filenames != fast_batches.filenames:
+        raise ValueError("Validation splits differ between input sizes")
+
+    labels = full_batches.classes
+    full_probs = full_model.predict(full_batches, verbose=0)
+    fast_probs = fast_model.predict(fast_batches, verbose=0)
+    full_pred, fast_pred = full_probs.argmax(axis=1), fast_probs.argmax(axis=1)
+    fast_conf = fast_probs.max(axis=1) * 100
+    full_accuracy = float((full_pred == labels).mean())
+
+    full_ms = single_image_latency_ms(full_model, full_batches, latency_samples)
+    fast_ms = single_image_latency_ms(fast_model, fast_batches, latency_samples)
+
+    rows = []
+    for threshold in thresholds:
+        exits = fast_conf >= threshold
+        combined = np.where(exits, fast_pred, full_pred)
+        # Escalated images pay for both passes
+        avg_ms = fast_ms + (1 - exits.mean()) * full_ms
+        accuracy = float((combined == labels).mean())
+        rows.append({
+            'threshold': threshold,
+            'exit_rate': round(float(exits.mean()), 4),
+            'accuracy': round(accuracy, 4),
+            'accuracy_delta': round((accuracy - full_accuracy) * 100, 2),  # points
+            'avg_latency_ms': round(float(avg_ms), 2),
+            'latency_saving': round(float(1 - avg_ms / full_ms), 4),
+        })
+
+    acceptable = [row for row in rows if row['accuracy_delta'] >= -max_accuracy_drop]
+    recommended = min(acceptable, key=lambda row: row['threshold']) if acceptable else rows[-1]
+    return {
+        'samples': int(len(labels)),
+        'full_accuracy': round(full_accuracy, 4),
+        'fast_accuracy': round(float((fast_pred == labels).mean()), 4),
+        'full_latency_ms': round(full_ms, 2),
+        'fast_latency_ms': round(fast_ms, 2),
+        'max_accuracy_drop': max_accuracy_drop,
+        'thresholds': rows,
+        'recommended_threshold': recommended['threshold'],
+        'recommended': recommended,
+    }
+
+
+def print_report(report):
+    print(f"Validation images: {report['samples']}")
+    print(f"Full model: {report['full_accuracy'] * 100:.2f}% accuracy, {report['full_latency_ms']:.1f} ms/image")
+    print(f"Fast model: {report['fast_accuracy'] * 100:.2f}% accuracy, {report['fast_latency_ms']:.1f} ms/image")
+    print(f"\n{'threshold':>9} {'exit rate':>10} {'accuracy':>9} {'delta':>7} {'avg ms':>8} {'saving':>7}")
+    for row in report['thresholds']:
+        marker = '  <-' if row['threshold'] == report['recommended_threshold'] else ''
+        print(f"{row['threshold']:>8}% {row['exit_rate'] * 100:>9.1f}% {row['accuracy'] * 100:>8.2f}% "
+              f"{row['accuracy_delta']:>+7.2f} {row['avg_latency_ms']:>8.1f} {row['latency_saving'] * 100:>6.1f}%{marker}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report early-exit latency saving vs accuracy delta')
+    parser.add_argument('--version', help='registry version with a fast artifact (default: CURRENT)')
+    parser.add_argument('--data-dir', default='training_data')
+    parser.add_argument('--max-accuracy-drop', type=float, default=1.0)
+    parser.add_argument('--latency-samples', type=int, default=50)
+    parser.add_argument('--output', help='also write the report as JSON')
+    args = parser.parse_args()
+
+    version = args.version or model_registry.current_version()
+    if not version:
+        sys.exit("❌ No registry version given and none is active")
+    manifest = model_registry.read_manifest(version)
+    if 'fast' not in manifest:
+        sys.exit(f"❌ {version} has no fast artifact (train one with train_kaggle_model.py --fast)")
+
+    report = early_exit_report(
+        keras.models.load_model(manifest['artifact_path']),
+        keras.models.load_model(manifest['fast']['artifact_path']),
+        args.data_dir,
+        max_accuracy_drop=args.max_accuracy_drop,
+        latency_samples=args.latency_samples
+    )
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,445 @@
+"""
+Evaluation harness for any model artifact
+
+    python ml_model/evaluate_model.py [--version v20250101120000 | --artifact ml_model/skin_type_model.h5]
+                                      [--data-dir training_data] [--split validation|all] [--plots reports/]
+
+Scores a labelled directory (one sub-folder per class, as used for training)
+and reports:
+- the confusion matrix and per-class precision, recall and F1
+- calibration: accuracy against top-1 confidence in 10 bins, and the ECE
+- latency: per-image decode time, and predict time at several batch sizes
+
+Images are preprocessed the way the API does it, decoded on a thread pool
+while the previous batch is scored. Probabilities are cached per (artifact
+sha256, image sha256) under --cache-dir, so evaluating the same artifact
+again only scores new or changed images.
+
+Before anything is scored, the label mapping is checked: the artifact's
+class_indices must match the data folders and the model's output width, and
+the class names the API would attach must follow the same order. Any
+mismatch exits with an error.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from tensorflow import keras
+import numpy as np
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services import model_registry
+from services.compiled_model import make_predictor
+from services.ml_service import DEFAULT_CLASS_NAMES
+from services.preprocessing import decode_into
+from utils.helpers import available_cores
+
+# The extensions and split rule of ImageDataGenerator.flow_from_directory
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'bmp', 'ppm', 'tif', 'tiff')
+VALIDATION_SPLIT = 0.2
+LATENCY_BATCH_SIZES = (1, 8, 32)
+CALIBRATION_BINS = 10
+
+
+class LabelMappingError(ValueError):
+    pass
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def resolve_artifact(version=None, artifact_path=None):
+    """
+    (artifact_path, artifact_sha256, class_indices, serving class names) for a
+    registry version or a bare artifact file. class_indices is None when a bare
+    file has no class_indices.json next to it.
+    """
+    if artifact_path is None:
+        version = version or model_registry.current_version()
+        if not version:
+            raise LabelMappingError("No registry version given and none is active")
+        manifest = model_registry.read_manifest(version)
+        return (manifest['artifact_path'], manifest.get('sha256') or _sha256(manifest['artifact_path']),
+                manifest['class_indices'], manifest['class_names'])
+
+    # A bare file is served the way SkinAnalyzer serves the legacy model
+    class_indices_path = os.path.join(os.path.dirname(artifact_path), 'class_indices.json')
+    class_indices, class_names = None, list(DEFAULT_CLASS_NAMES)
+    if os.path.exists(class_indices_path):
+        with open(class_indices_path) as f:
+            class_indices = json.load(f)
+        class_names = model_registry.class_names_from_indices(class_indices)
+    return artifact_path, _sha256(artifact_path), class_indices, class_names
+
+
+def data_classes(data_dir):
+    return sorted(name for name in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, name)))
+
+
+def check_label_mapping(class_indices, class_names, folders, num_outputs):
+    """Every inconsistency between the artifact, the data and the serving labels; raises LabelMappingError"""
+    problems = []
+    if class_indices is None:
+        problems.append(f"no class_indices.json next to the artifact; the API would assume {class_names}")
+    else:
+        try:
+            expected_names = model_registry.class_names_from_indices(class_indices)
+        except model_registry.RegistryError as e:
+            expected_names = None
+            problems.append(str(e))
+        if expected_names is not None and class_names != expected_names:
+            problems.append(f"served class names {class_names} do not follow class_indices order {expected_names}")
+        if set(class_indices) != set(folders):
+            problems.append(f"class_indices {sorted(class_indices)} do not match data folders {folders}")
+        if len(class_indices) != num_outputs:
+            problems.append(f"model has {num_outputs} outputs but class_indices lists {len(class_indices)} classes")
+    if problems:
+        raise LabelMappingError('Inconsistent label mapping:\n  - ' + '\n  - '.join(problems))
+
+
+def list_images(data_dir, class_indices, split='validation'):
+    """
+    (paths, labels) in flow_from_directory order. 'validation' is the same
+    first 20% of each class the trainer holds out; 'all' is every image.
+    """
+    paths, labels = [], []
+    for name in sorted(class_indices, key=class_indices.get):
+        class_dir = os.path.join(data_dir, name)
+        files = [
+            os.path.join(root, fname)
+            for root, _, fnames in sorted(os.walk(class_dir), key=lambda walk: walk[0])
+            for fname in sorted(fnames)
+            if fname.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+        if split == 'validation':
+            files = files[:int(VALIDATION_SPLIT * len(files))]
+        paths.extend(files)
+        labels.extend([class_indices[name]] * len(files))
+    return paths, np.array(labels, dtype=np.int64)
+
+
+class PredictionCache:
+    """Probabilities of one artifact keyed by image sha256, stored as {cache_dir}/{artifact_sha256}.npz"""
+
+    def __init__(self, cache_dir, artifact_sha256):
+        self.path = os.path.join(cache_dir, f'{artifact_sha256[:32]}.npz')
+        self.entries = {}
+        self.dirty = False
+        if os.path.exists(self.path):
+            with np.load(self.path) as data:
+                self.entries = dict(zip(data['image_hashes'].tolist(), data['probabilities']))
+
+    def get(self, image_hash):
+        return self.entries.get(image_hash)
+
+    def put(self, image_hash, probabilities):
+        self.entries[image_hash] = probabilities
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, image_hashes=np.array(list(self.entries)),
+                     probabilities=np.stack(list(self.entries.values())))
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+def _first_output(outputs):
+    return outputs[0] if isinstance(outputs, list) else outputs
+
+
+def _timed_decode(path, out):
+    start = time.perf_counter()
+    decode_into(path, out)
+    return (time.perf_counter() - start) * 1000
+
+
+def _submit_batch(pool, paths, input_shape):
+    batch = np.empty((len(paths),) + input_shape, dtype=np.float32)
+    return batch, [pool.submit(_timed_decode, path, batch[i]) for i, path in enumerate(paths)]
+
+
+def predict_all(predictor, paths, input_shape, image_hashes, cache, batch_size, pool):
+    """
+    Fill probabilities for every path, scoring only cache misses. Batch k+1
+    is decoded on the pool while batch k is scored. Returns (probabilities,
+    readable mask, decode times in ms, a sample batch for latency tests).
+    """
+    probabilities = [cache.get(image_hash) for image_hash in image_hashes]
+    misses = [i for i, p in enumerate(probabilities) if p is None]
+    readable = np.ones(len(paths), dtype=bool)
+    decode_ms, sample = [], None
+
+    chunks = [misses[start:start + batch_size] for start in range(0, len(misses), batch_size)]
+    pending = _submit_batch(pool, [paths[i] for i in chunks[0]], input_shape) if chunks else None
+    for k, chunk in enumerate(chunks):
+        batch, futures = pending
+        ok = np.ones(len(chunk), dtype=bool)
+        for j, future in enumerate(futures):
+            try:
+                decode_ms.append(future.result())
+            except Exception as e:
+                print(f"⚠ Skipping {paths[chunk[j]]}: {e}")
+                ok[j] = False
+                readable[chunk[j]] = False
+        if k + 1 < len(chunks):
+            pending = _submit_batch(pool, [paths[i] for i in chunks[k + 1]], input_shape)
+        batch = batch[ok]
+        if sample is None and len(batch):
+            sample = batch.copy()
+        if len(batch):
+            scored = np.asarray(_first_output(predictor(batch)), dtype=np.float32)
+            for i, row in zip((i for i, keep in zip(chunk, ok) if keep), scored):
+                probabilities[i] = row
+                cache.put(image_hashes[i], row)
+        if (k + 1) % 20 == 0:
+            print(f"  {min((k + 1) * batch_size, len(misses)):,}/{len(misses):,} images scored...")
+    return probabilities, readable, decode_ms, sample
+
+
+def latency_profile(predictor, sample, batch_sizes=LATENCY_BATCH_SIZES, repeat=20):
+    """Median and p95 wall time of one predictor call at each batch size"""
+    rows = []
+    for batch_size in batch_sizes:
+        batch = np.resize(sample, (batch_size,) + sample.shape[1:])
+        predictor(batch)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            predictor(batch)
+            timings.append((time.perf_counter() - start) * 1000)
+        p50, p95 = np.percentile(timings, [50, 95])
+        rows.append({
+            'batch_size': batch_size,
+            'p50_ms': round(float(p50), 2),
+            'p95_ms': round(float(p95), 2),
+            'per_image_ms': round(float(p50) / batch_size, 3),
+            'images_per_sec': round(batch_size * 1000 / float(p50), 1),
+        })
+    return rows
+
+
+def classification_metrics(labels, predicted, class_names):
+    num_classes = len(class_names)
+    confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+    np.add.at(confusion, (labels, predicted), 1)
+    true_positives = np.diag(confusion)
+    support = confusion.sum(axis=1)
+    predicted_counts = confusion.sum(axis=0)
+    precision = np.divide(true_positives, predicted_counts, out=np.zeros(num_classes), where=predicted_counts > 0)
+    recall = np.divide(true_positives, support, out=np.zeros(num_classes), where=support > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall,
+                   out=np.zeros(num_classes), where=(precision + recall) > 0)
+    per_class = {
+        name: {
+            'precision': round(float(precision[i]), 4),
+            'recall': round(float(recall[i]), 4),
+            'f1': round(float(f1[i]), 4),
+            'support': int(support[i]),
+        }
+        for i, name in enumerate(class_names)
+    }
+    return confusion, per_class, round(float(f1[support > 0].mean()) if support.any() else 0.0, 4)
+
+
+def calibration(probabilities, labels, bins=CALIBRATION_BINS):
+    """Reliability of top-1 confidence: accuracy per confidence bin and expected calibration error"""
+    confidence = probabilities.max(axis=1)
+    correct = probabilities.argmax(axis=1) == labels
+    edges = np.linspace(0, 1, bins + 1)
+    index = np.clip(np.digitize(confidence, edges[1:-1]), 0, bins - 1)
+    rows, ece = [], 0.0
+    for b in range(bins):
+        in_bin = index == b
+        count = int(in_bin.sum())
+        if count == 0:
+            continue
+        mean_confidence = float(confidence[in_bin].mean())
+        accuracy = float(correct[in_bin].mean())
+        ece += count / len(labels) * abs(accuracy - mean_confidence)
+        rows.append({
+            'low': round(float(edges[b]), 2),
+            'high': round(float(edges[b + 1]), 2),
+            'count': count,
+            'confidence': round(mean_confidence, 4),
+            'accuracy': round(accuracy, 4),
+        })
+    return {'bins': rows, 'ece': round(ece, 4)}
+
+
+def evaluate(artifact_path=None, data_dir='training_data', version=None, split='validation',
+             cache_dir='ml_model/eval_cache', batch_size=64, workers=None, model=None, use_cache=True):
+    """Check the label mapping, score the data set and return a report dict"""
+    started = time.perf_counter()
+    artifact_path, artifact_sha256, class_indices, class_names = resolve_artifact(version, artifact_path)
+    model = model or keras.models.load_model(artifact_path)
+    input_shape = tuple(model.input_shape[1:])
+    num_outputs = _first_output(model.output_shape)[-1]
+    check_label_mapping(class_indices, class_names, data_classes(data_dir), num_outputs)
+
+    paths, labels = list_images(data_dir, class_indices, split)
+    if not paths:
+        raise ValueError(f"No images in {data_dir} ({split} split)")
+    cache = PredictionCache(cache_dir, artifact_sha256)
+    if not use_cache:
+        cache.entries = {}
+
+    with ThreadPoolExecutor(max_workers=workers or available_cores()) as pool:
+        image_hashes = list(pool.map(_sha256, paths, chunksize=64))
+        cached = sum(cache.get(image_hash) is not None for image_hash in image_hashes)
+        print(f"✓ {len(paths):,} images, {cached:,} cached predictions")
+
+        predictor = make_predictor(model)
+        predictor.warmup()
+        probabilities, readable, decode_ms, sample = predict_all(
+            predictor, paths, input_shape, image_hashes, cache, batch_size, pool
+        )
+        cache.save()
+        scored_seconds = time.perf_counter() - started
+        if sample is None:
+            # Everything readable came from the cache; decode a few of those just for timing
+            sample_paths = [path for path, p in zip(paths, probabilities) if p is not None][:max(LATENCY_BATCH_SIZES)]
+            sample, futures = _submit_batch(pool, sample_paths, input_shape)
+            decode_ms = [future.result() for future in futures]
+        latency = latency_profile(predictor, sample)
+
+    probabilities = np.stack([p for p, ok in zip(probabilities, readable) if ok])
+    labels = labels[readable]
+    predicted = probabilities.argmax(axis=1)
+    confusion, per_class, macro_f1 = classification_metrics(labels, predicted, class_names)
+    return {
+        'artifact': artifact_path,
+        'artifact_sha256': artifact_sha256,
+        'version': version,
+        'data_dir': data_dir,
+        'split': split,
+        'class_names': class_names,
+        'samples': int(len(labels)),
+        'unreadable': [path for path, ok in zip(paths, readable) if not ok],
+        'cached': cached,
+        'accuracy': round(float((predicted == labels).mean()), 4),
+        'macro_f1': macro_f1,
+        'per_class': per_class,
+        'confusion_matrix': confusion.tolist(),
+        'calibration': calibration(probabilities, labels),
+        'latency': {
+            'decode_p50_ms': round(float(np.median(decode_ms)), 2),
+            'predict': latency,
+        },
+        'seconds': round(scored_seconds, 2),
+        'images_per_sec': round(len(paths) / scored_seconds, 1),
+    }
+
+
+def print_evaluation(report):
+    names = report['class_names']
+    width = max(len(name) for name in names) + 2
+    print(f"Images: {report['samples']:,} ({report['split']} split, {report['cached']:,} cached), "
+          f"{report['images_per_sec']:.1f} images/s")
+    print(f"Accuracy: {report['accuracy'] * 100:.2f}%, macro F1: {report['macro_f1']:.4f}, "
+          f"ECE: {report['calibration']['ece']:.4f}")
+
+    print(f"\nConfusion matrix (rows: true, columns: predicted)")
+    print(' ' * width + ''.join(f"{name[:9]:>10}" for name in names))
+    for name, row in zip(names, report['confusion_matrix']):
+        print(f"{name:<{width}}" + ''.join(f"{count:>10}" for count in row))
+
+    print(f"\n{'class':<{width}} {'precision':>9} {'recall':>7} {'f1':>7} {'support':>8}")
+    for name, row in report['per_class'].items():
+        print(f"{name:<{width}} {row['precision'] * 100:>8.1f}% {row['recall'] * 100:>6.1f}% "
+              f"{row['f1']:>7.3f} {row['support']:>8}")
+
+    print(f"\n{'confidence':>11} {'count':>6} {'mean conf':>9} {'accuracy':>9}")
+    for row in report['calibration']['bins']:
+        print(f"{row['low']:>5.1f}-{row['high']:<5.1f} {row['count']:>6} {row['confidence'] * 100:>8.1f}% "
+              f"{row['accuracy'] * 100:>8.1f}%")
+
+    print(f"\nDecode: {report['latency']['decode_p50_ms']:.1f} ms/image")
+    print(f"{'batch':>5} {'p50 ms':>8} {'p95 ms':>8} {'ms/image':>9} {'img/s':>8}")
+    for row in report['latency']['predict']:
+        print(f"{row['batch_size']:>5} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+              f"{row['per_image_ms']:>9.2f} {row['images_per_sec']:>8.1f}")
+
+
+def save_plots(report, output_dir):
+    """confusion_matrix.png and calibration.png"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    os.makedirs(output_dir, exist_ok=True)
+    names = report['class_names']
+    confusion = np.array(report['confusion_matrix'])
+    plt.figure(figsize=(6, 5))
+    plt.imshow(confusion, cmap='Blues')
+    plt.colorbar()
+    plt.xticks(range(len(names)), names, rotation=45)
+    plt.yticks(range(len(names)), names)
+    for i in range(len(names)):
+        for j in range(len(names)):
+            plt.text(j, i, confusion[i, j], ha='center', va='center',
+                     color='white' if confusion[i, j] > confusion.max() / 2 else 'black')
+    plt.title('Confusion Matrix')
+    plt.xlabel('Predicted')
+    plt.ylabel('True')
+    plt.tight_layout()
+    plt.savefig(os.path.join(output_dir, 'confusion_matrix.png'))
+    plt.close()
+
+    bins = report['calibration']['bins']
+    plt.figure(figsize=(5, 5))
+    plt.plot([0, 1], [0, 1], linestyle='--')
+    plt.plot([row['confidence'] for row in bins], [row['accuracy'] for row in bins], marker='o')
+    plt.title(f"Calibration (ECE {report['calibration']['ece']:.3f})")
+    plt.xlabel('Confidence')
+    plt.ylabel('Accuracy')
+    plt.legend(['Perfect', 'Model'])
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig(os.path.join(output_dir, 'calibration.png'))
+    plt.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate a model artifact on a labelled image directory')
+    parser.add_argument('--version', help='registry version (default: CURRENT)')
+    parser.add_argument('--artifact', help='model file instead of a registry version')
+    parser.add_argument('--data-dir', default='training_data')
+    parser.add_argument('--split', choices=('validation', 'all'), default='validation')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=None, help='decode threads (default: all cores)')
+    parser.add_argument('--cache-dir', default='ml_model/eval_cache')
+    parser.add_argument('--no-cache', action='store_true', help='score every image again')
+    parser.add_argument('--output', help='also write the report as JSON')
+    parser.add_argument('--plots', help='directory for confusion matrix and calibration charts')
+    args = parser.parse_args()
+
+    try:
+        report = evaluate(args.artifact, args.data_dir, args.version, args.split, args.cache_dir,
+                          args.batch_size, args.workers, use_cache=not args.no_cache)
+    except (LabelMappingError, model_registry.RegistryError) as e:
+        sys.exit(f"❌ {e}")
+    print_evaluation(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.plots:
+        save_plots(report, args.plots)
+        print(f"✓ Charts saved to {args.plots}")
+
+
+if __name__ == '__main__':
+    main()
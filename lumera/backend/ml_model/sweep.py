@@ -0,0 +1,273 @@
+"""
+Parallel hyperparameter sweeps for train_with_kaggle_dataset
+
+    python ml_model/sweep.py run --study ml_model/sweeps/skin.db --trials 24 [--space space.json]
+    python ml_model/sweep.py report --study ml_model/sweeps/skin.db
+
+Trials run concurrently in a process pool. Each trial process is limited to
+--threads-per-trial TensorFlow/BLAS threads, and the pool is sized so that
+trials x threads fills the available cores. After every epoch a trial
+records val_accuracy in the study. Median stopping prunes it when its best
+val_accuracy so far is below the median of the other trials' bests at the
+same epoch.
+
+A study is a SQLite file holding the search space, every trial's parameters
+and state, and per-epoch curves. Parameters are sampled from (seed, trial
+number), so an interrupted sweep resumes with the same plan. Trials that
+were running when it stopped are started again; finished ones are kept.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+from utils.helpers import available_cores
+
+# Each entry is one of:
+#   {"type": "choice", "values": [...]}
+#   {"type": "uniform" | "loguniform", "low": a, "high": b}
+#   {"type": "int", "low": a, "high": b, "step": s}
+DEFAULT_SPACE = {
+    'batch_size': {'type': 'choice', 'values': [8, 16, 32]},
+    'learning_rate': {'type': 'loguniform', 'low': 1e-4, 'high': 3e-3},
+    'fine_tune_learning_rate': {'type': 'loguniform', 'low': 1e-5, 'high': 3e-4},
+    'dropout': {'type': 'uniform', 'low': 0.2, 'high': 0.6},
+    'head_dropout': {'type': 'uniform', 'low': 0.1, 'high': 0.5},
+    'l2': {'type': 'loguniform', 'low': 1e-5, 'high': 1e-2},
+    'freeze_layers': {'type': 'int', 'low': 40, 'high': 140, 'step': 20},
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS study (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    space TEXT NOT NULL,
+    fixed TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS trials (
+    number INTEGER PRIMARY KEY,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL,            -- RUNNING | COMPLETE | PRUNED | FAILED
+    value REAL,                     -- best val_accuracy
+    error TEXT,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS trial_epochs (
+    number INTEGER NOT NULL,
+    epoch INTEGER NOT NULL,
+    val_accuracy REAL NOT NULL,
+    PRIMARY KEY (number, epoch)
+);
+"""
+
+
+class TrialPruned(Exception):
+    pass
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def sample_params(space, seed, number):
+    """Deterministic per trial, so a resumed sweep proposes the same trials"""
+    rng = random.Random(f'{seed}:{number}')
+    params = {}
+    for name, spec in sorted(space.items()):
+        kind = spec['type']
+        if kind == 'choice':
+            params[name] = rng.choice(spec['values'])
+        elif kind == 'uniform':
+            params[name] = round(rng.uniform(spec['low'], spec['high']), 4)
+        elif kind == 'loguniform':
+            params[name] = float(f"{math.exp(rng.uniform(math.log(spec['low']), math.log(spec['high']))):.3g}")
+        elif kind == 'int':
+            params[name] = rng.randrange(spec['low'], spec['high'] + 1, spec.get('step', 1))
+        else:
+            raise ValueError(f"Unknown parameter type for {name}: {kind}")
+    return params
+
+
+def median_stopping_callback(conn, number, warmup_epochs, min_trials):
+    """
+    Keras callback that records val_accuracy per epoch (counted across both
+    training phases) through the trial's connection `conn` and raises
+    TrialPruned when this trial falls below the median of the others at the
+    same epoch.
+    """
+    from tensorflow import keras
+
+    class MedianStopping(keras.callbacks.Callback):
+        def __init__(self):
+            super().__init__()
+            self.epoch = 0
+            self.best = 0.0
+
+        def on_epoch_end(self, epoch, logs=None):
+            value = float((logs or {}).get('val_accuracy', 0.0))
+            self.best = max(self.best, value)
+            step = self.epoch
+            self.epoch += 1
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO trial_epochs VALUES (?, ?, ?)', (number, step, value))
+                if step < warmup_epochs:
+                    return
+                # Best-so-far of every other trial that reached this epoch
+                others = [row[0] for row in conn.execute(
+                    'SELECT MAX(val_accuracy) FROM trial_epochs WHERE number != ? AND epoch <= ? '
+                    'GROUP BY number HAVING MAX(epoch) >= ?', (number, step, step)
+                )]
+            if len(others) >= min_trials and self.best < statistics.median(others):
+                raise TrialPruned(f"epoch {step}: best {self.best:.4f} < median {statistics.median(others):.4f}")
+
+    return MedianStopping()
+
+
+def run_trial(study_path, number, params, threads, trial_dir, warmup_epochs, min_trials):
+    """Body of one trial; runs in a pool process with its own thread limits"""
+    for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    os.makedirs(trial_dir, exist_ok=True)
+    log = open(os.path.join(trial_dir, 'train.log'), 'w', buffering=1)
+    sys.stdout = sys.stderr = log
+
+    import tensorflow as tf
+    from services import runtime
+    runtime.configure_tensorflow(tf, {'intra_op': threads, 'inter_op': 1, 'opencv': 1})
+    from ml_model.train_kaggle_model import train_with_kaggle_dataset
+
+    # One connection for the whole trial; `with conn` only scopes a transaction, so close it here
+    conn = connect(study_path)
+    try:
+        callback = median_stopping_callback(conn, number, warmup_epochs, min_trials)
+        state, error = 'COMPLETE', None
+        try:
+            train_with_kaggle_dataset(model_name='model', publish=False, params=params,
+                                      model_dir=trial_dir, extra_callbacks=[callback])
+        except TrialPruned as e:
+            state, error = 'PRUNED', str(e)
+        except Exception as e:
+            state, error = 'FAILED', repr(e)
+
+        with conn:
+            conn.execute('UPDATE trials SET state = ?, value = ?, error = ?, finished_at = ? WHERE number = ?',
+                         (state, callback.best, error, datetime.utcnow().isoformat(), number))
+    finally:
+        conn.close()
+        log.close()
+    return number, state, callback.best
+
+
+def run_sweep(study_path, n_trials, space=None, fixed=None, seed=0, parallel=None, threads_per_trial=2,
+              warmup_epochs=5, min_trials=3):
+    os.makedirs(os.path.dirname(os.path.abspath(study_path)), exist_ok=True)
+    conn = connect(study_path)
+    row = conn.execute('SELECT space, fixed, seed FROM study').fetchone()
+    if row is None:
+        space, fixed = space or DEFAULT_SPACE, fixed or {}
+        with conn:
+            conn.execute('INSERT INTO study VALUES (1, ?, ?, ?, ?)',
+                         (json.dumps(space), json.dumps(fixed), seed, datetime.utcnow().isoformat()))
+    else:
+        # A study keeps the space and seed it was created with
+        space, fixed, seed = json.loads(row[0]), json.loads(row[1]), row[2]
+        print(f"↻ Resuming study {study_path}")
+
+    with conn:
+        # Trials cut off by an interruption start over with a clean curve
+        interrupted = [n for (n,) in conn.execute("SELECT number FROM trials WHERE state = 'RUNNING'")]
+        conn.executemany('DELETE FROM trial_epochs WHERE number = ?', [(n,) for n in interrupted])
+    done = {n for (n,) in conn.execute("SELECT number FROM trials WHERE state != 'RUNNING'")}
+    pending = [n for n in range(n_trials) if n not in done]
+
+    cores = available_cores()
+    parallel = parallel or max(1, cores // threads_per_trial)
+    print(f"🔬 {len(pending)} trials to run ({len(done)} done), {parallel} at a time x {threads_per_trial} threads "
+          f"on {cores} cores")
+
+    trials_dir = os.path.splitext(os.path.abspath(study_path))[0] + '_trials'
+    ctx = multiprocessing.get_context('spawn')
+    # A fresh process per trial: TensorFlow's thread pools are fixed once it starts
+    pool_options = {'max_tasks_per_child': 1} if sys.version_info >= (3, 11) else {}
+    with ProcessPoolExecutor(max_workers=parallel, mp_context=ctx, **pool_options) as pool:
+        futures = []
+        for number in pending:
+            params = dict(sample_params(space, seed, number), **fixed)
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO trials (number, params, state, started_at) '
+                             "VALUES (?, ?, 'RUNNING', ?)", (number, json.dumps(params), datetime.utcnow().isoformat()))
+            futures.append(pool.submit(run_trial, study_path, number, params, threads_per_trial,
+                                       os.path.join(trials_dir, f'{number:04d}'), warmup_epochs, min_trials))
+        for future in as_completed(futures):
+            try:
+                number, state, value = future.result()
+            except Exception as e:
+                # The trial stays RUNNING and is retried when the sweep resumes
+                print(f"❌ trial process died: {e}")
+                continue
+            marker = {'COMPLETE': '✓', 'PRUNED': '✂', 'FAILED': '❌'}[state]
+            print(f"{marker} trial {number}: {state.lower()}, best val_accuracy {value:.4f}")
+    conn.close()
+    print_report(study_path)
+
+
+def print_report(study_path, top=10):
+    conn = connect(study_path)
+    counts = dict(conn.execute('SELECT state, COUNT(*) FROM trials GROUP BY state').fetchall())
+    print(f"\n📊 {sum(counts.values())} trials: " + ', '.join(f"{n} {s.lower()}" for s, n in sorted(counts.items())))
+    rows = conn.execute(
+        "SELECT t.number, t.value, t.state, t.params, COUNT(e.epoch) FROM trials t "
+        "LEFT JOIN trial_epochs e ON e.number = t.number WHERE t.value IS NOT NULL "
+        "GROUP BY t.number ORDER BY t.value DESC LIMIT ?", (top,)
+    ).fetchall()
+    for number, value, state, params, epochs in rows:
+        print(f"  #{number:<4} {value:.4f}  {state.lower():<8} {epochs:>3} epochs  {params}")
+    if rows:
+        print(f"\nBest params: {rows[0][3]}")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hyperparameter sweeps for the skin type classifier')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run')
+    run.add_argument('--study', default=os.path.join('ml_model', 'sweeps', 'study.db'))
+    run.add_argument('--trials', type=int, default=24, help='total trials in the study')
+    run.add_argument('--space', help='JSON file with the search space (default: built-in)')
+    run.add_argument('--fixed', help='JSON object of params held constant, e.g. {"epochs": 15}')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--parallel', type=int, default=None, help='concurrent trials (default: cores / threads)')
+    run.add_argument('--threads-per-trial', type=int, default=2)
+    run.add_argument('--warmup-epochs', type=int, default=5, help='epochs before a trial can be pruned')
+    run.add_argument('--min-trials', type=int, default=3, help='other trials needed at an epoch to prune')
+    report = sub.add_parser('report')
+    report.add_argument('--study', default=os.path.join('ml_model', 'sweeps', 'study.db'))
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        space = None
+        if args.space:
+            with open(args.space) as f:
+                space = json.load(f)
+        run_sweep(args.study, args.trials, space, json.loads(args.fixed) if args.fixed else None, args.seed,
+                  args.parallel, args.threads_per_trial, args.warmup_epochs, args.min_trials)
+    else:
+        print_report(args.study)
+
+
+if __name__ == '__main__':
+    main()
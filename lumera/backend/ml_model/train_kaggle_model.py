@@ -8,27 +8,30 @@ import numpy as np
 import json
 import os
 import matplotlib.pyplot as plt
+import argparse
+import sys
 from datetime import datetime
 
-def train_with_kaggle_dataset():
-    """
-    Optimized training for the Kaggle skin type dataset
-    """
-    print("=" * 60)
-    print("🎓 TRAINING SKIN TYPE CLASSIFIER")
-    print("   Dataset: Oily, Dry, Normal (+ Synthetic)")
-    print("=" * 60)
-    
-    # Configuration
-    IMG_HEIGHT = 224
-    IMG_WIDTH = 224
-    BATCH_SIZE = 16  # Smaller batch for limited data
-    EPOCHS = 50      # More epochs for smaller dataset
-    DATA_DIR = 'training_data'
-    MODEL_DIR = 'ml_model'
-    
-    os.makedirs(MODEL_DIR, exist_ok=True)
-    
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services import model_registry
+
+# Hyperparameters of train_with_kaggle_dataset; ml_model/sweep.py searches over these
+DEFAULT_PARAMS = {
+    'batch_size': 16,                 # Smaller batch for limited data
+    'epochs': 50,                     # More epochs for smaller dataset
+    'fine_tune_epochs': 20,
+    'learning_rate': 0.001,
+    'fine_tune_learning_rate': 0.0001,
+    'dropout': 0.4,
+    'head_dropout': 0.3,
+    'l2': 0.001,
+    'freeze_layers': 100,             # MobileNetV2 layers kept frozen while fine-tuning
+    'early_stop_patience': 15,
+}
+
+
+def build_generators(data_dir, img_height, img_width, batch_size):
+    """Augmented training and plain validation iterators over the same 80/20 split"""
     # Data augmentation (aggressive for small dataset)
     train_datagen = ImageDataGenerator(
         rescale=1./255,
@@ -48,38 +51,31 @@ def train_with_kaggle_dataset():
         validation_split=0.2
     )
     
-    # Create generators
-    print("\n📁 Loading dataset...")
     train_generator = train_datagen.flow_from_directory(
-        DATA_DIR,
-        target_size=(IMG_HEIGHT, IMG_WIDTH),
-        batch_size=BATCH_SIZE,
+        data_dir,
+        target_size=(img_height, img_width),
+        batch_size=batch_size,
         class_mode='categorical',
         subset='training',
         shuffle=True
     )
     
     val_generator = val_datagen.flow_from_directory(
-        DATA_DIR,
-        target_size=(IMG_HEIGHT, IMG_WIDTH),
-        batch_size=BATCH_SIZE,
+        data_dir,
+        target_size=(img_height, img_width),
+        batch_size=batch_size,
         class_mode='categorical',
         subset='validation',
         shuffle=False
     )
-    
-    print(f"✓ Training samples: {train_generator.samples}")
-    print(f"✓ Validation samples: {val_generator.samples}")
-    print(f"✓ Classes: {list(train_generator.class_indices.keys())}")
-    
-    # Save class indices
-    with open(os.path.join(MODEL_DIR, 'class_indices.json'), 'w') as f:
-        json.dump(train_generator.class_indices, f)
-    
-    # Build model
-    print("\n🏗️ Building model...")
+    return train_generator, val_generator
+
+
+def build_model(img_height, img_width, alpha, params, num_classes=5):
+    """Frozen MobileNetV2 base with the regularised dense head, compiled for the first phase"""
     base_model = MobileNetV2(
-        input_shape=(IMG_HEIGHT, IMG_WIDTH, 3),
+        input_shape=(img_height, img_width, 3),
+        alpha=alpha,
         include_top=False,
         weights='imagenet'
     )
@@ -89,29 +85,43 @@ def train_with_kaggle_dataset():
         base_model,
         layers.GlobalAveragePooling2D(),
         layers.BatchNormalization(),
-        layers.Dropout(0.4),
-        layers.Dense(256, activation='relu', kernel_regularizer=keras.regularizers.l2(0.001)),
+        layers.Dropout(params['dropout']),
+        layers.Dense(256, activation='relu', kernel_regularizer=keras.regularizers.l2(params['l2'])),
         layers.BatchNormalization(),
-        layers.Dropout(0.4),
-        layers.Dense(128, activation='relu', kernel_regularizer=keras.regularizers.l2(0.001)),
-        layers.Dropout(0.3),
-        layers.Dense(5, activation='softmax')
+        layers.Dropout(params['dropout']),
+        layers.Dense(128, activation='relu', kernel_regularizer=keras.regularizers.l2(params['l2'])),
+        layers.Dropout(params['head_dropout']),
+        layers.Dense(num_classes, activation='softmax')
     ])
     
     model.compile(
-        optimizer=keras.optimizers.Adam(learning_rate=0.001),
+        optimizer=keras.optimizers.Adam(learning_rate=params['learning_rate']),
         loss='categorical_crossentropy',
         metrics=['accuracy']
     )
-    
-    print("✓ Model built")
-    model.build(input_shape=(None, 224, 224, 3))
+    model.build(input_shape=(None, img_height, img_width, 3))
+    return model, base_model
 
-    model.summary()
+
+def unfreeze_for_fine_tuning(model, base_model, params):
+    """Unfreeze the base past its first freeze_layers layers and recompile at the fine-tune rate"""
+    base_model.trainable = True
     
-    # Callbacks
+    # Freeze the first freeze_layers layers
+    for layer in base_model.layers[:params['freeze_layers']]:
+        layer.trainable = False
+    
+    model.compile(
+        optimizer=keras.optimizers.Adam(learning_rate=params['fine_tune_learning_rate']),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+
+
+def build_callbacks(checkpoint_path, params):
+    """Best-val_accuracy checkpoint, early stopping and LR decay, shared by both training phases"""
     checkpoint = ModelCheckpoint(
-        os.path.join(MODEL_DIR, 'best_model.keras'),
+        checkpoint_path,
         monitor='val_accuracy',
         save_best_only=True,
         mode='max',
@@ -121,7 +131,7 @@ def train_with_kaggle_dataset():
     
     early_stop = EarlyStopping(
         monitor='val_accuracy',
-        patience=15,
+        patience=params['early_stop_patience'],
         restore_best_weights=True,
         verbose=1
     )
@@ -133,6 +143,57 @@ def train_with_kaggle_dataset():
         min_lr=1e-7,
         verbose=1
     )
+    return [checkpoint, early_stop, reduce_lr]
+
+
+def train_with_kaggle_dataset(img_size=224, alpha=1.0, model_name='skin_type_model', publish=True,
+                              params=None, model_dir='ml_model', extra_callbacks=()):
+    """
+    Optimized training for the Kaggle skin type dataset.
+    img_size and alpha (MobileNetV2 width multiplier) shrink the network for
+    the fast early-exit model; publish=False only saves {model_name}.h5.
+    params overrides DEFAULT_PARAMS; extra_callbacks run in both phases.
+    """
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    print("=" * 60)
+    print("🎓 TRAINING SKIN TYPE CLASSIFIER")
+    print("   Dataset: Oily, Dry, Normal (+ Synthetic)")
+    print(f"   Input: {img_size}x{img_size}, MobileNetV2 alpha {alpha}")
+    print("=" * 60)
+    
+    # Configuration
+    IMG_HEIGHT = img_size
+    IMG_WIDTH = img_size
+    BATCH_SIZE = params['batch_size']
+    EPOCHS = params['epochs']
+    DATA_DIR = 'training_data'
+    MODEL_DIR = model_dir
+    
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    
+    # Create generators
+    print("\n📁 Loading dataset...")
+    train_generator, val_generator = build_generators(DATA_DIR, IMG_HEIGHT, IMG_WIDTH, BATCH_SIZE)
+    
+    print(f"✓ Training samples: {train_generator.samples}")
+    print(f"✓ Validation samples: {val_generator.samples}")
+    print(f"✓ Classes: {list(train_generator.class_indices.keys())}")
+    
+    # Save class indices
+    with open(os.path.join(MODEL_DIR, 'class_indices.json'), 'w') as f:
+        json.dump(train_generator.class_indices, f)
+    
+    # Build model
+    print("\n🏗️ Building model...")
+    model, base_model = build_model(IMG_HEIGHT, IMG_WIDTH, alpha, params, train_generator.num_classes)
+    print("✓ Model built")
+    model.summary()
+    
+    # Callbacks
+    callbacks = build_callbacks(
+        os.path.join(MODEL_DIR, 'best_model.keras' if model_name == 'skin_type_model' else f'best_{model_name}.keras'),
+        params
+    )
     
     # Train
     print(f"\n🚀 Training for {EPOCHS} epochs...")
@@ -140,29 +201,19 @@ def train_with_kaggle_dataset():
         train_generator,
         epochs=EPOCHS,
         validation_data=val_generator,
-        callbacks=[checkpoint, early_stop, reduce_lr],
+        callbacks=[*callbacks, *extra_callbacks],
         verbose=1
     )
     
     # Fine-tune
     print("\n🔧 Fine-tuning...")
-    base_model.trainable = True
-    
-    # Freeze first 100 layers
-    for layer in base_model.layers[:100]:
-        layer.trainable = False
-    
-    model.compile(
-        optimizer=keras.optimizers.Adam(learning_rate=0.0001),
-        loss='categorical_crossentropy',
-        metrics=['accuracy']
-    )
+    unfreeze_for_fine_tuning(model, base_model, params)
     
     history_fine = model.fit(
         train_generator,
-        epochs=20,
+        epochs=params['fine_tune_epochs'],
         validation_data=val_generator,
-        callbacks=[checkpoint, early_stop, reduce_lr],
+        callbacks=[*callbacks, *extra_callbacks],
         verbose=1
     )
     
@@ -173,8 +224,29 @@ def train_with_kaggle_dataset():
     print(f"✓ Validation Accuracy: {results[1]:.4f}")
     
     # Save
-    model.save(os.path.join(MODEL_DIR, 'skin_type_model.h5'))
-    print(f"✓ Model saved to {MODEL_DIR}/skin_type_model.h5")
+    model.save(os.path.join(MODEL_DIR, f'{model_name}.h5'))
+    print(f"✓ Model saved to {MODEL_DIR}/{model_name}.h5")
+    
+    # Per-class report on the same split; raises before publishing if the labels are inconsistent
+    from ml_model.evaluate_model import evaluate, print_evaluation
+    print("\n🔎 Per-class evaluation...")
+    evaluation = evaluate(os.path.join(MODEL_DIR, f'{model_name}.h5'), DATA_DIR, model=model,
+                          cache_dir=os.path.join(MODEL_DIR, 'eval_cache'))
+    print_evaluation(evaluation)
+    
+    # Publish to the registry; serving processes switch once it is activated
+    if publish:
+        version = model_registry.publish(
+            os.path.join(MODEL_DIR, f'{model_name}.h5'),
+            os.path.join(MODEL_DIR, 'class_indices.json'),
+            extra={
+                'val_accuracy': float(results[1]),
+                'val_loss': float(results[0]),
+                'val_macro_f1': evaluation['macro_f1'],
+                'val_ece': evaluation['calibration']['ece'],
+            }
+        )
+        print(f"✓ Published as {version} (activate with: python -m services.model_registry activate {version})")
     
     # Plot
     plt.figure(figsize=(12, 4))
@@ -198,7 +270,7 @@ def train_with_kaggle_dataset():
     plt.grid(True)
     
     plt.tight_layout()
-    plt.savefig(os.path.join(MODEL_DIR, 'training_history.png'))
+    plt.savefig(os.path.join(MODEL_DIR, 'training_history.png' if model_name == 'skin_type_model' else f'{model_name}_history.png'))
     print(f"✓ Training plot saved")
     
     print("\n" + "=" * 60)
@@ -208,5 +280,54 @@ def train_with_kaggle_dataset():
     return model
 
 
+def train_fast_model(img_size=128, alpha=0.35, max_accuracy_drop=1.0):
+    """
+    Train the low-resolution early-exit model, calibrate its confidence
+    threshold against the full model on the validation split and attach it
+    to the current registry version (or leave it next to the legacy model).
+    """
+    from ml_model.early_exit_report import early_exit_report, print_report
+    
+    MODEL_DIR = 'ml_model'
+    fast_model = train_with_kaggle_dataset(img_size, alpha, 'skin_type_model_fast', publish=False)
+    fast_path = os.path.join(MODEL_DIR, 'skin_type_model_fast.h5')
+    
+    version = model_registry.current_version() or (model_registry.list_versions() or [None])[-1]
+    if version:
+        full_path = model_registry.read_manifest(version)['artifact_path']
+    else:
+        full_path = os.path.join(MODEL_DIR, 'skin_type_model.h5')
+    print(f"\n⏱️ Calibrating early exit against {version or full_path}...")
+    report = early_exit_report(keras.models.load_model(full_path), fast_model, 'training_data',
+                               max_accuracy_drop=max_accuracy_drop)
+    print_report(report)
+    with open(os.path.join(MODEL_DIR, 'early_exit_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    
+    if version:
+        model_registry.attach(version, 'fast', fast_path, os.path.join(MODEL_DIR, 'class_indices.json'), extra={
+            'threshold': report['recommended_threshold'],
+            'img_size': img_size,
+            'alpha': alpha,
+            'avg_latency_saving': report['recommended']['latency_saving'],
+            'accuracy_delta': report['recommended']['accuracy_delta'],
+        })
+        print(f"✓ Attached fast model to {version} (threshold {report['recommended_threshold']:.0f}%)")
+    else:
+        print(f"✓ Fast model saved next to the legacy model; set EARLY_EXIT_CONFIDENCE={report['recommended_threshold']:.0f}")
+    return fast_model
+
+
 if __name__ == '__main__':
-    trained_model = train_with_kaggle_dataset()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Train the skin type classifier')
+    parser.add_argument('--fast', action='store_true', help='train the low-resolution early-exit model instead')
+    parser.add_argument('--img-size', type=int, default=None, help='input resolution (default 224, or 128 with --fast)')
+    parser.add_argument('--alpha', type=float, default=None, help='MobileNetV2 width (default 1.0, or 0.35 with --fast)')
+    parser.add_argument('--max-accuracy-drop', type=float, default=1.0,
+                        help='accuracy points the early exit may cost when picking its threshold')
+    args = parser.parse_args()
+    
+    if args.fast:
+        trained_model = train_fast_model(args.img_size or 128, args.alpha or 0.35, args.max_accuracy_drop)
+    else:
+        trained_model = train_with_kaggle_dataset(args.img_size or 224, args.alpha or 1.0)
\ No newline at end of file
@@ -1,9 +1,20 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy import inspect, text, select, delete, insert, update, func
+from sqlalchemy.dialects import postgresql, sqlite
+from datetime import date, datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from services.recommendations import get_catalogue, decode_ids
+import json
 
 db = SQLAlchemy()
 
+def recommendation_texts(recommendation_ids, legacy_json):
+    """Recommendation strings for a row: catalogue IDs when present, else the legacy JSON text"""
+    if recommendation_ids:
+        return get_catalogue().resolve(decode_ids(recommendation_ids))
+    return json.loads(legacy_json) if legacy_json else []
+
+
 class User(db.Model):
     __tablename__ = 'users'
     
@@ -14,6 +25,7 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     analyses = db.relationship('Analysis', backref='user', lazy=True, cascade='all, delete-orphan')
+    daily_stats = db.relationship('AnalysisDailyStat', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -38,9 +50,21 @@ class Analysis(db.Model):
     image_path = db.Column(db.String(255), nullable=False)
     skin_type = db.Column(db.String(50), nullable=False)
     confidence = db.Column(db.Float, nullable=False)
-    recommendations = db.Column(db.Text, nullable=False)  # JSON string
+    recommendations = db.Column(db.Text, nullable=False, default='')  # legacy JSON text; '' once recommendation_ids is set
+    recommendation_ids = db.Column(db.String(255), nullable=True)  # comma-separated catalogue IDs
+    model_version = db.Column(db.String(64), nullable=True)  # registry version, 'legacy' or 'features'
+    phash = db.Column(db.BigInteger, nullable=True)  # 64-bit dHash stored as signed, see utils/imagehash.py
+    embedding = db.Column(db.LargeBinary, nullable=True)  # float16 penultimate-layer vector, see services/embedding_index.py
+    original_size = db.Column(db.BigInteger, nullable=True)  # bytes of a full-resolution original sent after a preview
+    original_status = db.Column(db.String(16), nullable=True)  # None (single upload), pending, processing, complete, failed, abandoned
+    provisional = db.Column(db.Boolean, nullable=True)  # True: fast-path result under overload, queued for model re-scoring
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_analyses_user_phash', 'user_id', 'phash'),
+        db.Index('ix_analyses_provisional', 'provisional'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -48,6 +72,157 @@ class Analysis(db.Model):
             'image_path': self.image_path,
             'skin_type': self.skin_type,
             'confidence': self.confidence,
-            'recommendations': self.recommendations,
+            'recommendations': recommendation_texts(self.recommendation_ids, self.recommendations),
+            'model_version': self.model_version,
+            'original_status': self.original_status,
+            'provisional': bool(self.provisional),
             'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+
+
+
+class AnalysisDailyStat(db.Model):
+    """Per-user, per-day, per-skin-type running totals, kept in step with analyses"""
+    __tablename__ = 'analysis_daily_stats'
+    __table_args__ = (db.UniqueConstraint('user_id', 'day', 'skin_type', name='uq_daily_stat'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    skin_type = db.Column(db.String(50), nullable=False)
+    analysis_count = db.Column(db.Integer, nullable=False, default=0)
+    confidence_sum = db.Column(db.Float, nullable=False, default=0.0)
+
+
+def record_daily_stat(analysis):
+    """
+    Add a new (flushed) Analysis to its owner's daily aggregate with a single
+    upsert. Runs in the caller's transaction, so the aggregate commits or rolls
+    back together with the Analysis row.
+    """
+    dialect = sqlite if db.engine.dialect.name == 'sqlite' else postgresql
+    stmt = dialect.insert(AnalysisDailyStat).values(
+        user_id=analysis.user_id,
+        day=analysis.created_at.date(),
+        skin_type=analysis.skin_type,
+        analysis_count=1,
+        confidence_sum=analysis.confidence
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'day', 'skin_type'],
+        set_={
+            'analysis_count': AnalysisDailyStat.analysis_count + 1,
+            'confidence_sum': AnalysisDailyStat.confidence_sum + stmt.excluded.confidence_sum
+        }
+    )
+    db.session.execute(stmt)
+
+
+def retract_daily_stat(user_id, day, skin_type, confidence):
+    """Take one analysis back out of its daily aggregate, e.g. before its skin type is rewritten"""
+    db.session.execute(
+        update(AnalysisDailyStat)
+        .where(AnalysisDailyStat.user_id == user_id, AnalysisDailyStat.day == day,
+               AnalysisDailyStat.skin_type == skin_type)
+        .values(analysis_count=AnalysisDailyStat.analysis_count - 1,
+                confidence_sum=AnalysisDailyStat.confidence_sum - confidence)
+    )
+
+
+def rebuild_daily_stats():
+    """Recompute every aggregate from the analyses table (after bulk rewrites)"""
+    db.session.execute(delete(AnalysisDailyStat))
+    db.session.execute(insert(AnalysisDailyStat).from_select(
+        ['user_id', 'day', 'skin_type', 'analysis_count', 'confidence_sum'],
+        select(
+            Analysis.user_id,
+            func.date(Analysis.created_at),
+            Analysis.skin_type,
+            func.count(Analysis.id),
+            func.sum(Analysis.confidence)
+        ).group_by(Analysis.user_id, func.date(Analysis.created_at), Analysis.skin_type)
+    ))
+    
+    # Archived analyses still count towards their days
+    from services.archive import daily_totals
+    dialect = sqlite if db.engine.dialect.name == 'sqlite' else postgresql
+    for user_id, day, skin_type, count, confidence_sum in daily_totals():
+        stmt = dialect.insert(AnalysisDailyStat).values(
+            user_id=user_id,
+            day=date.fromisoformat(day) if isinstance(day, str) else day,
+            skin_type=skin_type,
+            analysis_count=count,
+            confidence_sum=confidence_sum
+        )
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['user_id', 'day', 'skin_type'],
+            set_={
+                'analysis_count': AnalysisDailyStat.analysis_count + stmt.excluded.analysis_count,
+                'confidence_sum': AnalysisDailyStat.confidence_sum + stmt.excluded.confidence_sum
+            }
+        ))
+
+class ShadowPrediction(db.Model):
+    """A candidate model's prediction recorded next to the primary one for the same upload"""
+    __tablename__ = 'shadow_predictions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    primary_version = db.Column(db.String(64), nullable=False)
+    primary_skin_type = db.Column(db.String(50), nullable=False)
+    primary_confidence = db.Column(db.Float, nullable=False)
+    primary_latency_ms = db.Column(db.Float, nullable=False)
+    candidate_version = db.Column(db.String(64), nullable=False, index=True)
+    candidate_skin_type = db.Column(db.String(50), nullable=False)
+    candidate_confidence = db.Column(db.Float, nullable=False)
+    candidate_latency_ms = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class ArchivePartition(db.Model):
+    """One monthly archive database of old analyses, see services/archive.py"""
+    __tablename__ = 'archive_partitions'
+    
+    month = db.Column(db.String(7), primary_key=True)  # 'YYYY-MM'
+    min_id = db.Column(db.Integer, nullable=True)
+    max_id = db.Column(db.Integer, nullable=True)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def iter_analysis_chunks(columns, criteria=(), after_id=0, chunk_size=1000):
+    """
+    Yield lists of Analysis column tuples in primary-key order, chunk_size at a time.
+    Each chunk is a separate keyset query (id > last seen id), so memory stays flat,
+    no read transaction is held open between chunks and callers can resume from any id.
+    The first column must be Analysis.id.
+    """
+    last_id = after_id
+    while True:
+        stmt = select(*columns).where(Analysis.id > last_id, *criteria).order_by(Analysis.id).limit(chunk_size)
+        rows = db.session.execute(stmt.execution_options(stream_results=True)).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+def upgrade_schema():
+    """
+    Add columns and indexes introduced after a table was first created.
+    db.create_all() only creates missing tables, so existing SQLite files would
+    otherwise lack them. Only nullable columns are added this way.
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            print(f"✓ Added column {table.name}.{column.name}")
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
@@ -0,0 +1,154 @@
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import func, case
+from config import Config
+from models import db, User, ShadowPrediction
+from services import model_registry
+from services.ml_service import get_analyzer
+from services import degradation
+from services.shadow import get_shadow_runner
+import os
+
+admin_bp = Blueprint('admin', __name__)
+
+
+def admin_required(fn):
+    """JWT-protected route restricted to users listed in ADMIN_EMAILS"""
+    @wraps(fn)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        user = User.query.get(get_jwt_identity())
+        if not user or user.email not in Config.ADMIN_EMAILS:
+            return jsonify({'error': 'Admin access required'}), 403
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+@admin_bp.route('/model', methods=['GET'])
+@admin_required
+def get_model_status():
+    try:
+        return jsonify({
+            'serving_version': get_analyzer().model_version,
+            'active_version': model_registry.current_version(),
+            'versions': model_registry.list_versions()
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@admin_bp.route('/model/activate', methods=['POST'])
+@admin_required
+def activate_model():
+    try:
+        data = request.get_json()
+
+        if not data or not data.get('version'):
+            return jsonify({'error': 'Missing version'}), 400
+
+        version = data['version']
+        try:
+            model_registry.activate(version)
+        except model_registry.RegistryError as e:
+            return jsonify({'error': str(e)}), 404
+
+        # This process swaps now; the other workers pick up CURRENT via their watcher
+        get_analyzer().swap_in_background(version)
+
+        return jsonify({
+            'message': f'Activating model {version}',
+            'serving_version': get_analyzer().model_version
+        }), 202
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@admin_bp.route('/shadow/report', methods=['GET'])
+@admin_required
+def get_shadow_report():
+    """Agreement rate and latency deltas of each candidate against the primary model"""
+    try:
+        days = request.args.get('days', 7, type=int)
+        since = datetime.utcnow() - timedelta(days=days)
+        agree = case((ShadowPrediction.primary_skin_type == ShadowPrediction.candidate_skin_type, 1), else_=0)
+
+        rows = db.session.query(
+            ShadowPrediction.candidate_version,
+            ShadowPrediction.primary_version,
+            func.count(ShadowPrediction.id),
+            func.sum(agree),
+            func.avg(ShadowPrediction.primary_confidence),
+            func.avg(ShadowPrediction.candidate_confidence),
+            func.avg(ShadowPrediction.primary_latency_ms),
+            func.avg(ShadowPrediction.candidate_latency_ms)
+        ).filter(
+            ShadowPrediction.created_at >= since
+        ).group_by(
+            ShadowPrediction.candidate_version, ShadowPrediction.primary_version
+        ).all()
+
+        # Where the two models disagree, broken down by label pair
+        pairs = db.session.query(
+            ShadowPrediction.candidate_version,
+            ShadowPrediction.primary_skin_type,
+            ShadowPrediction.candidate_skin_type,
+            func.count(ShadowPrediction.id)
+        ).filter(
+            ShadowPrediction.created_at >= since,
+            ShadowPrediction.primary_skin_type != ShadowPrediction.candidate_skin_type
+        ).group_by(
+            ShadowPrediction.candidate_version,
+            ShadowPrediction.primary_skin_type,
+            ShadowPrediction.candidate_skin_type
+        ).all()
+
+        disagreements = {}
+        for candidate, primary_type, candidate_type, count in pairs:
+            disagreements.setdefault(candidate, []).append({
+                'primary': primary_type, 'candidate': candidate_type, 'count': count
+            })
+
+        report = []
+        for candidate, primary, count, agreed, p_conf, c_conf, p_lat, c_lat in rows:
+            report.append({
+                'candidate_version': candidate,
+                'primary_version': primary,
+                'samples': count,
+                'agreement_rate': round(agreed / count, 4),
+                'primary_mean_confidence': round(p_conf, 2),
+                'candidate_mean_confidence': round(c_conf, 2),
+                'primary_mean_latency_ms': round(p_lat, 2),
+                'candidate_mean_latency_ms': round(c_lat, 2),
+                'latency_delta_ms': round(c_lat - p_lat, 2),
+                'disagreements': disagreements.get(candidate, [])
+            })
+
+        return jsonify({
+            'since': since.isoformat(),
+            'sample_rate': Config.SHADOW_SAMPLE_RATE,
+            'candidates': report
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@admin_bp.route('/metrics', methods=['GET'])
+@admin_required
+def get_metrics():
+    """Degradation mode, its switches, the re-score queue and shadow throughput, for this worker process"""
+    try:
+        return jsonify({
+            'pid': os.getpid(),
+            'serving_version': get_analyzer().model_version,
+            'degradation': degradation.get_degradation_controller().snapshot(),
+            'rescore': dict(degradation.rescore_stats, pending=degradation.pending_count()),
+            'shadow': get_shadow_runner().snapshot()
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
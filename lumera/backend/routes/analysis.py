@@ -1,11 +1,26 @@
-from flask import Blueprint, request, jsonify, send_from_directory
+from flask import Blueprint, request, jsonify, send_from_directory, current_app, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from werkzeug.utils import secure_filename
-from models import db, Analysis, User
+from sqlalchemy import select, func
+from datetime import datetime, timedelta
+from models import db, Analysis, AnalysisDailyStat, User, record_daily_stat, iter_analysis_chunks
 from services.ml_service import analyze_skin
-from utils.helpers import allowed_file
+from services.executor import run_cpu_bound, run_fast_path
+from services.recommendations import encode_ids
+from services.duplicates import get_duplicate_index
+from services.embedding_index import get_embedding_index, encode_embedding, decode_embedding
+from services.storage import store_upload, upload_dir, received_bytes, append_chunk, attach_original_later, save_temp
+from services.frames import analyze_frames, video_frames, burst_frames
+from services.degradation import get_degradation_controller
+from services import archive, export
+from utils.helpers import allowed_file, parse_content_range
+from utils.imagehash import dhash, to_signed64
+from config import Config
+from utils.serialization import analysis_projection, analysis_row_to_dict
+from werkzeug.datastructures import FileStorage
+import cv2
+import io
 import os
-import json
+import numpy as np
 
 analysis_bp = Blueprint('analysis', __name__)
 
@@ -30,62 +45,472 @@ def upload_image():
         if not allowed_file(file.filename):
             return jsonify({'error': 'Invalid file type. Only PNG, JPG, JPEG allowed'}), 400
         
-        filename = secure_filename(f"{user_id}_{int(os.path.getmtime('.'))}_{file.filename}")
-        upload_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
-        os.makedirs(upload_folder, exist_ok=True)
+        # Two-phase upload: `image` is a downscaled preview and the client will
+        # send the full-resolution original (this many bytes) in chunks
+        original_size = request.form.get('original_size', type=int)
+        if original_size is not None and not 0 < original_size <= Config.MAX_CONTENT_LENGTH:
+            return jsonify({'error': 'original_size must be between 1 byte and the upload size limit'}), 400
         
-        filepath = os.path.join(upload_folder, filename)
-        file.save(filepath)
+        # Perceptual hash from the upload stream, before anything is written or analyzed
+        try:
+            phash = dhash(file.stream)
+        except (OSError, ValueError):
+            return jsonify({'error': 'Could not read image'}), 400
+        finally:
+            file.stream.seek(0)
         
-        result = analyze_skin(filepath)
+        near_duplicate = None
+        if Config.PHASH_DUPLICATE_POLICY != 'off':
+            match = get_duplicate_index().find(int(user_id), phash)
+            if match:
+                previous = Analysis.query.filter_by(id=match[0], user_id=user_id).first()
+                if previous:
+                    near_duplicate = {'analysis_id': previous.id, 'distance': match[1]}
+                    if Config.PHASH_DUPLICATE_POLICY == 'reuse':
+                        return jsonify({
+                            'message': 'This photo matches a recent analysis; returning that result',
+                            'analysis': previous.to_dict(),
+                            'near_duplicate': near_duplicate
+                        }), 200
+        
+        # Content-addressed name: identical uploads share one file, different ones never collide
+        filename = store_upload(file)
+        filepath = os.path.join(upload_dir(), filename)
+        
+        # Optional comma-separated areas of concern, e.g. "t_zone,cheeks"
+        regions = request.form.get('regions')
+        regions = {r.strip() for r in regions.split(',') if r.strip()} if regions else None
+        
+        controller = get_degradation_controller()
+        if controller.should_degrade():
+            # Overloaded: the rule-based answer now, on its own small pool rather than
+            # behind the queued model work; the row is re-scored once load subsides
+            result = run_fast_path(analyze_skin, filepath, regions, provisional=True)
+        else:
+            with controller.track():
+                result = run_cpu_bound(analyze_skin, filepath, regions)
         
         analysis = Analysis(
             user_id=user_id,
             image_path=filename,
             skin_type=result['skin_type'],
             confidence=result['confidence'],
-            recommendations=json.dumps(result['recommendations'])
+            recommendations='',
+            recommendation_ids=encode_ids(result['recommendation_ids']),
+            model_version=result['model_version'],
+            phash=to_signed64(phash),
+            embedding=encode_embedding(result['embedding']) if result['embedding'] is not None else None,
+            original_size=original_size,
+            original_status='pending' if original_size else None,
+            provisional=result['provisional'] or None
         )
         
         db.session.add(analysis)
+        db.session.flush()
+        record_daily_stat(analysis)
         db.session.commit()
+        get_duplicate_index().add(int(user_id), phash, analysis.id, analysis.created_at)
         
-        return jsonify({
+        response = {
             'message': 'Analysis completed successfully',
             'analysis': analysis.to_dict()
+        }
+        if near_duplicate:
+            response['near_duplicate'] = near_duplicate
+        if original_size:
+            response['original_upload'] = {
+                'url': f'/api/analysis/{analysis.id}/original',
+                'total': original_size,
+                'received': 0,
+                'chunk_size': Config.UPLOAD_CHUNK_BYTES
+            }
+        return jsonify(response), 201
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+@analysis_bp.route('/burst', methods=['POST'])
+@jwt_required()
+def upload_burst():
+    """
+    Analyze a short video (`video`) or a burst of photos (several `frames`)
+    as one sample. Sharp, distinct frames are scored together and the result
+    is stored as a single Analysis with the sharpest frame as its image.
+    """
+    video_path = None
+    try:
+        user_id = get_jwt_identity()
+        user = User.query.get(user_id)
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        # A burst scores several frames on the model; there is no cheap answer for it
+        controller = get_degradation_controller()
+        if controller.should_degrade():
+            return jsonify({'error': 'Server is busy; try again shortly or upload a single photo'}), 503, {
+                'Retry-After': str(int(Config.DEGRADE_MIN_DWELL_SECONDS))
+            }
+        
+        video = request.files.get('video')
+        bursts = [f for f in request.files.getlist('frames') if f.filename]
+        if video is not None and video.filename:
+            ext = video.filename.rsplit('.', 1)[-1].lower() if '.' in video.filename else ''
+            if ext not in Config.VIDEO_EXTENSIONS:
+                return jsonify({'error': f"Invalid video type. Allowed: {', '.join(sorted(Config.VIDEO_EXTENSIONS))}"}), 400
+            # OpenCV decodes from a path; the clip is streamed to disk, not memory
+            video_path = save_temp(video.stream, ext)
+            frames = video_frames(video_path)
+        elif bursts:
+            if not all(allowed_file(f.filename) for f in bursts):
+                return jsonify({'error': 'Invalid file type. Only PNG, JPG, JPEG allowed'}), 400
+            frames = burst_frames(bursts)
+        else:
+            return jsonify({'error': 'Provide a video file or one or more frames'}), 400
+        
+        regions = request.form.get('regions')
+        regions = {r.strip() for r in regions.split(',') if r.strip()} if regions else None
+        
+        try:
+            with controller.track():
+                result, best_frame = analyze_frames(frames, regions)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        ok, encoded = cv2.imencode('.jpg', best_frame, [cv2.IMWRITE_JPEG_QUALITY, 92])
+        if not ok:
+            raise ValueError('Could not encode the selected frame')
+        filename = store_upload(FileStorage(io.BytesIO(encoded.tobytes()), filename='frame.jpg'))
+        with open(os.path.join(upload_dir(), filename), 'rb') as f:
+            phash = dhash(f)
+        
+        analysis = Analysis(
+            user_id=user_id,
+            image_path=filename,
+            skin_type=result['skin_type'],
+            confidence=result['confidence'],
+            recommendations='',
+            recommendation_ids=encode_ids(result['recommendation_ids']),
+            model_version=result['model_version'],
+            phash=to_signed64(phash),
+            embedding=encode_embedding(result['embedding']) if result['embedding'] is not None else None
+        )
+        
+        db.session.add(analysis)
+        db.session.flush()
+        record_daily_stat(analysis)
+        db.session.commit()
+        get_duplicate_index().add(int(user_id), phash, analysis.id, analysis.created_at)
+        
+        return jsonify({
+            'message': 'Analysis completed successfully',
+            'analysis': analysis.to_dict(),
+            'frames': result['frames']
         }), 201
     
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
+    finally:
+        if video_path and os.path.exists(video_path):
+            os.remove(video_path)
+
+
+def _original_state(analysis):
+    return {
+        'status': analysis.original_status,
+        'received': analysis.original_size if analysis.original_status in ('processing', 'complete')
+        else received_bytes(analysis.id),
+        'total': analysis.original_size
+    }
+
+
+@analysis_bp.route('/<int:analysis_id>/original', methods=['GET'])
+@jwt_required()
+def get_original_upload(analysis_id):
+    """How much of the original has arrived, so an interrupted client knows where to resume"""
+    try:
+        user_id = get_jwt_identity()
+        analysis = Analysis.query.filter_by(id=analysis_id, user_id=user_id).first()
+        
+        if not analysis or analysis.original_status is None:
+            return jsonify({'error': 'No original upload for this analysis'}), 404
+        
+        return jsonify(_original_state(analysis)), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@analysis_bp.route('/<int:analysis_id>/original', methods=['PUT'])
+@jwt_required()
+def put_original_chunk(analysis_id):
+    """
+    Append one chunk of the original, sent as the raw body with a
+    `Content-Range: bytes start-end/total` header. The body is streamed to
+    disk, never held in memory. Once the last byte arrives the original is
+    attached in the background and the response is 202.
+    """
+    try:
+        user_id = get_jwt_identity()
+        analysis = Analysis.query.filter_by(id=analysis_id, user_id=user_id).first()
+        
+        if not analysis or analysis.original_status is None:
+            return jsonify({'error': 'No original upload for this analysis'}), 404
+        
+        if analysis.original_status != 'pending':
+            return jsonify(dict(_original_state(analysis), error='Original upload is no longer accepting chunks')), 409
+        
+        content_range = parse_content_range(request.headers.get('Content-Range'))
+        if content_range is None:
+            return jsonify({'error': 'Content-Range header required: bytes start-end/total'}), 400
+        start, end, total = content_range
+        if total != analysis.original_size:
+            return jsonify({'error': f'Total size does not match original_size ({analysis.original_size})'}), 400
+        if end - start + 1 > Config.UPLOAD_CHUNK_MAX_BYTES:
+            return jsonify({'error': f'Chunks are limited to {Config.UPLOAD_CHUNK_MAX_BYTES} bytes'}), 413
+        
+        received = append_chunk(analysis_id, request.stream, start, end - start + 1)
+        if received != end + 1:
+            # Out of order, repeated or cut short: the client resumes from `received`
+            return jsonify(dict(_original_state(analysis), error='Resume from the received offset')), 409
+        
+        if received < total:
+            return jsonify(_original_state(analysis)), 200
+        
+        analysis.original_status = 'processing'
+        db.session.commit()
+        attach_original_later(current_app._get_current_object(), analysis_id)
+        return jsonify(_original_state(analysis)), 202
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
 
 
 @analysis_bp.route('/history', methods=['GET'])
 @jwt_required()
 def get_analysis_history():
+    """Newest first; `limit` and `before` (ISO timestamp) page through hot and archived rows alike"""
     try:
         user_id = get_jwt_identity()
-        analyses = Analysis.query.filter_by(user_id=user_id).order_by(Analysis.created_at.desc()).all()
+        limit = request.args.get('limit', type=int)
+        limit = max(limit, 1) if limit is not None else None
+        before = request.args.get('before')
+        try:
+            before = datetime.fromisoformat(before) if before else None
+        except ValueError:
+            return jsonify({'error': 'before must be an ISO timestamp'}), 400
+        
+        stmt = select(*analysis_projection()).where(Analysis.user_id == user_id)
+        if before is not None:
+            stmt = stmt.where(Analysis.created_at < before)
+        stmt = stmt.order_by(Analysis.created_at.desc())
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        rows = db.session.execute(stmt).all()
+        
+        # Archive months are only opened when the recent rows do not fill the page
+        if limit is None or len(rows) < limit:
+            remaining = None if limit is None else limit - len(rows)
+            rows += archive.history_rows(int(user_id), before, remaining, {row[0] for row in rows})
+            rows.sort(key=lambda row: row[-1], reverse=True)
         
         return jsonify({
-            'analyses': [analysis.to_dict() for analysis in analyses]
+            'analyses': [analysis_row_to_dict(row) for row in rows]
         }), 200
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@analysis_bp.route('/export', methods=['GET'])
+@jwt_required()
+def export_analysis_history():
+    """
+    Stream the whole history as NDJSON (default) or CSV (`format=csv`), oldest
+    first. `image_urls=1` adds signed image links. The body is gzip-encoded on
+    the fly when the client accepts it.
+    """
+    try:
+        user_id = int(get_jwt_identity())
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in export.FORMATS:
+            return jsonify({'error': f"format must be one of: {', '.join(export.FORMATS)}"}), 400
+        image_urls = request.args.get('image_urls', '0') in ('1', 'true')
+        compress = bool(request.accept_encodings['gzip']) and request.args.get('gzip', '1') != '0'
+        
+        mimetype, extension = export.FORMATS[fmt]
+        response = Response(
+            stream_with_context(export.export_chunks(user_id, fmt, image_urls, compress)),
+            mimetype=mimetype
+        )
+        response.headers['Content-Disposition'] = (
+            f"attachment; filename=lumera-analyses-{datetime.utcnow():%Y%m%d}.{extension}"
+        )
+        response.headers['X-Accel-Buffering'] = 'no'  # let nginx pass chunks through as they come
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        return response
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @analysis_bp.route('/result/<int:analysis_id>', methods=['GET'])
 @jwt_required()
 def get_analysis_result(analysis_id):
     try:
         user_id = get_jwt_identity()
+        row = db.session.execute(
+            select(*analysis_projection())
+            .where(Analysis.id == analysis_id, Analysis.user_id == user_id)
+        ).first()
+        if not row:
+            row = archive.find_row(analysis_id, int(user_id))
+        
+        if not row:
+            return jsonify({'error': 'Analysis not found'}), 404
+        
+        return jsonify({'analysis': analysis_row_to_dict(row)}), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@analysis_bp.route('/stats', methods=['GET'])
+@jwt_required()
+def get_analysis_stats():
+    """Skin type and confidence trends from the per-day aggregates (O(days), not O(analyses))"""
+    try:
+        user_id = get_jwt_identity()
+        days = min(max(request.args.get('days', 90, type=int), 1), 3650)
+        window = min(max(request.args.get('window', 7, type=int), 1), days)
+        start_day = datetime.utcnow().date() - timedelta(days=days - 1)
+        
+        rows = db.session.query(
+            AnalysisDailyStat.day,
+            AnalysisDailyStat.skin_type,
+            AnalysisDailyStat.analysis_count,
+            AnalysisDailyStat.confidence_sum
+        ).filter(
+            AnalysisDailyStat.user_id == user_id,
+            AnalysisDailyStat.day >= start_day
+        ).order_by(AnalysisDailyStat.day).all()
+        
+        daily = {}
+        totals = {}
+        for day, skin_type, count, confidence_sum in rows:
+            entry = daily.setdefault(day, {'counts': {}, 'analyses': 0, 'confidence_sum': 0.0})
+            entry['counts'][skin_type] = count
+            entry['analyses'] += count
+            entry['confidence_sum'] += confidence_sum
+            totals[skin_type] = totals.get(skin_type, 0) + count
+        
+        # Rolling mean confidence over the trailing `window` days, one point per day
+        series = []
+        per_day = []
+        window_count = 0
+        window_sum = 0.0
+        for offset in range(days):
+            day = start_day + timedelta(days=offset)
+            entry = daily.get(day)
+            count, confidence_sum = (entry['analyses'], entry['confidence_sum']) if entry else (0, 0.0)
+            per_day.append((count, confidence_sum))
+            window_count += count
+            window_sum += confidence_sum
+            if len(per_day) > window:
+                old_count, old_sum = per_day[-window - 1]
+                window_count -= old_count
+                window_sum -= old_sum
+            series.append({
+                'date': day.isoformat(),
+                'counts': entry['counts'] if entry else {},
+                'mean_confidence': round(confidence_sum / count, 2) if count else None,
+                'rolling_mean_confidence': round(window_sum / window_count, 2) if window_count else None
+            })
+        
+        total_analyses = sum(totals.values())
+        return jsonify({
+            'days': days,
+            'window': window,
+            'total_analyses': total_analyses,
+            'skin_type_totals': totals,
+            'dominant_skin_type': max(totals, key=totals.get) if totals else None,
+            'mean_confidence': round(sum(e['confidence_sum'] for e in daily.values()) / total_analyses, 2) if total_analyses else None,
+            'daily': series
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@analysis_bp.route('/similar/<int:analysis_id>', methods=['GET'])
+@jwt_required()
+def get_similar_analyses(analysis_id):
+    """
+    The caller's own past analyses closest to this one by embedding, plus an
+    anonymised neighbourhood: skin-type counts of the nearest analyses across
+    all users. Other users' analyses are only counted there, never listed.
+    Only analyses from the same model_version are compared, since embeddings
+    of different networks are not comparable.
+    """
+    try:
+        user_id = get_jwt_identity()
+        k = min(max(request.args.get('k', 10, type=int), 1), 100)
         analysis = Analysis.query.filter_by(id=analysis_id, user_id=user_id).first()
         
         if not analysis:
             return jsonify({'error': 'Analysis not found'}), 404
         
-        return jsonify({'analysis': analysis.to_dict()}), 200
+        if analysis.embedding is None:
+            return jsonify({'error': 'No embedding stored for this analysis'}), 409
+        
+        query = decode_embedding(analysis.embedding).astype(np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        
+        # Exact cosine over the caller's own embeddings, a chunk at a time
+        candidates = []
+        chunks = iter_analysis_chunks(
+            (Analysis.id, Analysis.embedding),
+            (Analysis.user_id == user_id, Analysis.id != analysis_id, Analysis.embedding.isnot(None),
+             Analysis.model_version == analysis.model_version)
+        )
+        for rows in chunks:
+            vectors = np.stack([decode_embedding(row[1]) for row in rows]).astype(np.float32)
+            scores = vectors @ query / np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)
+            candidates.extend(zip((row[0] for row in rows), scores.tolist()))
+        candidates = sorted(candidates, key=lambda c: -c[1])[:k]
+        rows = {
+            row.id: row for row in db.session.query(
+                Analysis.id, Analysis.image_path, Analysis.skin_type, Analysis.confidence, Analysis.created_at
+            ).filter(Analysis.id.in_([match_id for match_id, _ in candidates]))
+        }
+        similar = [{
+            'analysis_id': match_id,
+            'similarity': round(similarity, 4),
+            'skin_type': rows[match_id].skin_type,
+            'confidence': rows[match_id].confidence,
+            'created_at': rows[match_id].created_at.isoformat(),
+            'image_path': rows[match_id].image_path
+        } for match_id, similarity in candidates if match_id in rows]
+        
+        # Counts only, and only when enough analyses are pooled that none stands out
+        size = Config.SIMILAR_NEIGHBOURHOOD
+        index = get_embedding_index(analysis.model_version)
+        ids = [match_id for match_id, _ in index.search(query, size + 1) if match_id != analysis_id]
+        skin_types = dict(
+            db.session.query(Analysis.skin_type, func.count())
+            .filter(Analysis.id.in_(ids[:size]), Analysis.model_version == analysis.model_version)
+            .group_by(Analysis.skin_type).all()
+        ) if ids else {}
+        pooled = sum(skin_types.values())
+        neighbourhood = {'size': pooled, 'skin_types': skin_types} if pooled >= Config.SIMILAR_MIN_NEIGHBOURHOOD else None
+        
+        return jsonify({'analysis_id': analysis_id, 'similar': similar, 'neighbourhood': neighbourhood}), 200
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -95,8 +520,24 @@ def get_analysis_result(analysis_id):
 @jwt_required()
 def get_uploaded_image(filename):
     try:
-        upload_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
-        return send_from_directory(upload_folder, filename)
+        return send_from_directory(upload_dir(), filename)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 404
+
+
+@analysis_bp.route('/image/<token>', methods=['GET'])
+def get_signed_image(token):
+    """Image link from an export; the signature stands in for the bearer token"""
+    signed = export.verify_image_token(token)
+    if signed is None:
+        return jsonify({'error': 'Invalid or expired link'}), 403
+    try:
+        filename = export.current_image_path(*signed)
+        if filename is None:
+            return jsonify({'error': 'Analysis not found'}), 404
+        
+        return send_from_directory(upload_dir(), filename)
     
     except Exception as e:
-        return jsonify({'error': str(e)}), 404
\ No newline at end of file
+        return jsonify({'error': str(e)}), 404
@@ -0,0 +1,161 @@
+"""
+Luméra server launcher
+
+    python serve.py --mode dev     # Flask development server (same as python app.py)
+    python serve.py --mode prod    # gunicorn + gevent, workers sized from CPU cores
+
+In prod mode every worker runs its requests on a gevent event loop, so
+I/O-bound endpoints (auth, history, result, image fetch) never hold an OS
+thread while waiting on the network or disk. CPU-bound analysis is handed to
+a thread pool (services/executor.py). Uploaded images are streamed with
+sendfile(2) by gunicorn, or via X-Sendfile when USE_X_SENDFILE=1 and a proxy
+serves the files. Model input tensors come from one shared-memory pool that
+the master creates before forking (services/buffer_pool.py).
+"""
+import argparse
+import os
+import sys
+from utils.helpers import available_cores
+
+
+def default_worker_count():
+    """One worker per available core; each worker holds its own copy of the model"""
+    from config import Config
+    return Config.WEB_CONCURRENCY or available_cores()
+
+
+def pick_worker_class():
+    try:
+        import gevent  # noqa: F401
+        return 'gevent'
+    except ImportError:
+        print("⚠ gevent not installed, falling back to threaded workers")
+        return 'gthread'
+
+
+def run_dev(host, port):
+    from app import create_app, start_background_jobs
+    app = create_app()
+    start_background_jobs(app)
+    print(f"🚀 Starting Luméra Backend (development) on port {port}...")
+    app.run(debug=True, host=host, port=port)
+
+
+def run_prod(host, port, workers, worker_class, timeout):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit("❌ gunicorn is required for --mode prod (pip install gunicorn gevent)")
+
+    # Read by services/executor.py and services/runtime.py in every worker to
+    # size the analysis pool and the TensorFlow/BLAS thread pools
+    os.environ['WEB_CONCURRENCY'] = str(workers)
+    from services import runtime
+    runtime.configure_environment()
+    host_cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None
+
+    from config import Config
+    shared_pool = {}
+
+    def on_starting(server):
+        # Created before the fork so every worker inherits the same buffers
+        if not Config.TENSOR_POOL_SHARED:
+            return
+        from services.buffer_pool import TensorPool, install_pool
+        size = Config.MODEL_INPUT_SIZE
+        pool = TensorPool(workers * Config.TENSOR_POOL_SLOTS, (size, size, 3), shared=True)
+        install_pool(pool)
+        shared_pool['pool'] = pool
+        print(f"✓ Shared tensor pool: {pool.slots} x {size}x{size}x3 float32 ({pool.name})")
+
+    def on_exit(server):
+        if 'pool' in shared_pool:
+            shared_pool['pool'].close(unlink=True)
+
+    def child_exit(server, worker):
+        # A worker killed inside TensorPool.acquire() never released its slots
+        if 'pool' in shared_pool:
+            freed = shared_pool['pool'].release_process(worker.pid)
+            if freed:
+                server.log.warning(f"Released {freed} tensor pool slots held by worker {worker.pid}")
+
+    def pre_fork(server, worker):
+        # Lowest core slot not held by a live worker, so replacements reuse freed cores
+        taken = {getattr(w, 'core_slot', None) for w in server.WORKERS.values()}
+        worker.core_slot = next(slot for slot in range(workers + 1) if slot not in taken)
+    
+    def post_fork(server, worker):
+        cores = runtime.worker_cores(worker.core_slot, workers, host_cores)
+        runtime.pin_to_cores(cores)
+        server.log.info(f"Worker {worker.pid} pinned to cores {sorted(cores)}")
+    
+    def post_worker_init(worker):
+        # Load the model before the first request instead of during it
+        from services.ml_service import get_analyzer
+        get_analyzer()
+        # Compactor, archiver and rescorer run in serving workers only, never in CLI processes
+        from app import start_background_jobs
+        start_background_jobs(worker.wsgi)
+
+    options = {
+        'bind': f'{host}:{port}',
+        'workers': workers,
+        'worker_class': worker_class,
+        'worker_connections': 1000,
+        'threads': 1 if worker_class == 'gevent' else 4,
+        'timeout': timeout,
+        'keepalive': 5,
+        'sendfile': True,
+        # TensorFlow is not fork-safe, so the app is built inside each worker
+        'preload_app': False,
+        'on_starting': on_starting,
+        'on_exit': on_exit,
+        'child_exit': child_exit,
+        'post_worker_init': post_worker_init,
+        'accesslog': '-',
+    }
+
+    if Config.PIN_WORKER_CORES and host_cores:
+        options.update(pre_fork=pre_fork, post_fork=post_fork)
+    
+    class LumeraApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app import create_app
+            return create_app()
+
+    print(f"🚀 Starting Luméra Backend (production) on port {port}")
+    print(f"   {workers} x {worker_class} workers, {available_cores()} cores available, "
+          f"{runtime.thread_settings()['intra_op']} TF threads per worker"
+          + (" (pinned)" if Config.PIN_WORKER_CORES and host_cores else ""))
+    LumeraApplication().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the Luméra backend')
+    parser.add_argument('--mode', choices=['dev', 'prod'], default='dev')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=3001)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per available core)')
+    parser.add_argument('--worker-class', choices=['gevent', 'gthread'], default=None)
+    parser.add_argument('--timeout', type=int, default=120)
+    args = parser.parse_args()
+
+    if args.mode == 'dev':
+        run_dev(args.host, args.port)
+    else:
+        run_prod(
+            args.host,
+            args.port,
+            args.workers or default_worker_count(),
+            args.worker_class or pick_worker_class(),
+            args.timeout
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+Hot/cold partitioning of the analyses table
+
+Analyses older than ARCHIVE_AFTER_DAYS move from the main database into one
+SQLite file per month, e.g. instance/archive/analyses_2024_03.db. The
+archive_partitions table in the main database records each file's month, id
+range and row count. So the hot table, its indexes and VACUUM only scale
+with recent rows.
+
+The archival job is online. It moves ARCHIVE_BATCH_SIZE rows at a time: it
+deletes them from the hot table, copies the deleted rows into their month's
+file and only then commits the delete, all in a short write transaction, and
+pauses between batches so that request writes are not starved. A run that
+stops before the commit leaves the rows hot; the next one copies them again. The newest analysis is never
+archived, which keeps SQLite from handing out an archived id again.
+
+Reads go through history_rows() and find_row(). /api/analysis/history and
+/api/analysis/result fall back to them, so clients see one table.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import MetaData, Table, Column, Index, create_engine, event, inspect, text, select, insert, delete, update, func
+from config import Config
+from models import db, Analysis, ArchivePartition
+from services.executor import start_background
+from utils.helpers import try_lock
+from utils.serialization import analysis_projection
+import os
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Same columns as analyses, without the users foreign key
+_metadata = MetaData()
+archive_table = Table(
+    'analyses', _metadata,
+    *[Column(column.name, column.type, primary_key=column.primary_key) for column in Analysis.__table__.columns],
+    Index('ix_archive_user_created', 'user_id', 'created_at')
+)
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def archive_dir():
+    path = Config.ARCHIVE_DIR
+    if not os.path.isabs(path):
+        path = os.path.join(BACKEND_DIR, path)
+    return path
+
+
+def partition_path(month):
+    """File for a 'YYYY-MM' month"""
+    return os.path.join(archive_dir(), f"analyses_{month.replace('-', '_')}.db")
+
+
+def _add_missing_columns(engine):
+    """Months archived before a column was added to analyses get it as NULL, like upgrade_schema()"""
+    existing = {column['name'] for column in inspect(engine).get_columns('analyses')}
+    for column in archive_table.columns:
+        if column.name not in existing:
+            with engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE analyses ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}'))
+
+
+def _engine(month):
+    path = partition_path(month)
+    with _engines_lock:
+        engine = _engines.get(path)
+        if engine is None:
+            os.makedirs(archive_dir(), exist_ok=True)
+            engine = create_engine(f'sqlite:///{path}')
+
+            @event.listens_for(engine, 'connect')
+            def set_pragmas(dbapi_connection, _):
+                dbapi_connection.execute('PRAGMA journal_mode=WAL')
+                dbapi_connection.execute('PRAGMA busy_timeout=5000')
+
+            _metadata.create_all(engine)
+            _add_missing_columns(engine)
+            _engines[path] = engine
+    return engine
+
+
+def _projection(table=archive_table):
+    """analysis_projection() columns, in the same order, from an archive table"""
+    return [table.c[column.key] for column in analysis_projection()]
+
+
+def archive_batch(cutoff, batch_size):
+    """Move up to batch_size analyses created before cutoff; returns {month: rows moved}"""
+    newest_id = db.session.query(func.max(Analysis.id)).scalar()
+    hot = Analysis.__table__
+    # DELETE ... RETURNING takes the rows and SQLite's write lock in one statement, so a
+    # compactor repoint, reanalyze or attach can neither slip in before the copy nor be
+    # lost with the deleted row: it waits for the commit below and then finds the row
+    # archived (the compactor follows it there with repoint_image())
+    rows = db.session.execute(
+        delete(hot).where(hot.c.id.in_(
+            select(hot.c.id).where(hot.c.created_at < cutoff, hot.c.id != newest_id)
+            .order_by(hot.c.id).limit(batch_size)
+        )).returning(*[hot.c[c.name] for c in archive_table.columns])
+    ).mappings().all()
+    if not rows:
+        db.session.rollback()
+        return {}
+
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(row['created_at'].strftime('%Y-%m'), []).append(dict(row))
+
+    # The hot delete only commits after every copy; a crash in between leaves the rows
+    # hot, and the next run copies them again over whatever reached the archive
+    try:
+        for month, month_rows in by_month.items():
+            with _engine(month).begin() as conn:
+                conn.execute(insert(archive_table).prefix_with('OR REPLACE'), month_rows)
+                count, min_id, max_id = conn.execute(
+                    select(func.count(), func.min(archive_table.c.id), func.max(archive_table.c.id))
+                ).one()
+            partition = db.session.get(ArchivePartition, month)
+            if partition is None:
+                partition = ArchivePartition(month=month)
+                db.session.add(partition)
+            partition.row_count, partition.min_id, partition.max_id = count, min_id, max_id
+            partition.updated_at = datetime.utcnow()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return {month: len(month_rows) for month, month_rows in by_month.items()}
+
+
+def run_archival(older_than_days=None, batch_size=None, pause=None, max_batches=None, log=print):
+    """Archive everything older than older_than_days, batch by batch; returns a report dict"""
+    older_than_days = Config.ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    batch_size = batch_size or Config.ARCHIVE_BATCH_SIZE
+    pause = Config.ARCHIVE_BATCH_PAUSE if pause is None else pause
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    report = {'archived': 0, 'batches': 0, 'months': {}, 'cutoff': cutoff.isoformat()}
+    while max_batches is None or report['batches'] < max_batches:
+        moved = archive_batch(cutoff, batch_size)
+        if not moved:
+            break
+        report['batches'] += 1
+        for month, count in moved.items():
+            report['archived'] += count
+            report['months'][month] = report['months'].get(month, 0) + count
+        if report['batches'] % 20 == 0:
+            log(f"  {report['archived']:,} analyses archived...")
+        time.sleep(pause)
+    return report
+
+
+def partitions(before=None):
+    """Archive months, newest first, optionally only those that can hold rows before `before`"""
+    query = ArchivePartition.query.order_by(ArchivePartition.month.desc())
+    if before is not None:
+        query = query.filter(ArchivePartition.month <= before.strftime('%Y-%m'))
+    return query.all()
+
+
+def history_rows(user_id, before=None, limit=None, exclude_ids=()):
+    """A user's archived analyses as analysis_projection() rows, newest first"""
+    rows = []
+    for partition in partitions(before):
+        stmt = select(*_projection()).where(archive_table.c.user_id == user_id)
+        if before is not None:
+            stmt = stmt.where(archive_table.c.created_at < before)
+        stmt = stmt.order_by(archive_table.c.created_at.desc())
+        if limit is not None:
+            stmt = stmt.limit(limit - len(rows) + len(exclude_ids))
+        with _engine(partition.month).connect() as conn:
+            rows.extend(row for row in conn.execute(stmt) if row[0] not in exclude_ids)
+        if limit is not None and len(rows) >= limit:
+            return rows[:limit]
+    return rows
+
+
+def iter_user_rows(user_id, chunk_size):
+    """A user's archived analyses as lists of analysis_projection() rows, oldest month first, by id"""
+    for partition in reversed(partitions()):
+        last_id = 0
+        while True:
+            with _engine(partition.month).connect() as conn:
+                rows = conn.execute(
+                    select(*_projection())
+                    .where(archive_table.c.user_id == user_id, archive_table.c.id > last_id)
+                    .order_by(archive_table.c.id)
+                    .limit(chunk_size)
+                ).all()
+            if not rows:
+                break
+            yield rows
+            last_id = rows[-1][0]
+
+
+def find_row(analysis_id, user_id):
+    """One archived analysis as an analysis_projection() row, or None"""
+    candidates = ArchivePartition.query.filter(
+        ArchivePartition.min_id <= analysis_id, ArchivePartition.max_id >= analysis_id
+    )
+    for partition in candidates:
+        with _engine(partition.month).connect() as conn:
+            row = conn.execute(
+                select(*_projection()).where(archive_table.c.id == analysis_id, archive_table.c.user_id == user_id)
+            ).first()
+        if row is not None:
+            return row
+    return None
+
+
+def image_reference_counts():
+    """{image_path: archived analyses pointing at it}, so the storage compactor keeps those files"""
+    counts = {}
+    for partition in partitions():
+        with _engine(partition.month).connect() as conn:
+            for image_path, count in conn.execute(
+                select(archive_table.c.image_path, func.count()).group_by(archive_table.c.image_path)
+            ):
+                counts[image_path] = counts.get(image_path, 0) + count
+    return counts
+
+
+def repoint_image(old_name, new_name):
+    """Follow a transcoded upload in every archive month"""
+    for partition in partitions():
+        with _engine(partition.month).begin() as conn:
+            conn.execute(
+                update(archive_table).where(archive_table.c.image_path == old_name).values(image_path=new_name)
+            )
+
+
+def daily_totals():
+    """Yield (user_id, day, skin_type, count, confidence_sum) aggregated over the archives"""
+    day = func.date(archive_table.c.created_at)
+    for partition in partitions():
+        with _engine(partition.month).connect() as conn:
+            yield from conn.execute(
+                select(archive_table.c.user_id, day, archive_table.c.skin_type,
+                       func.count(), func.sum(archive_table.c.confidence))
+                .group_by(archive_table.c.user_id, day, archive_table.c.skin_type)
+            )
+
+
+def format_report(report):
+    months = ', '.join(f"{month}: {count:,}" for month, count in sorted(report['months'].items()))
+    return (f"{report['archived']:,} analyses archived in {report['batches']:,} batches"
+            + (f" ({months})" if months else ''))
+
+
+_archiver = None
+
+
+def start_archiver(app, interval_hours):
+    """Run run_archival() every interval_hours on a daemon thread inside an app context"""
+    global _archiver
+    if _archiver is not None or interval_hours <= 0:
+        return
+    lock_path = os.path.join(app.instance_path, 'archiver.lock')
+
+    def loop():
+        while True:
+            time.sleep(interval_hours * 3600)
+            handle = try_lock(lock_path)
+            if handle is None:
+                continue  # another worker is archiving
+            try:
+                with app.app_context():
+                    report = run_archival()
+                print(f"✓ Archival: {format_report(report)}")
+            except Exception as e:
+                print(f"⚠ Archival failed: {e}")
+            finally:
+                handle.close()
+
+    _archiver = start_background(loop, 'archiver')
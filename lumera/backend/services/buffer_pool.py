@@ -0,0 +1,146 @@
+"""
+Pre-allocated float32 input tensors for the model
+
+A TensorPool owns one contiguous (slots, H, W, 3) float32 block. acquire()
+lends out a (1, H, W, 3) view that preprocessing writes into in place, so a
+request allocates no input tensor of its own. When every slot is busy the
+caller gets a fresh array rather than waiting (counted as a miss).
+
+The block can live in multiprocessing.shared_memory. A pool created in the
+gunicorn master before workers fork is inherited by every worker, and the
+slot owners and lock are shared too, so all workers draw from one set of
+buffers. Processes that are not forked can attach() by name.
+
+Each slot records the pid that holds it. A worker killed inside acquire()
+cannot free its slot, so the master releases a dead worker's slots when it
+exits, and _claim() reclaims slots of dead processes once none is free.
+"""
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import multiprocessing
+import os
+import threading
+import numpy as np
+
+_HEADER_BYTES = 64  # slot owner pids are padded to a cache line before the tensors
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by another user
+    return True
+
+
+class TensorPool:
+    def __init__(self, slots, shape, shared=False, name=None, _attach=False, lock=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        header = max(_HEADER_BYTES, -(-slots * 4 // _HEADER_BYTES) * _HEADER_BYTES)
+        tensor_bytes = slots * int(np.prod(self.shape)) * 4
+        self.shm = None
+        if shared:
+            if _attach:
+                self.shm = shared_memory.SharedMemory(name=name)
+            else:
+                self.shm = shared_memory.SharedMemory(create=True, size=header + tensor_bytes, name=name)
+            buffer = self.shm.buf
+            self._lock = lock or multiprocessing.Lock()
+        else:
+            buffer = bytearray(header + tensor_bytes)
+            self._lock = lock or threading.Lock()
+
+        self._owners = np.ndarray((slots,), dtype=np.int32, buffer=buffer)  # 0 = free
+        self._tensors = np.ndarray((slots,) + self.shape, dtype=np.float32, buffer=buffer, offset=header)
+        if not _attach:
+            self._owners[:] = 0
+        self.acquired = 0
+        self.misses = 0
+        self.reclaimed = 0
+
+    @property
+    def name(self):
+        return self.shm.name if self.shm is not None else None
+
+    @classmethod
+    def attach(cls, name, slots, shape, lock):
+        """Open a pool created by another process; `lock` must be the creator's lock"""
+        return cls(slots, shape, shared=True, name=name, _attach=True, lock=lock)
+
+    def _reclaim_dead(self):
+        """Free slots whose owner process no longer exists; called with the lock held"""
+        held = np.flatnonzero(self._owners != 0)
+        dead = [index for index in held if not _alive(int(self._owners[index]))]
+        self._owners[dead] = 0
+        self.reclaimed += len(dead)
+        return len(dead)
+
+    def _claim(self):
+        with self._lock:
+            free = np.flatnonzero(self._owners == 0)
+            if not len(free) and self._reclaim_dead():
+                free = np.flatnonzero(self._owners == 0)
+            if not len(free):
+                return None
+            index = int(free[0])
+            self._owners[index] = os.getpid()
+            return index
+
+    def release_process(self, pid, timeout=1.0):
+        """
+        Free every slot `pid` still holds; returns how many. The server master
+        calls this when a worker exits, with a timeout in case the worker died
+        holding the lock.
+        """
+        if not self._lock.acquire(timeout=timeout):
+            return 0
+        try:
+            held = self._owners == pid
+            self._owners[held] = 0
+            return int(held.sum())
+        finally:
+            self._lock.release()
+
+    @contextmanager
+    def acquire(self):
+        """Yield a writable (1, H, W, 3) float32 tensor for the duration of the block"""
+        index = self._claim()
+        if index is None:
+            self.misses += 1
+            yield np.empty((1,) + self.shape, dtype=np.float32)
+            return
+        self.acquired += 1
+        try:
+            yield self._tensors[index:index + 1]
+        finally:
+            with self._lock:
+                self._owners[index] = 0
+
+    def close(self, unlink=False):
+        if self.shm is not None:
+            self._owners = self._tensors = None
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def install_pool(pool):
+    """Register a pool (e.g. a shared one made by the server master) for its shape"""
+    with _pools_lock:
+        _pools[pool.shape] = pool
+
+
+def get_tensor_pool(shape, slots=8):
+    """Pool for (H, W, 3) inputs; a private in-process pool is created on first use"""
+    shape = tuple(shape)
+    with _pools_lock:
+        if shape not in _pools:
+            _pools[shape] = TensorPool(slots, shape)
+        return _pools[shape]
@@ -0,0 +1,118 @@
+"""
+Compiled, shape-bucketed inference
+
+model.predict() builds a data adapter, a progress callback and a batched
+loop on every call, and retraces whenever the batch size changes. For
+request-sized inputs that overhead is a large share of the latency.
+
+CompiledPredictor traces one tf.function per batch-size bucket (1, 4, 8, 32
+by default), each with a fixed input signature, so a call never retraces.
+Inputs are zero-padded up to the nearest bucket, and batches larger than
+the biggest bucket are split into chunks of it. XLA JIT is chosen per
+bucket: INFERENCE_XLA=auto times both variants at warm-up and keeps the
+faster one, since XLA helps some shapes on CPU and slows down others.
+"""
+from config import Config
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+
+class KerasPredictor:
+    """Plain model.predict, used when compilation is disabled or not possible"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def warmup(self):
+        height, width = self.model.input_shape[1:3]
+        self(np.zeros((1, height, width, 3), dtype=np.float32))
+
+    def __call__(self, batch):
+        return self.model.predict(batch, verbose=0, batch_size=max(1, len(batch)))
+
+
+class CompiledPredictor:
+    def __init__(self, model, buckets=(1, 4, 8, 32), xla='auto'):
+        self.model = model
+        self.buckets = tuple(sorted(buckets))
+        self.input_shape = tuple(model.input_shape[1:])
+        self.xla_mode = xla
+        self.xla = {}  # bucket -> whether its graph is XLA-compiled
+        self._functions = {}
+        self._lock = threading.Lock()
+
+    def _trace(self, bucket, jit_compile):
+        spec = tf.TensorSpec((bucket,) + self.input_shape, tf.float32)
+        model = self.model
+        fn = tf.function(lambda x: model(x, training=False), input_signature=[spec], jit_compile=jit_compile)
+        fn.get_concrete_function()
+        return fn
+
+    @staticmethod
+    def _time(fn, x, repeat=5):
+        fn(x)  # XLA compiles on the first call
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn(x)
+        return (time.perf_counter() - start) / repeat
+
+    def _function(self, bucket):
+        fn = self._functions.get(bucket)
+        if fn is not None:
+            return fn
+        with self._lock:
+            if bucket in self._functions:
+                return self._functions[bucket]
+            if self.xla_mode == 'auto':
+                x = tf.zeros((bucket,) + self.input_shape, tf.float32)
+                plain, compiled = self._trace(bucket, False), self._trace(bucket, True)
+                try:
+                    use_xla = self._time(compiled, x) < self._time(plain, x)
+                except Exception as e:
+                    print(f"⚠ XLA unavailable for batch {bucket}: {e}")
+                    use_xla = False
+                fn = compiled if use_xla else plain
+            else:
+                use_xla = self.xla_mode == 'on'
+                fn = self._trace(bucket, use_xla)
+            self.xla[bucket] = use_xla
+            self._functions[bucket] = fn
+            return fn
+
+    def warmup(self):
+        """Trace (and in auto mode, time) every bucket now rather than on a request"""
+        for bucket in self.buckets:
+            fn = self._function(bucket)
+            fn(tf.zeros((bucket,) + self.input_shape, tf.float32))
+
+    def __call__(self, batch):
+        """Same result as model.predict(batch): an array, or a list of arrays for multi-output models"""
+        batch = np.asarray(batch, dtype=np.float32)
+        largest = self.buckets[-1]
+        chunks = []
+        for start in range(0, len(batch), largest):
+            chunk = batch[start:start + largest]
+            size = len(chunk)
+            bucket = next(b for b in self.buckets if b >= size)
+            if size < bucket:
+                padded = np.zeros((bucket,) + self.input_shape, dtype=np.float32)
+                padded[:size] = chunk
+                chunk = padded
+            outputs = self._function(bucket)(chunk)
+            if not isinstance(outputs, (list, tuple)):
+                outputs = [outputs]
+            chunks.append([output.numpy()[:size] for output in outputs])
+        merged = [np.concatenate(parts) for parts in zip(*chunks)]
+        return merged[0] if len(merged) == 1 else merged
+
+
+def make_predictor(model):
+    """CompiledPredictor for Keras models when INFERENCE_COMPILED is on, else model.predict"""
+    if model is None:
+        return None
+    if Config.INFERENCE_COMPILED and isinstance(model, keras.Model):
+        return CompiledPredictor(model, Config.INFERENCE_BUCKETS, Config.INFERENCE_XLA)
+    return KerasPredictor(model)
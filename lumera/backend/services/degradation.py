@@ -0,0 +1,265 @@
+"""
+Overload-aware degradation to the rule-based classifier
+
+DegradationController watches two signals in each worker process:
+- queue depth: model analyses submitted to the analysis pool and not yet
+  finished, whether queued or running
+- latency: p95 wall time of those analyses over the last
+  DEGRADE_WINDOW_SECONDS, including time spent waiting in the queue
+
+The mode switches to 'degraded' when the depth reaches DEGRADE_QUEUE_HIGH or
+the p95 exceeds DEGRADE_LATENCY_SLO_MS. While degraded, uploads skip the
+model: they get the classify_by_features() answer at once and are stored
+with provisional=True. The mode returns to 'normal' only after
+DEGRADE_MIN_DWELL_SECONDS, once the depth is down to DEGRADE_QUEUE_LOW and
+the p95 is under DEGRADE_RECOVER_RATIO x the SLO. The gap between the two
+thresholds keeps the mode from flapping at the boundary.
+
+Provisional rows are the re-score queue; it lives in the database, so it
+survives restarts. A background thread drains it in small batches, only
+while the worker is in normal mode and lightly loaded.
+"""
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from config import Config
+from services.executor import analysis_thread_count, run_cpu_bound, start_background
+from utils.helpers import try_lock
+import os
+import threading
+import time
+import numpy as np
+
+NORMAL = 'normal'
+DEGRADED = 'degraded'
+
+
+class DegradationController:
+    def __init__(self, queue_high, queue_low, latency_slo_ms, recover_ratio=0.7, window_seconds=30,
+                 min_samples=10, min_dwell_seconds=15, enabled=True):
+        self.queue_high = queue_high
+        self.queue_low = queue_low
+        self.latency_slo_ms = latency_slo_ms
+        self.recover_ratio = recover_ratio
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.min_dwell_seconds = min_dwell_seconds
+        self.enabled = enabled
+        self.mode = NORMAL
+        self.in_flight = 0
+        self.counters = {'model': 0, 'degraded': 0, 'to_degraded': 0, 'to_normal': 0}
+        self.switches = deque(maxlen=50)  # recent mode changes with their reason
+        self._mode_since = time.monotonic()
+        self._latencies = deque()  # (monotonic time, ms)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self, latency=True):
+        """
+        Wrap one model analysis: counts towards the queue depth and, when done,
+        the latency window. latency=False counts only the depth, for background
+        batches whose wall time is not a request's.
+        """
+        with self._lock:
+            self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.in_flight -= 1
+                if latency:
+                    self._latencies.append((time.monotonic(), elapsed_ms))
+
+    def _p95(self, now):
+        while self._latencies and self._latencies[0][0] < now - self.window_seconds:
+            self._latencies.popleft()
+        if len(self._latencies) < self.min_samples:
+            return None
+        return float(np.percentile([ms for _, ms in self._latencies], 95))
+
+    def _switch(self, mode, now, reason):
+        self.mode = mode
+        self._mode_since = now
+        self.counters['to_' + mode] += 1
+        self.switches.append({'at': datetime.utcnow().isoformat(), 'mode': mode, 'reason': reason})
+        print(f"{'⚠' if mode == DEGRADED else '✓'} Inference mode -> {mode}: {reason}")
+
+    def _update(self, now):
+        p95 = self._p95(now)
+        if self.mode == NORMAL:
+            if self.in_flight >= self.queue_high:
+                self._switch(DEGRADED, now, f'queue depth {self.in_flight} >= {self.queue_high}')
+            elif p95 is not None and p95 > self.latency_slo_ms:
+                self._switch(DEGRADED, now, f'p95 {p95:.0f} ms > SLO {self.latency_slo_ms:.0f} ms')
+        elif (now - self._mode_since >= self.min_dwell_seconds
+                and self.in_flight <= self.queue_low
+                and (p95 is None or p95 <= self.latency_slo_ms * self.recover_ratio)):
+            self._switch(NORMAL, now, f'queue depth {self.in_flight}, p95 {"n/a" if p95 is None else f"{p95:.0f} ms"}')
+        return p95
+
+    def should_degrade(self):
+        """Decide for one incoming analysis; True routes it to the fast path"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            self._update(time.monotonic())
+            degraded = self.mode == DEGRADED
+            self.counters['degraded' if degraded else 'model'] += 1
+        return degraded
+
+    def idle(self):
+        """Normal mode with the pool not saturated: spare capacity for re-scoring"""
+        with self._lock:
+            self._update(time.monotonic())
+            return self.mode == NORMAL and self.in_flight <= self.queue_low
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            p95 = self._p95(now)
+            return {
+                'enabled': self.enabled,
+                'mode': self.mode,
+                'mode_seconds': round(now - self._mode_since, 1),
+                'queue_depth': self.in_flight,
+                'p95_latency_ms': round(p95, 1) if p95 is not None else None,
+                'latency_samples': len(self._latencies),
+                'thresholds': {
+                    'queue_high': self.queue_high,
+                    'queue_low': self.queue_low,
+                    'latency_slo_ms': self.latency_slo_ms,
+                    'recover_below_ms': round(self.latency_slo_ms * self.recover_ratio, 1),
+                },
+                'requests': {'model': self.counters['model'], 'degraded': self.counters['degraded']},
+                'switches': {'to_degraded': self.counters['to_degraded'], 'to_normal': self.counters['to_normal']},
+                'recent_switches': list(self.switches),
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_degradation_controller():
+    """Per-process controller; thresholds default to multiples of the analysis pool size"""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            threads = analysis_thread_count()
+            _controller = DegradationController(
+                queue_high=Config.DEGRADE_QUEUE_HIGH or 2 * threads,
+                queue_low=Config.DEGRADE_QUEUE_LOW or threads,
+                latency_slo_ms=Config.DEGRADE_LATENCY_SLO_MS,
+                recover_ratio=Config.DEGRADE_RECOVER_RATIO,
+                window_seconds=Config.DEGRADE_WINDOW_SECONDS,
+                min_samples=Config.DEGRADE_MIN_SAMPLES,
+                min_dwell_seconds=Config.DEGRADE_MIN_DWELL_SECONDS,
+                enabled=Config.DEGRADE_ENABLED
+            )
+    return _controller
+
+
+rescore_stats = {'rescored': 0, 'changed': 0, 'missing': 0, 'last_run': None}
+
+
+def _load_or_none(path, size):
+    from services.ml_service import load_image_tensor
+    try:
+        return load_image_tensor(path, size)
+    except (OSError, ValueError):
+        return None
+
+
+def rescore_batch(batch_size=None):
+    """Re-score the oldest provisional analyses with the serving model; returns how many were taken off the queue"""
+    from models import db, Analysis, record_daily_stat, retract_daily_stat
+    from services.embedding_index import get_embedding_index, encode_embedding
+    from services.ml_service import get_analyzer
+    from services.recommendations import encode_ids
+    from services.storage import upload_dir
+
+    analyzer = get_analyzer()
+    if analyzer.active is None:
+        return 0
+    rows = (Analysis.query.filter(Analysis.provisional.is_(True))
+            .order_by(Analysis.id).limit(batch_size or Config.RESCORE_BATCH_SIZE).all())
+    if not rows:
+        return 0
+
+    size = analyzer.input_size()
+    tensors = [_load_or_none(os.path.join(upload_dir(), row.image_path), size) for row in rows]
+    scored = [(row, tensor) for row, tensor in zip(rows, tensors) if tensor is not None]
+    for row, tensor in zip(rows, tensors):
+        if tensor is None:
+            row.provisional = None  # the image is gone; keep the provisional answer, stop retrying
+            rescore_stats['missing'] += 1
+
+    embedded = []
+    if scored:
+        batch = np.stack([tensor for _, tensor in scored])
+        # Occupies the analysis pool like any upload, so it counts towards the queue depth
+        with get_degradation_controller().track(latency=False):
+            skin_types, confidences, version, embeddings = run_cpu_bound(analyzer.predict_batch, batch)
+        for i, ((row, _), skin_type, confidence) in enumerate(zip(scored, skin_types, confidences)):
+            retract_daily_stat(row.user_id, row.created_at.date(), row.skin_type, row.confidence)
+            if skin_type != row.skin_type:
+                rescore_stats['changed'] += 1
+            row.skin_type = skin_type
+            row.confidence = confidence
+            row.recommendations = ''
+            row.recommendation_ids = encode_ids(analyzer.get_recommendations(skin_type, confidence))
+            row.model_version = version
+            row.provisional = False
+            if embeddings is not None:
+                row.embedding = encode_embedding(embeddings[i])
+                embedded.append((row.id, embeddings[i]))
+            db.session.flush()
+            record_daily_stat(row)
+        rescore_stats['rescored'] += len(scored)
+    db.session.commit()
+
+    if embedded:
+        # Replaces vectors the index already holds; rows past its last id come in with its next sync
+        get_embedding_index(version).upsert([analysis_id for analysis_id, _ in embedded],
+                                            np.stack([vector for _, vector in embedded]))
+    return len(rows)
+
+
+def pending_count():
+    from models import Analysis
+    return Analysis.query.filter(Analysis.provisional.is_(True)).count()
+
+
+_rescorer = None
+
+
+def start_rescorer(app, interval_seconds):
+    """Drain the provisional queue every interval_seconds while this worker has spare capacity"""
+    global _rescorer
+    if _rescorer is not None or interval_seconds <= 0:
+        return
+    controller = get_degradation_controller()
+    lock_path = os.path.join(app.instance_path, 'rescorer.lock')
+
+    def loop():
+        while True:
+            time.sleep(interval_seconds)
+            if not controller.idle():
+                continue
+            handle = try_lock(lock_path)
+            if handle is None:
+                continue  # another worker is re-scoring
+            try:
+                with app.app_context():
+                    # One small batch at a time, re-checking the load in between
+                    while controller.idle() and rescore_batch():
+                        pass
+                rescore_stats['last_run'] = datetime.utcnow().isoformat()
+            except Exception as e:
+                print(f"⚠ Re-scoring failed: {e}")
+            finally:
+                handle.close()
+
+    _rescorer = start_background(loop, 'rescorer')
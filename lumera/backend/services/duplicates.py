@@ -0,0 +1,85 @@
+"""
+Per-user near-duplicate lookup over perceptual hashes
+
+Each user's recent hashes are kept in an in-process BK-tree. A tree is built
+from the indexed Analysis.phash column on first use. Before every lookup it
+is topped up with rows whose id is above the last one seen, so uploads
+handled by other worker processes are picked up with one cheap indexed query.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from config import Config
+from models import db, Analysis
+from utils.imagehash import BKTree, from_signed64
+import threading
+
+
+class _UserTree:
+    def __init__(self):
+        self.tree = BKTree()
+        self.last_id = 0
+
+
+class NearDuplicateIndex:
+    def __init__(self, max_users):
+        self.max_users = max_users
+        self._trees = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tree_for(self, user_id):
+        entry = self._trees.get(user_id)
+        if entry is None:
+            entry = _UserTree()
+            self._trees[user_id] = entry
+            if len(self._trees) > self.max_users:
+                self._trees.popitem(last=False)
+        else:
+            self._trees.move_to_end(user_id)
+        return entry
+
+    def _top_up(self, user_id, entry):
+        since = datetime.utcnow() - timedelta(days=Config.PHASH_LOOKBACK_DAYS)
+        rows = db.session.query(Analysis.id, Analysis.phash, Analysis.created_at).filter(
+            Analysis.user_id == user_id,
+            Analysis.id > entry.last_id,
+            Analysis.phash.isnot(None),
+            Analysis.created_at >= since
+        ).order_by(Analysis.id).all()
+        for analysis_id, phash, created_at in rows:
+            entry.tree.add(from_signed64(phash), (analysis_id, created_at))
+            entry.last_id = analysis_id
+
+    def find(self, user_id, phash, max_distance=None):
+        """Closest recent analysis of this user within max_distance bits, as (analysis_id, distance)"""
+        max_distance = Config.PHASH_MAX_DISTANCE if max_distance is None else max_distance
+        since = datetime.utcnow() - timedelta(days=Config.PHASH_LOOKBACK_DAYS)
+        with self._lock:
+            entry = self._tree_for(user_id)
+            self._top_up(user_id, entry)
+            for distance, (analysis_id, created_at) in entry.tree.search(phash, max_distance):
+                # Trees only grow, so entries can age out of the lookback window
+                if created_at >= since:
+                    return analysis_id, distance
+        return None
+
+    def add(self, user_id, phash, analysis_id, created_at):
+        with self._lock:
+            entry = self._trees.get(user_id)
+            if entry is not None and analysis_id > entry.last_id:
+                entry.tree.add(phash, (analysis_id, created_at))
+                entry.last_id = analysis_id
+
+    def forget(self, user_id):
+        """Drop a user's cached tree, e.g. after their analyses are deleted or archived"""
+        with self._lock:
+            self._trees.pop(user_id, None)
+
+
+_index = None
+
+
+def get_duplicate_index():
+    global _index
+    if _index is None:
+        _index = NearDuplicateIndex(Config.PHASH_CACHE_USERS)
+    return _index
@@ -0,0 +1,284 @@
+"""
+Approximate nearest-neighbour index over analysis embeddings
+
+An inverted-file (IVF) index in plain NumPy: vectors are L2-normalised,
+assigned to the closest of `nlist` k-means centroids and stored as float16
+in per-centroid growable arrays. A query scores only the `nprobe` closest
+lists, so each search touches about nprobe / nlist of the rows.
+
+Until `nlist * TRAIN_FACTOR` vectors have been added, the index is a flat
+exact scan. After that it trains itself once and switches to IVF. Inserts
+are incremental, upsert() replaces the vectors of re-scored analyses, and
+save()/load() snapshot the whole index to one .npz file.
+
+There is one index per model version (get_embedding_index(version)): an
+embedding is only comparable with embeddings from the same network.
+"""
+from config import Config
+import os
+import re
+import threading
+import time
+import numpy as np
+
+TRAIN_FACTOR = 39  # vectors per centroid needed before k-means is worth it
+
+
+def _normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class _List:
+    """Growable (ids, float16 vectors) with amortised O(1) appends"""
+
+    def __init__(self, dim, capacity=64):
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.vectors = np.empty((capacity, dim), dtype=np.float16)
+        self.size = 0
+
+    def extend(self, ids, vectors):
+        needed = self.size + len(ids)
+        if needed > len(self.ids):
+            capacity = max(needed, len(self.ids) * 2)
+            self.ids = np.resize(self.ids, capacity)
+            grown = np.empty((capacity, self.vectors.shape[1]), dtype=np.float16)
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+        self.ids[self.size:needed] = ids
+        self.vectors[self.size:needed] = vectors
+        self.size = needed
+
+    def remove(self, ids):
+        keep = ~np.isin(self.ids[:self.size], ids)
+        kept = int(keep.sum())
+        if kept < self.size:
+            self.ids[:kept] = self.ids[:self.size][keep]
+            self.vectors[:kept] = self.vectors[:self.size][keep]
+            self.size = kept
+
+
+class IVFIndex:
+    def __init__(self, dim=128, nlist=256, nprobe=8):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self.lists = [_List(dim)]  # a single flat list until trained
+        self.last_id = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return sum(lst.size for lst in self.lists)
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def _train(self):
+        flat = self.lists[0]
+        ids = flat.ids[:flat.size].copy()
+        vectors = flat.vectors[:flat.size].astype(np.float32)
+
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), self.nlist * 256), replace=False)]
+        centroids = sample[rng.choice(len(sample), self.nlist, replace=False)]
+        for _ in range(20):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(self.nlist):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalise(centroids)
+
+        self.centroids = centroids
+        self.lists = [_List(self.dim) for _ in range(self.nlist)]
+        self._assign(ids, vectors)
+
+    def _assign(self, ids, vectors):
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(self.nlist + 1))
+        for c in range(self.nlist):
+            picked = order[bounds[c]:bounds[c + 1]]
+            if len(picked):
+                self.lists[c].extend(ids[picked], vectors[picked])
+
+    def _insert(self, ids, vectors):
+        if self.trained:
+            self._assign(ids, vectors)
+        else:
+            self.lists[0].extend(ids, vectors)
+            if self.lists[0].size >= self.nlist * TRAIN_FACTOR:
+                self._train()
+
+    def add(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return
+        vectors = _normalise(vectors)
+        with self._lock:
+            self._insert(ids, vectors)
+            self.last_id = max(self.last_id, int(ids.max()))
+
+    def upsert(self, ids, vectors):
+        """
+        Set the vectors of analyses the index has already caught up to (id <= last_id),
+        replacing any stored for the same ids. Newer ids are left to sync_from_db().
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            covered = ids <= self.last_id
+            if not covered.any():
+                return
+            ids, vectors = ids[covered], _normalise(vectors)[covered]
+            for lst in self.lists:
+                lst.remove(ids)
+            self._insert(ids, vectors)
+
+    def search(self, vector, k=10):
+        """Top-k (id, cosine similarity) pairs, most similar first"""
+        query = _normalise(np.asarray(vector).reshape(1, -1))[0]
+        with self._lock:
+            if self.trained:
+                probe = np.argpartition(-(self.centroids @ query), min(self.nprobe, self.nlist) - 1)[:self.nprobe]
+                lists = [self.lists[c] for c in probe]
+            else:
+                lists = self.lists
+            ids = np.concatenate([lst.ids[:lst.size] for lst in lists]) if lists else np.empty(0, np.int64)
+            if not len(ids):
+                return []
+            scores = np.concatenate([lst.vectors[:lst.size].astype(np.float32) @ query for lst in lists])
+
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def save(self, path):
+        """Write a snapshot atomically"""
+        with self._lock:
+            arrays = {
+                'meta': np.array([self.dim, self.nlist, self.nprobe, self.last_id], dtype=np.int64),
+                'sizes': np.array([lst.size for lst in self.lists], dtype=np.int64),
+                'ids': np.concatenate([lst.ids[:lst.size] for lst in self.lists]),
+                'vectors': np.concatenate([lst.vectors[:lst.size] for lst in self.lists]),
+            }
+            if self.trained:
+                arrays['centroids'] = self.centroids
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            dim, nlist, nprobe, last_id = (int(v) for v in data['meta'])
+            index = cls(dim, nlist, nprobe)
+            index.last_id = last_id
+            if 'centroids' in data:
+                index.centroids = data['centroids']
+                index.lists = [_List(dim) for _ in range(nlist)]
+            offsets = np.concatenate([[0], np.cumsum(data['sizes'])])
+            ids, vectors = data['ids'], data['vectors']
+            for lst, start, end in zip(index.lists, offsets[:-1], offsets[1:]):
+                lst.extend(ids[start:end], vectors[start:end])
+        return index
+
+
+def encode_embedding(vector):
+    """Pack an embedding (128-d for the full model) as float16 bytes for Analysis.embedding"""
+    return np.asarray(vector, dtype=np.float16).tobytes()
+
+
+def decode_embedding(blob):
+    return np.frombuffer(blob, dtype=np.float16)
+
+
+_indexes = {}  # model_version -> {'index', 'mtime', 'next_sync', 'sync_lock'}
+_index_lock = threading.Lock()
+
+
+def snapshot_path(version):
+    """EMBEDDING_INDEX_PATH with the model version in the name, e.g. embedding_index.v2025....npz"""
+    path = Config.EMBEDDING_INDEX_PATH
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), path)
+    root, ext = os.path.splitext(path)
+    return f"{root}.{re.sub(r'[^A-Za-z0-9_.-]', '_', version)}{ext}"
+
+
+def embedded_versions():
+    """Model versions that have stored embeddings"""
+    from models import db, Analysis
+    return [version for (version,) in db.session.query(Analysis.model_version).filter(
+        Analysis.embedding.isnot(None), Analysis.model_version.isnot(None)
+    ).distinct()]
+
+
+def new_index(version):
+    """Empty index sized for `version`'s embeddings (a fast or student model may differ from EMBEDDING_DIM)"""
+    from models import db, Analysis
+    blob = db.session.query(Analysis.embedding).filter(
+        Analysis.model_version == version, Analysis.embedding.isnot(None)
+    ).limit(1).scalar()
+    dim = len(decode_embedding(blob)) if blob is not None else Config.EMBEDDING_DIM
+    return IVFIndex(dim, Config.EMBEDDING_NLIST, Config.EMBEDDING_NPROBE)
+
+
+def sync_from_db(index, version, chunk_size=5000):
+    """Add embeddings produced by `version` newer than the index's last id; returns how many were added"""
+    from models import Analysis, iter_analysis_chunks
+    added = 0
+    chunks = iter_analysis_chunks(
+        (Analysis.id, Analysis.embedding),
+        (Analysis.embedding.isnot(None), Analysis.model_version == version),
+        index.last_id, chunk_size
+    )
+    for rows in chunks:
+        index.add([row[0] for row in rows], np.stack([decode_embedding(row[1]) for row in rows]))
+        added += len(rows)
+    return added
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_embedding_index(version):
+    """
+    Process-wide index of the embeddings one model version produced; vectors
+    from different networks live in different spaces and are never compared.
+    It is reloaded whenever its snapshot file changes (e.g. after `flask
+    reanalyze` or `embedding-index --rebuild`) and caught up from the database
+    at most every EMBEDDING_SYNC_SECONDS, by one caller at a time and outside
+    the global lock; the others search the slightly older index.
+    """
+    path = snapshot_path(version)
+    mtime = _mtime(path)
+    with _index_lock:
+        entry = _indexes.get(version)
+        if entry is None or mtime != entry['mtime']:
+            if mtime is not None:
+                index = IVFIndex.load(path)
+            elif entry is None:
+                index = new_index(version)
+            else:
+                index = entry['index']
+            entry = _indexes[version] = {'index': index, 'mtime': mtime, 'next_sync': 0.0,
+                                         'sync_lock': threading.Lock()}
+        index = entry['index']
+        now = time.monotonic()
+        due = now >= entry['next_sync']
+        if due:
+            entry['next_sync'] = now + Config.EMBEDDING_SYNC_SECONDS
+    if due and entry['sync_lock'].acquire(blocking=False):
+        try:
+            sync_from_db(index, version)
+        finally:
+            entry['sync_lock'].release()
+    return index
@@ -0,0 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from services.runtime import cores_share
+import functools
+import threading
+
+# Under the production server (serve.py) requests run as greenlets on a gevent
+# event loop. Model inference is CPU-bound and would stall every other request
+# on that loop, so it is pushed onto real OS threads. TensorFlow, OpenCV and
+# NumPy release the GIL while they work, so those threads run in parallel.
+
+_executor = None
+_fast_pool = None
+_lock = threading.Lock()
+
+
+def analysis_thread_count():
+    """Threads per worker process reserved for CPU-bound analysis"""
+    if Config.ANALYSIS_THREADS:
+        return Config.ANALYSIS_THREADS
+    # A pinned worker's affinity is already its slice; dividing again would shrink it
+    return cores_share()
+
+
+def _gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=analysis_thread_count(),
+                    thread_name_prefix='analysis'
+                )
+    return _executor
+
+
+def run_cpu_bound(fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) off the request thread and wait for its result.
+    Only the calling request blocks; with gevent the event loop keeps serving.
+    """
+    if _gevent_patched():
+        # A patched ThreadPoolExecutor would only spawn greenlets, so use the
+        # hub's native thread pool instead.
+        import gevent
+        pool = gevent.get_hub().threadpool
+        if pool.maxsize != analysis_thread_count():
+            pool.maxsize = analysis_thread_count()
+        return pool.apply(fn, args, kwargs)
+    return _get_executor().submit(fn, *args, **kwargs).result()
+
+
+class _GeventResult:
+    def __init__(self, async_result):
+        self._async_result = async_result
+
+    def result(self):
+        return self._async_result.get()
+
+
+def submit_cpu_bound(fn, *args, **kwargs):
+    """
+    Like run_cpu_bound(), but returns at once with a handle whose result()
+    waits. Lets a request overlap two CPU-bound steps, e.g. decoding the next
+    batch of frames while the current one is scored.
+    """
+    if _gevent_patched():
+        import gevent
+        pool = gevent.get_hub().threadpool
+        if pool.maxsize != analysis_thread_count():
+            pool.maxsize = analysis_thread_count()
+        return _GeventResult(pool.spawn(fn, *args, **kwargs))
+    return _get_executor().submit(fn, *args, **kwargs)
+
+
+class _GeventPool:
+    """gevent's native-thread ThreadPool behind ThreadPoolExecutor's submit()"""
+
+    def __init__(self, max_workers):
+        import gevent
+        from gevent.threadpool import ThreadPool
+        self._hub = gevent.get_hub()
+        self._pool = ThreadPool(max_workers, hub=self._hub)
+
+    def submit(self, fn, *args, **kwargs):
+        from gevent import monkey
+        if monkey.get_original('_thread', 'get_ident')() == self._hub.thread_ident:
+            return _GeventResult(self._pool.spawn(fn, *args, **kwargs))
+        # Called from a native thread (e.g. inside run_cpu_bound): the pool belongs
+        # to the hub, so hand it the spawn; there is no handle to wait on
+        self._hub.loop.run_callback_threadsafe(functools.partial(self._pool.spawn, fn, *args, **kwargs))
+        return None
+
+
+def native_pool(max_workers, name):
+    """
+    A pool of real OS threads for background work, with submit(). Under gevent
+    a ThreadPoolExecutor would only spawn greenlets on the event loop, so this
+    is a gevent ThreadPool there. Create it on the event loop's thread.
+    """
+    if _gevent_patched():
+        return _GeventPool(max_workers)
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+
+def run_fast_path(fn, *args, **kwargs):
+    """
+    Like run_cpu_bound(), but on a small pool of its own (DEGRADE_FAST_THREADS)
+    for the degraded rule-based path, so it never queues behind model work.
+    """
+    global _fast_pool
+    with _lock:
+        if _fast_pool is None:
+            _fast_pool = native_pool(Config.DEGRADE_FAST_THREADS, 'fast-path')
+    return _fast_pool.submit(fn, *args, **kwargs).result()
+
+
+def start_background(target, name):
+    """
+    Run a background job's loop on a daemon OS thread. Under gevent a
+    threading.Thread is a greenlet, so the job would run on the event loop;
+    it gets a one-thread native pool of its own there instead.
+    """
+    if _gevent_patched():
+        return native_pool(1, name).submit(target)
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    thread.start()
+    return thread
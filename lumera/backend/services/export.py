@@ -0,0 +1,128 @@
+"""
+Streaming export of a user's analyses
+
+export_chunks() yields the response body piece by piece. Archived months
+come first, then the hot table, each read in keyset chunks of
+EXPORT_CHUNK_SIZE rows by id. Every chunk is serialized, optionally
+gzip-compressed, and released before the next one is read. So memory stays
+flat however many rows a user has. The read transaction is ended after each
+chunk, so a long download never pins an old SQLite snapshot.
+
+Image URLs in an export are signed with SECRET_KEY (itsdangerous). They let
+whoever holds the file fetch the images without a bearer token until
+EXPORT_URL_MAX_AGE runs out. A link names the analysis, not the file: the
+storage compactor and late original uploads repoint image_path, so the file
+is looked up when the link is opened.
+"""
+from flask import url_for
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from config import Config
+from models import db, Analysis, iter_analysis_chunks
+from services import archive
+from utils.serialization import analysis_projection, analysis_row_to_dict, dumps_bytes
+import csv
+import io
+import zlib
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+CSV_COLUMNS = ('id', 'created_at', 'skin_type', 'confidence', 'model_version',
+               'original_status', 'image_path', 'recommendations')
+
+
+def _serializer():
+    return URLSafeTimedSerializer(Config.SECRET_KEY, salt='export-image')
+
+
+def sign_image(analysis_id, user_id):
+    return _serializer().dumps([analysis_id, user_id])
+
+
+def verify_image_token(token):
+    """(analysis_id, user_id) a signed image token was issued for, or None if it is forged or expired"""
+    try:
+        analysis_id, user_id = _serializer().loads(token, max_age=Config.EXPORT_URL_MAX_AGE)
+    except (BadSignature, TypeError, ValueError):
+        return None
+    return analysis_id, user_id
+
+
+def current_image_path(analysis_id, user_id):
+    """The analysis' image_path as it is now, archived analyses included; None if it is gone"""
+    image_path = db.session.query(Analysis.image_path).filter(
+        Analysis.id == analysis_id, Analysis.user_id == user_id
+    ).scalar()
+    if image_path is None:
+        row = archive.find_row(analysis_id, user_id)
+        if row is not None:
+            image_path = analysis_row_to_dict(row)['image_path']
+    return image_path
+
+
+def iter_row_chunks(user_id, chunk_size=None):
+    """analysis_projection() rows of one user in id order, chunk_size at a time, archive first"""
+    chunk_size = chunk_size or Config.EXPORT_CHUNK_SIZE
+    yield from archive.iter_user_rows(user_id, chunk_size)
+    for rows in iter_analysis_chunks(analysis_projection(), (Analysis.user_id == user_id,), chunk_size=chunk_size):
+        db.session.rollback()  # end the read transaction between chunks
+        yield rows
+
+
+class _CSVChunkWriter:
+    """csv.writer over one reusable buffer, drained after every chunk"""
+
+    def __init__(self, image_urls):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.image_urls = image_urls
+
+    def header(self):
+        self.writer.writerow(CSV_COLUMNS + (('image_url',) if self.image_urls else ()))
+        return self._drain()
+
+    def rows(self, records):
+        for record in records:
+            values = [record[column] for column in CSV_COLUMNS[:-1]]
+            values.append('; '.join(record['recommendations']))
+            if self.image_urls:
+                values.append(record['image_url'])
+            self.writer.writerow(values)
+        return self._drain()
+
+    def _drain(self):
+        data = self.buffer.getvalue().encode('utf-8')
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+
+def export_chunks(user_id, fmt='ndjson', image_urls=False, compress=False, chunk_size=None):
+    """Yield the encoded export body; runs inside the request context (stream_with_context)"""
+    compressor = zlib.compressobj(Config.COMPRESS_LEVEL, zlib.DEFLATED, 31) if compress else None  # 31 = gzip
+
+    def emit(data):
+        if compressor is None:
+            return data
+        # Sync-flush so every chunk reaches the client as soon as it is read
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    csv_writer = _CSVChunkWriter(image_urls) if fmt == 'csv' else None
+    if csv_writer is not None:
+        yield emit(csv_writer.header())
+
+    for rows in iter_row_chunks(user_id, chunk_size):
+        records = [analysis_row_to_dict(row) for row in rows]
+        if image_urls:
+            for record in records:
+                token = sign_image(record['id'], record['user_id'])
+                record['image_url'] = url_for('analysis.get_signed_image', token=token, _external=True)
+        if csv_writer is not None:
+            data = csv_writer.rows(records)
+        else:
+            data = b''.join(dumps_bytes(record) + b'\n' for record in records)
+        yield emit(data)
+
+    if compressor is not None:
+        yield compressor.flush()
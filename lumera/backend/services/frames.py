@@ -0,0 +1,174 @@
+"""
+Video clip and burst analysis
+
+Frames are decoded one at a time: a clip is read from disk with
+cv2.VideoCapture and a burst one image at a time. Nothing holds more than a
+batch of frames. Each sampled frame is kept only if it is
+  - sharp: variance of the Laplacian on a 256px grayscale copy, and
+  - new: mean absolute difference from the last kept frame on a 32x32
+    thumbnail, so a still camera does not yield the same frame ten times.
+
+Kept frames are scored in batched predict calls with one pinned model
+version. Decoding batch k+1 runs on another analysis thread while batch k
+is being scored. Per-frame probabilities are averaged into one result, and
+the sharpest kept frame becomes the analysis image.
+"""
+from config import Config
+from services.executor import run_cpu_bound, submit_cpu_bound
+from services.ml_service import get_analyzer
+from services.preprocessing import skin_features_bgr
+from services.recommendations import get_catalogue
+import cv2
+import numpy as np
+
+_INV_255 = np.float32(1.0 / 255.0)
+
+
+def video_frames(path, sample_fps=None, max_seconds=None):
+    """Yield BGR frames from a video file at about sample_fps, decoding only the sampled ones"""
+    sample_fps = sample_fps or Config.VIDEO_SAMPLE_FPS
+    max_seconds = max_seconds or Config.VIDEO_MAX_SECONDS
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError('Could not read video')
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        step = max(1, round(fps / sample_fps))
+        index = 0
+        while index < fps * max_seconds and capture.grab():
+            # grab() only demuxes; frames that are not sampled are never converted
+            if index % step == 0:
+                ok, frame = capture.retrieve()
+                if ok:
+                    yield frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def burst_frames(files):
+    """Yield BGR frames from uploaded images, decoding each only when it is needed"""
+    for file in files[:Config.BURST_MAX_UPLOADS]:
+        data = np.frombuffer(file.stream.read(), dtype=np.uint8)
+        frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if frame is not None:
+            yield frame
+
+
+class FrameReader:
+    """Turns a frame iterator into batches of preprocessed model inputs"""
+
+    def __init__(self, frames, input_size, batch_size=None, max_frames=None,
+                 min_sharpness=None, min_motion=None):
+        self.frames = iter(frames)
+        self.input_size = input_size  # (width, height)
+        self.batch_size = batch_size or Config.FRAME_BATCH_SIZE
+        self.max_frames = max_frames or Config.FRAME_MAX_SELECTED
+        self.min_sharpness = Config.FRAME_MIN_SHARPNESS if min_sharpness is None else min_sharpness
+        self.min_motion = Config.FRAME_MIN_MOTION if min_motion is None else min_motion
+        self.stats = {'decoded': 0, 'kept': 0, 'blurry': 0, 'duplicates': 0}
+        self.best_frame = None  # sharpest kept frame, stored as the analysis image
+        self._best_sharpness = -1.0
+        self._fallback = None  # sharpest frame of all, used if none passes the filters
+        self._fallback_sharpness = -1.0
+        self._last_thumb = None
+
+    def _measure(self, frame):
+        height, width = frame.shape[:2]
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, (256, max(1, height * 256 // width)), interpolation=cv2.INTER_AREA)
+        sharpness = float(cv2.Laplacian(small, cv2.CV_32F).var())
+        thumb = cv2.resize(small, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+        return sharpness, thumb
+
+    def _select(self, frame):
+        sharpness, thumb = self._measure(frame)
+        if sharpness > self._fallback_sharpness:
+            self._fallback, self._fallback_sharpness = frame, sharpness
+        if sharpness < self.min_sharpness:
+            self.stats['blurry'] += 1
+            return False
+        if self._last_thumb is not None and np.abs(thumb - self._last_thumb).mean() < self.min_motion:
+            self.stats['duplicates'] += 1
+            return False
+        self._last_thumb = thumb
+        if sharpness > self._best_sharpness:
+            self.best_frame, self._best_sharpness = frame, sharpness
+        return True
+
+    def _tensor(self, frame):
+        rgb = cv2.cvtColor(cv2.resize(frame, self.input_size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+        return np.multiply(rgb, _INV_255, dtype=np.float32)
+
+    def next_batch(self):
+        """Up to batch_size selected frames as an (N, H, W, 3) array, or None when done"""
+        tensors = []
+        while len(tensors) < self.batch_size and self.stats['kept'] < self.max_frames:
+            frame = next(self.frames, None)
+            if frame is None:
+                break
+            self.stats['decoded'] += 1
+            if self._select(frame):
+                self.stats['kept'] += 1
+                tensors.append(self._tensor(frame))
+        if not tensors and self.stats['kept'] == 0 and self._fallback is not None:
+            # Every frame was filtered out; score the sharpest one rather than nothing
+            self.best_frame, self._fallback = self._fallback, None
+            self.stats['kept'] = 1
+            tensors.append(self._tensor(self.best_frame))
+        return np.stack(tensors) if tensors else None
+
+
+def analyze_frames(frames, regions=None):
+    """
+    Analyze a stream of BGR frames as one sample. Returns (result, best_frame):
+    result has the same keys as analyze_skin() plus 'frames' statistics.
+    """
+    analyzer = get_analyzer()
+    active = analyzer.active  # one model version for every batch
+    reader = FrameReader(frames, analyzer.input_size())
+    probabilities, embeddings = [], []
+
+    pending = submit_cpu_bound(reader.next_batch)
+    while True:
+        batch = pending.result()
+        if batch is None:
+            break
+        pending = submit_cpu_bound(reader.next_batch)  # decode ahead while this batch is scored
+        if active is not None:
+            batch_probabilities, batch_embeddings = run_cpu_bound(analyzer.forward, active, batch)
+            probabilities.append(batch_probabilities)
+            if batch_embeddings is not None:
+                embeddings.append(batch_embeddings)
+
+    if reader.best_frame is None:
+        raise ValueError('No readable frames')
+
+    stats = dict(reader.stats)
+    embedding = None
+    if active is not None:
+        probabilities = np.concatenate(probabilities)
+        mean = probabilities.mean(axis=0)
+        predicted_class = int(np.argmax(mean))
+        skin_type = active.class_names[predicted_class]
+        confidence = float(mean[predicted_class] * 100)
+        model_version = active.version
+        stats['agreement'] = round(float((probabilities.argmax(axis=1) == predicted_class).mean()), 3)
+        if embeddings:
+            embedding = np.concatenate(embeddings).mean(axis=0)
+        print(f"Frame prediction: {skin_type} ({confidence:.2f}%) from {stats['kept']} frames")
+    else:
+        # No model: rule-based features of the sharpest frame
+        skin_type, confidence = analyzer.classify_by_features(skin_features_bgr(reader.best_frame))
+        model_version = 'features'
+
+    recommendation_ids = analyzer.get_recommendations(skin_type, confidence, regions)
+    return {
+        'skin_type': skin_type,
+        'confidence': round(confidence, 2),
+        'recommendation_ids': recommendation_ids,
+        'recommendations': get_catalogue().resolve(recommendation_ids),
+        'model_version': model_version,
+        'embedding': embedding,
+        'frames': stats
+    }, reader.best_frame
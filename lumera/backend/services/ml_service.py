@@ -49,90 +49,279 @@ def analyze_skin(image_path):
 import numpy as np
 from PIL import Image
 import cv2
+import json
 import os
+import threading
+import time
 import tensorflow as tf
 from tensorflow import keras
+from config import Config
+from services import model_registry
+from services.shadow import get_shadow_runner
+from services.recommendations import get_catalogue
+from services.buffer_pool import get_tensor_pool
+from services.preprocessing import decode_into, skin_features
+from services.compiled_model import make_predictor
+from services.executor import run_cpu_bound
+from services import runtime
+
+# Size TensorFlow's and OpenCV's thread pools for this worker before any op runs
+runtime.configure_tensorflow(tf)
+runtime.configure_opencv(cv2)
+
+# Output order assumed when a legacy model has no class_indices.json: the
+# alphabetical folder order flow_from_directory trains with
+DEFAULT_CLASS_NAMES = ('Combination', 'Dry', 'Normal', 'Oily', 'Sensitive')
+
+def load_image_tensor(image_path, size=(224, 224)):
+    """Decode one image into a float32 (H, W, 3) array in [0, 1]; module level so process pools can pickle it"""
+    with Image.open(image_path) as img:
+        img = img.convert('RGB').resize(size)
+        return np.asarray(img, dtype=np.float32) / 255.0
+
+
+def build_embedder(model):
+    """
+    Two-output view of `model` that returns (penultimate Dense activations, class
+    probabilities) from one forward pass, or None if there is no such layer.
+    """
+    dense_layers = [layer for layer in model.layers if isinstance(layer, keras.layers.Dense)]
+    if len(dense_layers) < 2:
+        return None
+    try:
+        return keras.Model(inputs=model.inputs, outputs=[dense_layers[-2].output, model.outputs[0]])
+    except Exception as e:
+        print(f"⚠ Could not expose embedding layer: {e}")
+        return None
+
+
+class LoadedModel:
+    """An immutable (model, version, class order) triple; swapped as one reference"""
+    def __init__(self, model, version, class_names, embedder=None, fast=None, fast_threshold=None):
+        self.model = model
+        self.version = version
+        self.class_names = class_names
+        self.embedder = embedder
+        self.fast = fast  # optional low-resolution model tried before `model`
+        self.fast_threshold = fast_threshold
+        # Callables with model.predict semantics, compiled per batch-size bucket
+        self.predict = make_predictor(model)
+        self.embed = make_predictor(embedder)
+        self.fast_predict = make_predictor(fast)
+        # Early exits keep an embedding too, in the fast model's own space
+        self.fast_embed = make_predictor(build_embedder(fast)) if fast is not None else None
+    
+    def warmup(self):
+        for predictor in (self.predict, self.embed, self.fast_predict, self.fast_embed):
+            if predictor is not None:
+                predictor.warmup()
+
 
 class SkinAnalyzer:
-    def __init__(self):
-        self.model = None
-        self.skin_types = ['Normal', 'Oily', 'Dry', 'Combination', 'Sensitive']
+    def __init__(self, load=True):
+        self.active = None
+        self.skin_types = list(DEFAULT_CLASS_NAMES)
         self.model_path = os.path.join(os.path.dirname(__file__), '../ml_model/skin_type_model.h5')
-        self.load_model()
+        self._swap_lock = threading.Lock()
+        self._watcher = None
+        if load:
+            self.load_model()
+    
+    @property
+    def model(self):
+        active = self.active
+        return active.model if active is not None else None
+    
+    @property
+    def model_version(self):
+        active = self.active
+        return active.version if active is not None else None
+    
+    def load_version(self, version):
+        """Load a registry version (or the legacy artifact when version is None) and warm it up"""
+        if version is None:
+            model = keras.models.load_model(self.model_path)
+            class_indices_path = os.path.join(os.path.dirname(self.model_path), 'class_indices.json')
+            class_names = self.skin_types
+            if os.path.exists(class_indices_path):
+                with open(class_indices_path) as f:
+                    class_names = model_registry.class_names_from_indices(json.load(f))
+            fast_path = self.model_path.replace('.h5', '_fast.h5')
+            fast = keras.models.load_model(fast_path) if os.path.exists(fast_path) else None
+            loaded = LoadedModel(model, 'legacy', class_names, build_embedder(model), fast)
+        else:
+            manifest = model_registry.read_manifest(version)
+            model = keras.models.load_model(manifest['artifact_path'])
+            fast, fast_threshold = None, None
+            if 'fast' in manifest:
+                fast = keras.models.load_model(manifest['fast']['artifact_path'])
+                fast_threshold = manifest['fast'].get('threshold')
+            loaded = LoadedModel(model, version, manifest['class_names'], build_embedder(model), fast, fast_threshold)
+        
+        # Trace every graph here rather than on a user request
+        loaded.warmup()
+        return loaded
     
     def load_model(self):
-        """Load the pre-trained model"""
+        """Load the active registry version, falling back to the legacy model file"""
         try:
-            if os.path.exists(self.model_path):
-                self.model = keras.models.load_model(self.model_path)
-                print("✓ ML Model loaded successfully")
-            else:
+            version = model_registry.current_version()
+            if version is None and not os.path.exists(self.model_path):
                 print("⚠ Model file not found. Using feature-based analysis.")
-                self.model = None
+                self.active = None
+                return
+            self.active = self.load_version(version)
+            print(f"✓ ML Model loaded successfully (version {self.active.version})")
+            settings = runtime.describe()
+            print(f"  threads: {settings['intra_op']} intra-op, {settings['inter_op']} inter-op, {settings['opencv']} OpenCV")
         except Exception as e:
             print(f"⚠ Error loading model: {e}. Using feature-based analysis.")
-            self.model = None
+            self.active = None
     
-    def preprocess_image(self, image_path):
-        """Preprocess image for model input"""
+    def swap_to(self, version, reload=False):
+        """
+        Load `version` alongside the serving model, then switch to it with a single
+        reference assignment. Requests already running keep the model they started with.
+        The load and warm-up run on a native analysis thread, so under gevent the
+        event loop keeps serving; only the assignment happens on the caller.
+        """
+        with self._swap_lock:
+            if self.model_version == version and not reload:
+                return self.active
+            loaded = run_cpu_bound(self.load_version, version)
+            self.active = loaded
+            print(f"✓ Hot-swapped ML Model to version {version}")
+            return loaded
+    
+    def swap_in_background(self, version):
+        def run():
+            try:
+                self.swap_to(version)
+            except Exception as e:
+                print(f"⚠ Model swap to {version} failed: {e}. Keeping {self.model_version}.")
+        thread = threading.Thread(target=run, name='model-swap', daemon=True)
+        thread.start()
+        return thread
+    
+    def start_watcher(self, interval):
+        """Poll the registry CURRENT pointer (and its manifest) and hot-swap when either changes"""
+        if self._watcher is not None or interval <= 0:
+            return
+        
+        def watch():
+            pointer = model_registry.current_pointer_path()
+            last_state = None
+            while True:
+                time.sleep(interval)
+                try:
+                    mtime = os.stat(pointer).st_mtime_ns
+                    version = model_registry.current_version()
+                    manifest_mtime = os.stat(model_registry.manifest_path(version)).st_mtime_ns if version else None
+                except FileNotFoundError:
+                    continue
+                state = (mtime, manifest_mtime)
+                if state == last_state:
+                    continue
+                # A changed manifest of the serving version means an artifact was attached
+                reload = last_state is not None and version == self.model_version
+                last_state = state
+                if version and (version != self.model_version or reload):
+                    try:
+                        self.swap_to(version, reload=reload)
+                    except Exception as e:
+                        print(f"⚠ Model swap to {version} failed: {e}. Keeping {self.model_version}.")
+        
+        self._watcher = threading.Thread(target=watch, name='model-watcher', daemon=True)
+        self._watcher.start()
+    
+    def input_size(self):
+        """(width, height) the serving model expects"""
+        model = self.model
+        if model is None:
+            return (224, 224)
+        height, width = model.input_shape[1:3]
+        return (width, height)
+    
+    def predict_batch(self, batch, batch_size=64):
+        """
+        Classify a (N, H, W, 3) batch with the serving model.
+        Returns (skin_types, confidences, model_version, embeddings); embeddings
+        is an (N, D) array, or None when the model has no embedding layer.
+        The compiled predictor runs it in chunks of the largest bucket.
+        """
+        active = self.active
+        if active is None:
+            raise Exception("No ML model loaded")
+        predictions, embeddings = self.forward(active, batch)
+        predicted = np.argmax(predictions, axis=1)
+        confidences = predictions[np.arange(len(predicted)), predicted] * 100
+        skin_types = [active.class_names[i] for i in predicted]
+        return skin_types, [round(float(c), 2) for c in confidences], active.version, embeddings
+    
+    def forward(self, active, batch):
+        """(probabilities, embeddings or None) for a batch from one pinned model version"""
+        if active.embedder is not None:
+            embeddings, predictions = active.embed(batch)
+            return predictions, embeddings
+        return active.predict(batch), None
+    
+    def preprocess_image(self, image_path, out=None):
+        """
+        Preprocess image for model input into a (1, H, W, 3) float32 tensor.
+        Pass `out` (e.g. a TensorPool slot) to fill an existing buffer in place.
+        """
         try:
-            # Read image
-            img = Image.open(image_path).convert('RGB')
-            
-            # Resize to model input size
-            img = img.resize((224, 224))
-            
-            # Convert to numpy array
-            img_array = np.array(img)
-            
-            # Normalize pixel values
-            img_array = img_array / 255.0
-            
-            # Add batch dimension
-            img_array = np.expand_dims(img_array, axis=0)
-            
-            return img_array
+            if out is None:
+                width, height = self.input_size()
+                out = np.empty((1, height, width, 3), dtype=np.float32)
+            decode_into(image_path, out[0])
+            return out
         except Exception as e:
             raise Exception(f"Image preprocessing failed: {str(e)}")
     
+    def augment(self, img_array, k):
+        """
+        Build up to k test-time variants of a preprocessed (1, H, W, 3) tensor:
+        flips, 90% crops stretched back to full size and brightness shifts.
+        Returns a (min(k, 9), H, W, 3) batch for a single predict call.
+        """
+        if k < 1:
+            raise ValueError(f"augment() needs at least one variant, got k={k}")
+        image = img_array[0]
+        height, width = image.shape[:2]
+        crop_h, crop_w = int(height * 0.9), int(width * 0.9)
+        
+        def crop(top, left):
+            # Nearest-neighbour resize back to (height, width) via index arrays
+            rows = top + (np.arange(height) * crop_h) // height
+            cols = left + (np.arange(width) * crop_w) // width
+            return image[np.ix_(rows, cols)]
+        
+        variants = [
+            lambda: image[:, ::-1],
+            lambda: crop((height - crop_h) // 2, (width - crop_w) // 2),
+            lambda: np.clip(image * 1.15, 0.0, 1.0),
+            lambda: image * 0.85,
+            lambda: crop(0, 0),
+            lambda: crop(height - crop_h, width - crop_w),
+            lambda: crop(0, width - crop_w)[:, ::-1],
+            lambda: crop(height - crop_h, 0)[:, ::-1],
+            lambda: image[::-1, :],
+        ]
+        return np.stack([make() for make in variants[:k]]).astype(img_array.dtype, copy=False)
+    
     def extract_skin_features(self, image_path):
         """
         Extract skin features using computer vision
         This is used when the ML model is not available
         """
         try:
-            # Read image
-            img = cv2.imread(image_path)
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            
-            # Convert to HSV for better color analysis
-            img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-            
-            # Detect face region (simplified - you can use face detection here)
-            height, width = img.shape[:2]
-            center_region = img_rgb[
-                int(height*0.3):int(height*0.7),
-                int(width*0.3):int(width*0.7)
-            ]
-            
-            # Calculate average brightness
-            brightness = np.mean(center_region)
-            
-            # Calculate color variance (indicates oiliness/shine)
-            variance = np.var(center_region)
-            
-            # Calculate saturation (redness/sensitivity indicator)
-            saturation = np.mean(img_hsv[:, :, 1])
-            
-            return {
-                'brightness': float(brightness),
-                'variance': float(variance),
-                'saturation': float(saturation)
-            }
+            return skin_features(image_path)
         except Exception as e:
             raise Exception(f"Feature extraction failed: {str(e)}")
     
-    def classify_by_features(self, features):
+    @staticmethod
+    def classify_by_features(features):
         """
         Classify skin type based on extracted features
         This is a rule-based fallback when ML model is unavailable
@@ -160,73 +349,130 @@ class SkinAnalyzer:
         
         return skin_type, round(confidence, 2)
     
-    def get_recommendations(self, skin_type):
-        """Get personalized recommendations based on skin type"""
-        recommendations_map = {
-            'Normal': [
-                'Maintain your routine with a gentle cleanser twice daily',
-                'Use a lightweight moisturizer with SPF 30+ during the day',
-                'Incorporate antioxidant serums like Vitamin C for protection'
-            ],
-            'Oily': [
-                'Use oil-free, non-comedogenic products to prevent clogged pores',
-                'Try salicylic acid cleansers to control excess sebum production',
-                'Apply a mattifying moisturizer and use blotting papers throughout the day',
-                'Consider niacinamide serums to regulate oil production'
-            ],
-            'Dry': [
-                'Use a rich, hydrating moisturizer with hyaluronic acid or ceramides',
-                'Avoid harsh soaps and hot water that strip natural oils',
-                'Apply a nourishing night cream before bed',
-                'Use a gentle, creamy cleanser instead of foaming formulas'
-            ],
-            'Combination': [
-                'Use different products for T-zone and cheek areas if needed',
-                'Balance with a pH-balanced cleanser suitable for all areas',
-                'Try lightweight gel moisturizers that won\'t clog pores',
-                'Use targeted treatments: mattifying for oily areas, hydrating for dry patches'
-            ],
-            'Sensitive': [
-                'Choose fragrance-free, hypoallergenic products designed for sensitive skin',
-                'Patch test all new products before full application',
-                'Avoid harsh exfoliants and use gentle, soothing ingredients like aloe vera',
-                'Look for products with centella asiatica or colloidal oatmeal to calm irritation'
-            ]
-        }
-        
-        return recommendations_map.get(skin_type, recommendations_map['Normal'])[:2]
+    def get_recommendations(self, skin_type, confidence=100.0, regions=None):
+        """Get personalized recommendation IDs based on skin type, confidence and regions"""
+        return get_catalogue().recommend(skin_type, confidence, regions)
     
-    def analyze(self, image_path):
+    def early_exit_threshold(self, active):
+        """Confidence (%) the fast model must reach for its answer to be returned"""
+        if Config.EARLY_EXIT_CONFIDENCE > 0:
+            return Config.EARLY_EXIT_CONFIDENCE
+        return active.fast_threshold or 85.0
+    
+    def fast_pass(self, active, image_path):
+        """
+        Run the low-resolution model first. Returns (skin_type, confidence, version,
+        embedding or None) when it is confident enough, or None to escalate to the
+        full model. The embedding comes from the fast model, so it is indexed under
+        the `<version>/fast` model_version, apart from the full model's.
+        """
+        if active.fast is None or Config.INFERENCE_MODE != 'adaptive':
+            return None
+        height, width = active.fast.input_shape[1:3]
+        embedding = None
+        with get_tensor_pool((height, width, 3), Config.TENSOR_POOL_SLOTS).acquire() as img_array:
+            self.preprocess_image(image_path, out=img_array)
+            start = time.perf_counter()
+            if active.fast_embed is not None:
+                embeddings, predictions = active.fast_embed(img_array)
+                embedding = embeddings[0]
+            else:
+                predictions = active.fast_predict(img_array)
+            latency_ms = (time.perf_counter() - start) * 1000
+        predicted_class = np.argmax(predictions[0])
+        confidence = float(predictions[0][predicted_class] * 100)
+        if confidence < self.early_exit_threshold(active):
+            return None
+        skin_type = active.class_names[predicted_class]
+        model_version = f"{active.version}/fast"
+        print(f"Fast model prediction: {skin_type} ({confidence:.2f}%)")
+        # Candidates need their own input size, so they decode the file rather than this low-resolution tensor
+        get_shadow_runner().maybe_submit(self, None, {
+            'model_version': model_version,
+            'skin_type': skin_type,
+            'confidence': round(confidence, 2),
+            'latency_ms': latency_ms
+        }, image_path=image_path)
+        return skin_type, confidence, model_version, embedding
+    
+    def analyze(self, image_path, regions=None, provisional=False):
         """
         Main analysis function
-        Returns skin type, confidence, and recommendations
+        Returns skin type, confidence, and recommendations.
+        provisional=True skips the model for the feature-based answer (overload).
         """
         try:
-            if self.model is not None:
-                # Use ML model for prediction
-                img_array = self.preprocess_image(image_path)
-                predictions = self.model.predict(img_array, verbose=0)
+            active = self.active  # pin one model version for the whole request
+            provisional = provisional and active is not None
+            if provisional:
+                active = None
+            embedding = None
+            early = self.fast_pass(active, image_path) if active is not None else None
+            if early is not None:
+                # Confident low-resolution answer; the full model is skipped
+                skin_type, confidence, model_version, embedding = early
+            elif active is not None:
+                # Use ML model for prediction; the input tensor is a pooled buffer
+                # that is filled in place and handed back when the block exits
+                height, width = active.model.input_shape[1:3]
+                with get_tensor_pool((height, width, 3), Config.TENSOR_POOL_SLOTS).acquire() as img_array:
+                    self.preprocess_image(image_path, out=img_array)
+                    start = time.perf_counter()
+                    if active.embedder is not None:
+                        # Same forward pass also yields the penultimate-layer embedding
+                        embeddings, predictions = active.embed(img_array)
+                        embedding = embeddings[0]
+                    else:
+                        predictions = active.predict(img_array)
+                    latency_ms = (time.perf_counter() - start) * 1000
+                
+                    # Get predicted class and confidence
+                    predicted_class = np.argmax(predictions[0])
+                    confidence = float(predictions[0][predicted_class] * 100)
+                    skin_type = active.class_names[predicted_class]
+                    model_version = active.version
                 
-                # Get predicted class and confidence
-                predicted_class = np.argmax(predictions[0])
-                confidence = float(predictions[0][predicted_class] * 100)
-                skin_type = self.skin_types[predicted_class]
+                    print(f"ML Model prediction: {skin_type} ({confidence:.2f}%)")
                 
-                print(f"ML Model prediction: {skin_type} ({confidence:.2f}%)")
+                    # Candidate models reuse this tensor off the request path
+                    get_shadow_runner().maybe_submit(self, img_array, {
+                        'model_version': model_version,
+                        'skin_type': skin_type,
+                        'confidence': round(confidence, 2),
+                        'latency_ms': latency_ms
+                    })
+                
+                    # Borderline results get a second opinion from augmented views,
+                    # all scored in one batched predict
+                    if Config.TTA_VARIANTS > 0 and (Config.TTA_MODE == 'always' or (
+                            Config.TTA_MODE == 'adaptive' and confidence < Config.TTA_CONFIDENCE_THRESHOLD)):
+                        batch = self.augment(img_array, Config.TTA_VARIANTS)
+                        tta_predictions = active.predict(batch)
+                        probabilities = np.concatenate([predictions, tta_predictions]).mean(axis=0)
+                        predicted_class = np.argmax(probabilities)
+                        confidence = float(probabilities[predicted_class] * 100)
+                        skin_type = active.class_names[predicted_class]
+                    
+                        print(f"TTA x{len(batch) + 1} prediction: {skin_type} ({confidence:.2f}%)")
             else:
                 # Fallback to feature-based analysis
                 features = self.extract_skin_features(image_path)
                 skin_type, confidence = self.classify_by_features(features)
+                model_version = 'features'
                 
                 print(f"Feature-based prediction: {skin_type} ({confidence:.2f}%)")
             
             # Get recommendations
-            recommendations = self.get_recommendations(skin_type)
+            recommendation_ids = self.get_recommendations(skin_type, confidence, regions)
             
             return {
                 'skin_type': skin_type,
                 'confidence': round(confidence, 2),
-                'recommendations': recommendations
+                'recommendation_ids': recommendation_ids,
+                'recommendations': get_catalogue().resolve(recommendation_ids),
+                'model_version': model_version,
+                'embedding': embedding,
+                'provisional': provisional
             }
         
         except Exception as e:
@@ -241,11 +487,12 @@ def get_analyzer():
     global _analyzer
     if _analyzer is None:
         _analyzer = SkinAnalyzer()
+        _analyzer.start_watcher(Config.MODEL_WATCH_INTERVAL)
     return _analyzer
 
-def analyze_skin(image_path):
+def analyze_skin(image_path, regions=None, provisional=False):
     """
     Main function called by the API
     """
     analyzer = get_analyzer()
-    return analyzer.analyze(image_path)
\ No newline at end of file
+    return analyzer.analyze(image_path, regions, provisional)
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""
+Versioned model registry
+
+    ml_model/registry/
+        CURRENT                      <- name of the active version
+        v20250101120000/
+            model.h5
+            fast.h5                  <- optional low-resolution early-exit model
+            manifest.json            <- version, class order, checksum
+
+Every process serving the API loads whatever CURRENT points at. Publishing
+and activating only ever replace files with os.replace, so a reader sees
+either the old version or the new one, never a half-written artifact.
+
+    python -m services.model_registry list
+    python -m services.model_registry publish ml_model/skin_type_model.h5 --activate
+    python -m services.model_registry activate v20250101120000
+    python -m services.model_registry attach v20250101120000 fast ml_model/skin_type_model_fast.h5
+"""
+from datetime import datetime
+from config import Config
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CLASS_INDICES = os.path.join(BACKEND_DIR, 'ml_model', 'class_indices.json')
+MANIFEST_NAME = 'manifest.json'
+CURRENT_NAME = 'CURRENT'
+ATTACHABLE_ROLES = ('fast',)
+
+
+class RegistryError(Exception):
+    pass
+
+
+def registry_dir():
+    path = Config.MODEL_REGISTRY_DIR
+    if not os.path.isabs(path):
+        path = os.path.join(BACKEND_DIR, path)
+    return path
+
+
+def current_pointer_path():
+    return os.path.join(registry_dir(), CURRENT_NAME)
+
+
+def class_names_from_indices(class_indices):
+    """Turn {'combination': 0, 'dry': 1, ...} into display names ordered by output index"""
+    ordered = sorted(class_indices.items(), key=lambda item: item[1])
+    if [index for _, index in ordered] != list(range(len(ordered))):
+        raise RegistryError(f"class indices are not contiguous: {class_indices}")
+    return [name.capitalize() for name, _ in ordered]
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _atomic_write(path, text):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def list_versions():
+    root = registry_dir()
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if os.path.isfile(os.path.join(root, name, MANIFEST_NAME))
+    )
+
+
+def manifest_path(version):
+    return os.path.join(registry_dir(), version, MANIFEST_NAME)
+
+
+def read_manifest(version):
+    path = manifest_path(version)
+    if not os.path.isfile(path):
+        raise RegistryError(f"Unknown model version: {version}")
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest['artifact_path'] = os.path.join(registry_dir(), version, manifest['artifact'])
+    for role in ATTACHABLE_ROLES:
+        if role in manifest:
+            manifest[role]['artifact_path'] = os.path.join(registry_dir(), version, manifest[role]['artifact'])
+    return manifest
+
+
+def current_version():
+    try:
+        with open(current_pointer_path()) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return version or None
+
+
+def activate(version):
+    """Point CURRENT at `version`; watching processes swap to it on their next poll"""
+    read_manifest(version)  # validate before switching
+    _atomic_write(current_pointer_path(), version + '\n')
+    return version
+
+
+def publish(artifact_path, class_indices_path=DEFAULT_CLASS_INDICES, version=None, activate_now=False, extra=None):
+    """Copy a trained artifact into the registry under a new version and return it"""
+    if not os.path.isfile(artifact_path):
+        raise RegistryError(f"Artifact not found: {artifact_path}")
+    with open(class_indices_path) as f:
+        class_indices = json.load(f)
+
+    version = version or datetime.utcnow().strftime('v%Y%m%d%H%M%S')
+    root = registry_dir()
+    final_dir = os.path.join(root, version)
+    if os.path.exists(final_dir):
+        raise RegistryError(f"Version already exists: {version}")
+    os.makedirs(root, exist_ok=True)
+
+    # Build the version in a scratch dir and rename it into place in one step
+    staging_dir = tempfile.mkdtemp(dir=root, prefix='.staging-')
+    try:
+        artifact_name = 'model' + os.path.splitext(artifact_path)[1]
+        shutil.copy2(artifact_path, os.path.join(staging_dir, artifact_name))
+        manifest = {
+            'version': version,
+            'artifact': artifact_name,
+            'sha256': _sha256(artifact_path),
+            'class_indices': class_indices,
+            'class_names': class_names_from_indices(class_indices),
+            'created_at': datetime.utcnow().isoformat(),
+            'source': os.path.abspath(artifact_path),
+        }
+        manifest.update(extra or {})
+        with open(os.path.join(staging_dir, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(staging_dir, final_dir)
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    if activate_now:
+        activate(version)
+    return version
+
+
+def attach(version, role, artifact_path, class_indices_path=DEFAULT_CLASS_INDICES, extra=None):
+    """
+    Add an auxiliary artifact (e.g. the `fast` early-exit model) to an existing
+    version. Its class order must match the version's, since both are read
+    through the same class_names.
+    """
+    if role not in ATTACHABLE_ROLES:
+        raise RegistryError(f"Unknown artifact role: {role}")
+    if not os.path.isfile(artifact_path):
+        raise RegistryError(f"Artifact not found: {artifact_path}")
+    manifest = read_manifest(version)
+    with open(class_indices_path) as f:
+        class_indices = json.load(f)
+    if class_indices != manifest['class_indices']:
+        raise RegistryError(f"{role} artifact class indices {class_indices} do not match {version}")
+
+    version_dir = os.path.join(registry_dir(), version)
+    artifact_name = role + os.path.splitext(artifact_path)[1]
+    fd, tmp_path = tempfile.mkstemp(dir=version_dir, prefix='.tmp-')
+    os.close(fd)
+    shutil.copy2(artifact_path, tmp_path)
+    os.replace(tmp_path, os.path.join(version_dir, artifact_name))
+
+    manifest.pop('artifact_path')
+    for other in ATTACHABLE_ROLES:
+        if other in manifest:
+            manifest[other].pop('artifact_path', None)
+    manifest[role] = dict(extra or {}, artifact=artifact_name, sha256=_sha256(artifact_path),
+                          source=os.path.abspath(artifact_path))
+    # Watching processes reload the version when its manifest changes
+    _atomic_write(manifest_path(version), json.dumps(manifest, indent=2))
+    return manifest[role]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage versioned skin type models')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list')
+    pub = sub.add_parser('publish')
+    pub.add_argument('artifact')
+    pub.add_argument('--class-indices', default=DEFAULT_CLASS_INDICES)
+    pub.add_argument('--version')
+    pub.add_argument('--activate', action='store_true')
+    act = sub.add_parser('activate')
+    act.add_argument('version')
+    att = sub.add_parser('attach')
+    att.add_argument('version')
+    att.add_argument('role', choices=ATTACHABLE_ROLES)
+    att.add_argument('artifact')
+    att.add_argument('--class-indices', default=DEFAULT_CLASS_INDICES)
+    att.add_argument('--threshold', type=float, help='early-exit confidence (%%) for a fast artifact')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        active = current_version()
+        for version in list_versions():
+            marker = '*' if version == active else ' '
+            print(f"{marker} {version}")
+    elif args.command == 'publish':
+        version = publish(args.artifact, args.class_indices, args.version, args.activate)
+        print(f"✓ Published {version}" + (" (active)" if args.activate else ""))
+    elif args.command == 'activate':
+        activate(args.version)
+        print(f"✓ Activated {args.version}")
+    elif args.command == 'attach':
+        extra = {'threshold': args.threshold} if args.threshold is not None else None
+        attach(args.version, args.role, args.artifact, args.class_indices, extra)
+        print(f"✓ Attached {args.role} artifact to {args.version}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Allocation-light image preprocessing
+
+decode_into() fills a caller-owned float32 (H, W, 3) buffer, usually a
+TensorPool slot, instead of building fresh uint8, float64 and batch arrays
+for every request. JPEGs are draft-decoded at the smallest DCT scale that is
+still at least the target size.
+
+skin_features() computes the rule-based features straight from the BGR
+decode, without RGB and HSV copies. HSV goes into a per-thread scratch
+buffer that is reused across calls.
+"""
+from PIL import Image
+import threading
+import cv2
+import numpy as np
+
+_INV_255 = np.float32(1.0 / 255.0)
+_scratch = threading.local()
+
+
+def decode_pixels(image_path, size):
+    """Decode and resize an image to (height, width, 3) RGB uint8; size is (width, height)"""
+    with Image.open(image_path) as img:
+        img.draft('RGB', size)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        return np.asarray(img.resize(size))
+
+
+def decode_into(image_path, out):
+    """Decode, resize and normalise an image into `out` (H, W, 3) float32, in place"""
+    height, width = out.shape[:2]
+    np.multiply(decode_pixels(image_path, (width, height)), _INV_255, out=out)
+    return out
+
+
+def _scratch_view(shape):
+    """A (h, w, 3) uint8 view into this thread's scratch buffer, grown only when needed"""
+    size = int(np.prod(shape))
+    buffer = getattr(_scratch, 'buffer', None)
+    if buffer is None or buffer.size < size:
+        buffer = _scratch.buffer = np.empty(size, dtype=np.uint8)
+    return buffer[:size].reshape(shape)
+
+
+def skin_features(image_path):
+    """Brightness, variance and saturation used by the rule-based classifier"""
+    img = cv2.imread(image_path)
+    if img is None:
+        raise ValueError(f"Could not read image: {image_path}")
+    return skin_features_bgr(img)
+
+
+def skin_features_bgr(img):
+    """skin_features() for an already decoded BGR uint8 image, e.g. a video frame"""
+    height, width = img.shape[:2]
+    center_region = img[int(height*0.3):int(height*0.7), int(width*0.3):int(width*0.7)]
+
+    # Mean and variance over all channels, from per-channel moments: the channel
+    # order does not matter and no float copy of the region is made
+    means, stds = cv2.meanStdDev(center_region)
+    means, stds = means.ravel(), stds.ravel()
+    brightness = means.mean()
+    variance = (stds ** 2 + means ** 2).mean() - brightness ** 2
+
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV, dst=_scratch_view(img.shape))
+    saturation = cv2.mean(hsv)[1]
+
+    return {
+        'brightness': float(brightness),
+        'variance': float(variance),
+        'saturation': float(saturation)
+    }
@@ -0,0 +1,78 @@
+"""
+Recommendation engine
+
+The catalogue in data/recommendations.json is loaded once per process and
+indexed by (skin type, confidence band). Analyses store only the chosen
+recommendation IDs; the text is resolved from the in-memory catalogue when
+a row is serialized.
+"""
+from config import Config
+import json
+import os
+import threading
+
+CATALOGUE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'recommendations.json')
+ID_SEPARATOR = ','
+
+
+class RecommendationCatalogue:
+    def __init__(self, path=CATALOGUE_PATH):
+        with open(path) as f:
+            data = json.load(f)
+        self.bands = {name: tuple(bounds) for name, bounds in data['bands'].items()}
+        self.items = {item['id']: item for item in data['items']}
+
+        # (skin_type, band) -> candidates ordered by priority, with the
+        # skin-type-agnostic ('*') and band-agnostic ('any') entries folded in
+        skin_types = {item['skin_type'] for item in data['items']} - {'*'}
+        self.index = {}
+        for skin_type in skin_types:
+            for band in self.bands:
+                matches = [
+                    item for item in data['items']
+                    if item['skin_type'] in (skin_type, '*') and item['band'] in (band, 'any')
+                ]
+                matches.sort(key=lambda item: item['priority'])
+                self.index[(skin_type, band)] = tuple(matches)
+
+    def band_for(self, confidence):
+        for name, (low, high) in self.bands.items():
+            if low <= confidence < high:
+                return name
+        return 'high'
+
+    def recommend(self, skin_type, confidence, regions=None, limit=None):
+        """
+        Pick recommendation IDs for a result. `regions` (e.g. {'t_zone'}) narrows
+        zone-specific advice to the areas that need it; whole-face items always apply.
+        """
+        limit = limit or Config.RECOMMENDATION_LIMIT
+        candidates = self.index.get((skin_type, self.band_for(confidence)), ())
+        if regions is not None:
+            candidates = [item for item in candidates if item['region'] == 'face' or item['region'] in regions]
+        return [item['id'] for item in candidates[:limit]]
+
+    def resolve(self, ids):
+        """Texts for stored IDs, skipping any that were removed from the catalogue"""
+        return [self.items[i]['text'] for i in ids if i in self.items]
+
+
+def encode_ids(ids):
+    return ID_SEPARATOR.join(ids)
+
+
+def decode_ids(value):
+    return value.split(ID_SEPARATOR) if value else []
+
+
+_catalogue = None
+_lock = threading.Lock()
+
+
+def get_catalogue():
+    global _catalogue
+    if _catalogue is None:
+        with _lock:
+            if _catalogue is None:
+                _catalogue = RecommendationCatalogue()
+    return _catalogue
@@ -0,0 +1,95 @@
+"""
+Per-process thread budget for TensorFlow, OpenCV and BLAS
+
+With several web workers on one host, every TensorFlow runtime would by
+default size its intra-op pool to all cores, so N workers run N x cores
+threads and tail latency suffers. Each process here takes an equal share of
+the cores it may run on. When PIN_WORKER_CORES is set, serve.py gives each
+worker its own contiguous slice of cores, and the share is that slice.
+
+    intra-op threads   TF_INTRA_OP_THREADS or the worker's share of cores
+    inter-op threads   TF_INTER_OP_THREADS or 1 (concurrency comes from requests)
+    OpenCV threads     OPENCV_THREADS
+    BLAS / OpenMP      same as intra-op, through environment variables that
+                       must be set before NumPy or TensorFlow are imported
+
+benchmarks/bench_threads.py sweeps these settings and prints the
+environment variables to use on a host.
+"""
+from config import Config
+from utils.helpers import available_cores
+import os
+
+_BLAS_ENV = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+_configured = {}
+_pinned = False
+
+
+def worker_count():
+    return int(os.environ.get('WEB_CONCURRENCY', 0)) or 1
+
+
+def cores_share():
+    """Cores this process should use: all of its pinned slice, or an equal share of the host's"""
+    if _pinned:
+        return available_cores()
+    return max(1, available_cores() // worker_count())
+
+
+def thread_settings():
+    share = cores_share()
+    return {
+        'intra_op': Config.TF_INTRA_OP_THREADS or share,
+        'inter_op': Config.TF_INTER_OP_THREADS or 1,
+        'opencv': Config.OPENCV_THREADS,
+    }
+
+
+def worker_cores(slot, workers, cores=None):
+    """Contiguous slice of `cores` for worker number `slot` out of `workers`"""
+    cores = sorted(cores if cores is not None else os.sched_getaffinity(0))
+    per_worker = max(1, len(cores) // workers)
+    start = (slot * per_worker) % len(cores)
+    return set(cores[start:start + per_worker])
+
+
+def pin_to_cores(cores):
+    global _pinned
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+        _pinned = True
+
+
+def configure_environment(settings=None):
+    """Cap BLAS/OpenMP pools; only effective before NumPy/TensorFlow are imported"""
+    settings = settings or thread_settings()
+    for name in _BLAS_ENV:
+        os.environ.setdefault(name, str(settings['intra_op']))
+
+
+def configure_tensorflow(tf, settings=None):
+    """Size TensorFlow's thread pools; must run before the first op executes"""
+    if 'tensorflow' in _configured:
+        return _configured['tensorflow']
+    settings = settings or thread_settings()
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(settings['intra_op'])
+        tf.config.threading.set_inter_op_parallelism_threads(settings['inter_op'])
+    except RuntimeError as e:
+        # The runtime was already initialised (e.g. by an import-time op); keep its pools
+        print(f"⚠ TensorFlow threads already fixed: {e}")
+    _configured['tensorflow'] = settings
+    return settings
+
+
+def configure_opencv(cv2, settings=None):
+    settings = settings or thread_settings()
+    cv2.setNumThreads(settings['opencv'])
+    _configured['opencv'] = settings['opencv']
+    return settings['opencv']
+
+
+def describe():
+    """Settings in effect for this process, for logs and the benchmark"""
+    affinity = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None
+    return dict(_configured.get('tensorflow') or thread_settings(), cores=affinity, workers=worker_count())
@@ -0,0 +1,132 @@
+"""
+Shadow inference for candidate models
+
+A sampled fraction of uploads is re-run through one or more candidate
+registry versions after the primary prediction has been made. Candidates
+see a copy of the exact tensor the primary model saw, run on a native
+background thread (services/executor.native_pool, so under gevent they stay
+off the event loop), and their predictions, confidences and latencies are
+handed to a sink (the app stores them as ShadowPrediction rows). The user's
+response never waits for a candidate. snapshot() counts what was sampled,
+recorded, failed and shed, so a stalled runner shows up in /api/admin/metrics.
+"""
+from config import Config
+from services.executor import native_pool
+import random
+import threading
+import time
+import numpy as np
+
+
+class ShadowRunner:
+    def __init__(self, versions, sample_rate, max_pending=32):
+        self.versions = list(versions)
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self.sink = None
+        self._models = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = native_pool(1, 'shadow')
+        self.counters = {'submitted': 0, 'recorded': 0, 'failed': 0, 'shed': 0}
+        self.last_recorded = None
+
+    @property
+    def enabled(self):
+        return bool(self.versions) and self.sample_rate > 0
+
+    def maybe_submit(self, analyzer, img_array, primary, image_path=None):
+        """
+        Queue candidate predictions for this upload if it is sampled.
+        `primary` holds skin_type, confidence, latency_ms and model_version.
+        Pass img_array=None with image_path when the primary tensor does not fit
+        the candidates (early exits); each candidate then decodes the file.
+        """
+        if not self.enabled or random.random() >= self.sample_rate:
+            return False
+        with self._lock:
+            # Shed shadow work rather than let it build up behind real traffic
+            if self._pending >= self.max_pending:
+                self.counters['shed'] += 1
+                return False
+            self._pending += 1
+            self.counters['submitted'] += 1
+        # The caller's tensor is a pooled buffer that is reused once it returns
+        self._executor.submit(self._run, analyzer, img_array.copy() if img_array is not None else None,
+                              primary, image_path)
+        return True
+
+    def _candidate(self, analyzer, version):
+        if version not in self._models:
+            self._models[version] = analyzer.load_version(version)
+        return self._models[version]
+
+    def _run(self, analyzer, img_array, primary, image_path=None):
+        try:
+            for version in self.versions:
+                if version == primary['model_version']:
+                    continue
+                try:
+                    candidate = self._candidate(analyzer, version)
+                    tensor = img_array
+                    if tensor is None:
+                        height, width = candidate.model.input_shape[1:3]
+                        tensor = analyzer.preprocess_image(image_path, out=np.empty((1, height, width, 3), np.float32))
+                    start = time.perf_counter()
+                    predictions = candidate.predict(tensor)
+                    latency_ms = (time.perf_counter() - start) * 1000
+                except Exception as e:
+                    print(f"⚠ Shadow model {version} failed: {e}")
+                    self._count('failed')
+                    continue
+
+                predicted_class = int(np.argmax(predictions[0]))
+                record = {
+                    'primary_version': primary['model_version'],
+                    'primary_skin_type': primary['skin_type'],
+                    'primary_confidence': primary['confidence'],
+                    'primary_latency_ms': primary['latency_ms'],
+                    'candidate_version': version,
+                    'candidate_skin_type': candidate.class_names[predicted_class],
+                    'candidate_confidence': round(float(predictions[0][predicted_class] * 100), 2),
+                    'candidate_latency_ms': latency_ms,
+                }
+                print(f"Shadow {version}: {record['candidate_skin_type']} "
+                      f"({record['candidate_confidence']:.2f}%, {latency_ms:.1f} ms)")
+                if self.sink is not None:
+                    try:
+                        self.sink(record)
+                        self._count('recorded')
+                        self.last_recorded = time.time()
+                    except Exception as e:
+                        print(f"⚠ Could not record shadow prediction: {e}")
+                        self._count('failed')
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def snapshot(self):
+        """Counters for this worker; `stalled` means the queue is full and nothing is being recorded"""
+        with self._lock:
+            idle_seconds = time.time() - self.last_recorded if self.last_recorded else None
+            return dict(
+                self.counters,
+                enabled=self.enabled,
+                pending=self._pending,
+                last_recorded_seconds_ago=round(idle_seconds, 1) if idle_seconds is not None else None,
+                stalled=self._pending >= self.max_pending and (idle_seconds is None or idle_seconds > 60)
+            )
+
+
+_runner = None
+
+
+def get_shadow_runner():
+    global _runner
+    if _runner is None:
+        _runner = ShadowRunner(Config.SHADOW_MODEL_VERSIONS, Config.SHADOW_SAMPLE_RATE)
+    return _runner
@@ -0,0 +1,396 @@
+"""
+Upload storage lifecycle
+
+Uploads are stored under their SHA-256, e.g. `3f2a...9c.jpg`, and compacted
+copies as `<sha256>.min.webp`. Two uploads can never overwrite each other,
+and identical bytes are stored once. Files carry no ownership of their own:
+a file is referenced by every Analysis whose image_path names it, and a file
+with no references is an orphan.
+
+The compactor runs from the CLI (`flask --app app storage-compact`) or on a
+background thread. It transcodes referenced originals whose newest analysis
+is older than STORAGE_TRANSCODE_AFTER_DAYS to a smaller format and repoints
+the rows. It deletes orphans that have not been touched for
+STORAGE_ORPHAN_GRACE_HOURS, which covers files saved by uploads that are
+still being analyzed. Each run returns a report of the bytes reclaimed.
+
+Two-phase uploads: the upload route analyzes a small preview right away.
+The client then sends the original in Content-Range chunks, which are
+appended to `.partial-<analysis id>`. When the last byte arrives, the file is
+hashed into the store on a background thread and the analysis is repointed
+from the preview to the original. Partials left unfinished beyond the orphan
+grace period are removed by the compactor, as are `.upload-`, `.temp-` and
+`.compact-` temp files a crashed process left behind.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from config import Config
+from services.executor import native_pool, start_background
+from utils.helpers import try_lock
+from PIL import Image, features
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, compaction still works from one process
+    fcntl = None
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_CHUNK = 1024 * 1024
+_TEMP_PREFIXES = ('.upload-', '.temp-', '.compact-')  # tempfile.mkstemp() names in the upload folder
+
+
+def upload_dir():
+    path = Config.UPLOAD_FOLDER
+    if not os.path.isabs(path):
+        path = os.path.join(BACKEND_DIR, path)
+    return path
+
+
+def _extension(filename):
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'jpg'
+    return 'jpg' if ext == 'jpeg' else ext
+
+
+@contextmanager
+def _store_lock():
+    """Blocking lock, across worker processes, between _commit() and the compactor's repoint-and-delete"""
+    handle = open(os.path.join(upload_dir(), '.store.lock'), 'w')
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        yield
+    finally:
+        handle.close()
+
+
+def _commit(tmp_path, digest, ext):
+    """Move a fully written temp file to its content-addressed name"""
+    filename = f"{digest}.{ext}"
+    path = os.path.join(upload_dir(), filename)
+    with _store_lock():
+        if os.path.exists(path):
+            # Same bytes already stored; refresh the mtime so the orphan sweep
+            # and the transcoder leave it alone until the new analysis row is committed
+            os.utime(path)
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    return filename
+
+
+def store_upload(file):
+    """Save a werkzeug FileStorage under its content hash and return the stored filename"""
+    folder = upload_dir()
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(_CHUNK), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        return _commit(tmp_path, digest.hexdigest(), _extension(file.filename))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_temp(stream, ext):
+    """Stream to a hidden temp file in the upload folder and return its path; the caller removes it"""
+    folder = upload_dir()
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.temp-', suffix=f'.{ext}')
+    with os.fdopen(fd, 'wb') as out:
+        for chunk in iter(lambda: stream.read(_CHUNK), b''):
+            out.write(chunk)
+    return tmp_path
+
+
+def partial_path(analysis_id):
+    return os.path.join(upload_dir(), f'.partial-{int(analysis_id)}')
+
+
+def received_bytes(analysis_id):
+    try:
+        return os.path.getsize(partial_path(analysis_id))
+    except FileNotFoundError:
+        return 0
+
+
+def append_chunk(analysis_id, stream, start, length):
+    """
+    Append `length` bytes from `stream` to the analysis's partial upload, if
+    it currently holds exactly `start` bytes. Returns the bytes held
+    afterwards, which fall short of start + length when the client
+    disconnected mid-chunk (the next chunk then resumes from there).
+    """
+    os.makedirs(upload_dir(), exist_ok=True)
+    with open(partial_path(analysis_id), 'ab') as out:
+        if fcntl is not None:
+            fcntl.flock(out, fcntl.LOCK_EX)  # one writer per partial, even across workers
+        received = out.seek(0, os.SEEK_END)
+        if received != start:
+            return received
+        remaining = length
+        while remaining > 0:
+            chunk = stream.read(min(_CHUNK, remaining))
+            if not chunk:
+                break
+            out.write(chunk)
+            remaining -= len(chunk)
+        return out.tell()
+
+
+_ORIGINAL_FORMATS = {'JPEG': 'jpg', 'PNG': 'png'}
+_attacher = None
+_attacher_lock = threading.Lock()
+
+
+def _attach(app, analysis_id):
+    from models import db, Analysis
+    path = partial_path(analysis_id)
+    with app.app_context():
+        try:
+            with Image.open(path) as img:
+                ext = _ORIGINAL_FORMATS.get(img.format)
+                img.verify()
+            if ext is None:
+                raise ValueError('Only PNG and JPEG originals are accepted')
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(_CHUNK), b''):
+                    digest.update(chunk)
+            filename = _commit(path, digest.hexdigest(), ext)
+            # The preview file is left behind as an orphan for the compactor
+            Analysis.query.filter_by(id=analysis_id).update({'image_path': filename, 'original_status': 'complete'})
+            db.session.commit()
+            print(f"✓ Original attached to analysis {analysis_id}")
+        except Exception as e:
+            db.session.rollback()
+            if os.path.exists(path):
+                os.remove(path)
+            Analysis.query.filter_by(id=analysis_id).update({'original_status': 'failed'})
+            db.session.commit()
+            print(f"⚠ Could not attach original to analysis {analysis_id}: {e}")
+
+
+def attach_original_later(app, analysis_id):
+    """Hash and store a completed partial upload off the request, then repoint the analysis"""
+    global _attacher
+    if _attacher is None:
+        with _attacher_lock:
+            if _attacher is None:
+                # Native thread even under gevent: verify() and SHA-256 over up to 16 MB would stall the loop
+                _attacher = native_pool(1, 'attach-original')
+    return _attacher.submit(_attach, app, analysis_id)
+
+
+def is_compacted(filename):
+    return '.min.' in filename
+
+
+def reference_counts():
+    """{image_path: number of analyses pointing at it}, archived ones included"""
+    from models import db, Analysis
+    from services.archive import image_reference_counts
+    rows = db.session.query(Analysis.image_path, db.func.count(Analysis.id)).group_by(Analysis.image_path)
+    counts = image_reference_counts()
+    for image_path, count in rows:
+        counts[image_path] = counts.get(image_path, 0) + count
+    return counts
+
+
+def transcode_format():
+    return 'webp' if Config.STORAGE_TRANSCODE_FORMAT == 'webp' and features.check('webp') else 'jpeg'
+
+
+def _transcode(path, fmt):
+    """Re-encode an image, capped at STORAGE_TRANSCODE_MAX_SIDE; returns the encoded bytes"""
+    with Image.open(path) as img:
+        img = img.convert('RGB')
+        img.thumbnail((Config.STORAGE_TRANSCODE_MAX_SIDE, Config.STORAGE_TRANSCODE_MAX_SIDE))
+        buffer = io.BytesIO()
+        img.save(buffer, fmt.upper(), quality=Config.STORAGE_TRANSCODE_QUALITY)
+    return buffer.getvalue()
+
+
+def compact(transcode_after_days=None, orphan_grace_hours=None, dry_run=False, log=print):
+    """
+    One compaction pass over the upload folder. Returns a report dict with
+    files and bytes before/after for transcoding, orphans removed and the
+    total bytes reclaimed.
+    """
+    from models import db, Analysis
+    from services.archive import repoint_image
+    transcode_after_days = Config.STORAGE_TRANSCODE_AFTER_DAYS if transcode_after_days is None else transcode_after_days
+    orphan_grace_hours = Config.STORAGE_ORPHAN_GRACE_HOURS if orphan_grace_hours is None else orphan_grace_hours
+    folder = upload_dir()
+    report = {
+        'transcoded': 0, 'transcode_bytes_before': 0, 'transcode_bytes_after': 0,
+        'orphans_removed': 0, 'orphan_bytes': 0, 'partials_removed': 0, 'missing_files': 0,
+        'failed': 0, 'changed': 0, 'bytes_reclaimed': 0, 'dry_run': dry_run
+    }
+    if not os.path.isdir(folder):
+        return report
+
+    counts = reference_counts()
+    on_disk = {name for name in os.listdir(folder) if not name.startswith('.')}
+    report['missing_files'] = len(set(counts) - on_disk)
+    grace_cutoff = time.time() - orphan_grace_hours * 3600
+
+    # Chunked originals the client stopped sending; the analysis keeps its preview
+    for name in sorted(n for n in os.listdir(folder) if n.startswith('.partial-')):
+        path = os.path.join(folder, name)
+        stat = os.stat(path)
+        if stat.st_mtime > grace_cutoff:
+            continue
+        report['partials_removed'] += 1
+        report['orphan_bytes'] += stat.st_size
+        if not dry_run:
+            os.remove(path)
+            db.session.query(Analysis).filter(
+                Analysis.id == int(name.split('-', 1)[1]), Analysis.original_status == 'pending'
+            ).update({Analysis.original_status: 'abandoned'}, synchronize_session=False)
+            db.session.commit()
+
+    # Temp files of uploads, previews and transcodes whose process died before
+    # the rename; the live ones are younger than the grace period
+    for name in sorted(n for n in os.listdir(folder) if n.startswith(_TEMP_PREFIXES)):
+        path = os.path.join(folder, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue  # renamed into place since the listing
+        if stat.st_mtime > grace_cutoff:
+            continue
+        report['orphans_removed'] += 1
+        report['orphan_bytes'] += stat.st_size
+        if not dry_run:
+            os.remove(path)
+
+    # Orphans: on disk, referenced by nothing, and old enough not to belong to
+    # an upload whose analysis row has not been committed yet
+    for name in sorted(on_disk - set(counts)):
+        path = os.path.join(folder, name)
+        stat = os.stat(path)
+        if stat.st_mtime > grace_cutoff:
+            continue
+        report['orphans_removed'] += 1
+        report['orphan_bytes'] += stat.st_size
+        if not dry_run:
+            os.remove(path)
+
+    # Transcode candidates: every referencing analysis is older than the cutoff
+    fmt = transcode_format()
+    ext = 'webp' if fmt == 'webp' else 'jpg'
+    cutoff = datetime.utcnow() - timedelta(days=transcode_after_days)
+    newest_use = db.func.max(Analysis.created_at)
+    stale = db.session.query(Analysis.image_path, db.func.count(Analysis.id), newest_use).group_by(
+        Analysis.image_path
+    ).having(newest_use < cutoff).all()
+    for name, references, newest in stale:
+        if name not in on_disk or is_compacted(name):
+            continue
+        path = os.path.join(folder, name)
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime > grace_cutoff:
+                continue  # an upload just deduplicated to it; its row may not be committed yet
+            data = _transcode(path, fmt)
+        except (OSError, ValueError) as e:
+            report['failed'] += 1
+            log(f"⚠ Could not transcode {name}: {e}")
+            continue
+        if len(data) >= stat.st_size:
+            continue  # already small; keep the original
+
+        new_name = f"{hashlib.sha256(data).hexdigest()}.min.{ext}"
+        if not dry_run:
+            new_path = os.path.join(folder, new_name)
+            created = not os.path.exists(new_path)
+            if created:
+                fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.compact-')
+                with os.fdopen(fd, 'wb') as out:
+                    out.write(data)
+                os.replace(tmp_path, new_path)
+            with _store_lock():
+                # An upload deduplicating to this file since it was picked refreshes its
+                # mtime in _commit() or adds a row; leave such a file for a later pass
+                db.session.rollback()  # read the references as they are now
+                current = db.session.query(db.func.count(Analysis.id), newest_use).filter(
+                    Analysis.image_path == name
+                ).one()
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    mtime = None
+                unchanged = mtime == stat.st_mtime_ns and tuple(current) == (references, newest)
+                if unchanged:
+                    # Repoint rows first; the original is only removed once nothing names it
+                    db.session.query(Analysis).filter(Analysis.image_path == name).update(
+                        {Analysis.image_path: new_name}, synchronize_session=False
+                    )
+                    db.session.commit()
+                    repoint_image(name, new_name)
+                    os.remove(path)
+            if not unchanged:
+                report['changed'] += 1
+                if created:
+                    os.remove(new_path)
+                continue
+        report['transcoded'] += 1
+        report['transcode_bytes_before'] += stat.st_size
+        report['transcode_bytes_after'] += len(data)
+
+    report['bytes_reclaimed'] = report['orphan_bytes'] + (
+        report['transcode_bytes_before'] - report['transcode_bytes_after']
+    )
+    return report
+
+
+def format_report(report):
+    mb = 1024 * 1024
+    verb = 'would reclaim' if report['dry_run'] else 'reclaimed'
+    return (f"{report['transcoded']:,} transcoded "
+            f"({report['transcode_bytes_before'] / mb:.1f} MB -> {report['transcode_bytes_after'] / mb:.1f} MB), "
+            f"{report['orphans_removed']:,} orphans and {report['partials_removed']:,} unfinished uploads "
+            f"({report['orphan_bytes'] / mb:.1f} MB), "
+            f"{verb} {report['bytes_reclaimed'] / mb:.1f} MB"
+            + (f", {report['missing_files']:,} referenced files missing" if report['missing_files'] else '')
+            + (f", {report['failed']:,} failed" if report['failed'] else '')
+            + (f", {report['changed']:,} skipped after changing mid-pass" if report['changed'] else ''))
+
+
+_compactor = None
+
+
+def start_compactor(app, interval_hours):
+    """Run compact() every interval_hours on a daemon thread inside an app context"""
+    global _compactor
+    if _compactor is not None or interval_hours <= 0:
+        return
+    lock_path = os.path.join(app.instance_path, 'storage_compactor.lock')
+
+    def loop():
+        while True:
+            time.sleep(interval_hours * 3600)
+            handle = try_lock(lock_path)
+            if handle is None:
+                continue  # another worker is compacting
+            try:
+                with app.app_context():
+                    report = compact()
+                print(f"✓ Storage compaction: {format_report(report)}")
+            except Exception as e:
+                print(f"⚠ Storage compaction failed: {e}")
+            finally:
+                handle.close()
+
+    _compactor = start_background(loop, 'storage-compactor')
@@ -1,5 +1,44 @@
 from config import Config
+import os
+import re
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locks
+    fcntl = None
+
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
 
 def allowed_file(filename):
     return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
\ No newline at end of file
+           filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
+
+def available_cores():
+    """Number of CPU cores this process may run on (respects taskset/cgroup affinity)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def parse_content_range(header):
+    """(start, end, total) from 'bytes start-end/total' (end inclusive), or None if malformed"""
+    match = _CONTENT_RANGE.match((header or '').strip())
+    if not match:
+        return None
+    start, end, total = (int(g) for g in match.groups())
+    if start > end or end >= total:
+        return None
+    return start, end, total
+
+def try_lock(lock_path):
+    """Non-blocking exclusive file lock so only one worker process runs a background job; None if held"""
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    handle = open(lock_path, 'w')
+    if fcntl is None:
+        return handle
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return handle
+    except OSError:
+        handle.close()
+        return None
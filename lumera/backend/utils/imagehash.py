@@ -0,0 +1,84 @@
+"""
+Perceptual hashing for near-duplicate detection
+
+dhash() compares neighbouring pixels of a tiny grayscale thumbnail, so the
+same photo re-encoded, resized or lightly cropped lands within a few bits of
+the original. BKTree answers "all hashes within Hamming distance d" without
+scanning every stored hash.
+"""
+from PIL import Image
+
+HASH_SIZE = 8
+_SIGN_BIT = 1 << 63
+
+
+def dhash(image_file, hash_size=HASH_SIZE):
+    """64-bit difference hash of an image file or file-like object"""
+    with Image.open(image_file) as img:
+        # JPEG draft mode decodes at 1/2..1/8 scale, skipping most of the work
+        img.draft('L', (hash_size * 8, hash_size * 8))
+        small = img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels = small.tobytes()
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def to_signed64(value):
+    """Store an unsigned 64-bit hash in a signed INTEGER column"""
+    return value - (1 << 64) if value & _SIGN_BIT else value
+
+
+def from_signed64(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes with Hamming distance"""
+
+    def __init__(self):
+        self.root = None  # [hash, [values], {distance: child}]
+        self.size = 0
+
+    def add(self, value_hash, value):
+        self.size += 1
+        if self.root is None:
+            self.root = [value_hash, [value], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value_hash, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value_hash, [value], {}]
+                return
+            node = child
+
+    def search(self, value_hash, max_distance):
+        """All (distance, value) pairs within max_distance, closest first"""
+        if self.root is None:
+            return []
+        matches = []
+        stack = [self.root]
+        while stack:
+            node_hash, values, children = stack.pop()
+            distance = hamming(value_hash, node_hash)
+            if distance <= max_distance:
+                matches.extend((distance, value) for value in values)
+            # Triangle inequality: only children at |d - distance| <= max_distance can match
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
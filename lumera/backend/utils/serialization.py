@@ -0,0 +1,134 @@
+"""
+Response serialization
+
+- FastJSONProvider plugs orjson into Flask's jsonify when it is installed and
+  falls back to the stdlib json module otherwise (JSON_BACKEND selects one).
+- analysis_projection()/analysis_row_to_dict() build API dicts straight from
+  query tuples, so list endpoints skip ORM object hydration.
+- register_compression() gzip/brotli-encodes large JSON responses for clients
+  that accept it.
+"""
+from datetime import date, datetime
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from config import Config
+from models import Analysis, recommendation_texts
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def backend_name():
+    if Config.JSON_BACKEND == 'stdlib' or orjson is None:
+        return 'stdlib'
+    return 'orjson'
+
+
+def dumps_bytes(obj):
+    """Serialize to compact UTF-8 JSON bytes with the configured backend"""
+    if backend_name() == 'orjson':
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if kwargs or backend_name() == 'stdlib':
+            return super().dumps(obj, **kwargs)
+        return dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs or backend_name() == 'stdlib':
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def analysis_projection():
+    """Columns read by list endpoints, in the order analysis_row_to_dict expects"""
+    return (
+        Analysis.id,
+        Analysis.user_id,
+        Analysis.image_path,
+        Analysis.skin_type,
+        Analysis.confidence,
+        Analysis.recommendation_ids,
+        Analysis.recommendations,
+        Analysis.model_version,
+        Analysis.original_status,
+        Analysis.provisional,
+        Analysis.created_at,
+    )
+
+
+def analysis_row_to_dict(row):
+    """Same shape as Analysis.to_dict(), built from an analysis_projection() tuple"""
+    (analysis_id, user_id, image_path, skin_type, confidence,
+     recommendation_ids, recommendations, model_version, original_status, provisional, created_at) = row
+    return {
+        'id': analysis_id,
+        'user_id': user_id,
+        'image_path': image_path,
+        'skin_type': skin_type,
+        'confidence': confidence,
+        'recommendations': recommendation_texts(recommendation_ids, recommendations),
+        'model_version': model_version,
+        'original_status': original_status,
+        'provisional': bool(provisional),
+        'created_at': created_at.isoformat()
+    }
+
+
+def _accepted_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def register_compression(app):
+    """Compress JSON responses above COMPRESS_MIN_BYTES"""
+    @app.after_request
+    def compress_response(response):
+        if (response.direct_passthrough
+                or response.is_streamed
+                or response.mimetype != 'application/json'
+                or 'Content-Encoding' in response.headers
+                or response.status_code < 200
+                or response.status_code >= 300):
+            return response
+        body = response.get_data()
+        if len(body) < Config.COMPRESS_MIN_BYTES:
+            return response
+        encoding = _accepted_encoding()
+        if encoding is None:
+            return response
+
+        if encoding == 'br':
+            compressed = brotli.compress(body, quality=Config.COMPRESS_LEVEL)
+        else:
+            compressed = gzip.compress(body, compresslevel=Config.COMPRESS_LEVEL)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
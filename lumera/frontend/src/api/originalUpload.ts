@@ -0,0 +1,67 @@
+import api from './axios';
+import { OriginalUpload } from '../types';
+
+const PREVIEW_MAX_SIDE = 512;
+const MAX_RETRIES = 5;
+
+// Downscaled JPEG sent for the instant analysis; the model only needs 224x224
+export const makePreview = (file: File): Promise<Blob> =>
+  new Promise((resolve, reject) => {
+    const url = URL.createObjectURL(file);
+    const img = new Image();
+    img.onload = () => {
+      const scale = Math.min(1, PREVIEW_MAX_SIDE / Math.max(img.width, img.height));
+      const canvas = document.createElement('canvas');
+      canvas.width = Math.round(img.width * scale);
+      canvas.height = Math.round(img.height * scale);
+      canvas.getContext('2d')?.drawImage(img, 0, 0, canvas.width, canvas.height);
+      URL.revokeObjectURL(url);
+      canvas.toBlob(
+        (blob) => (blob ? resolve(blob) : reject(new Error('Could not encode preview'))),
+        'image/jpeg',
+        0.85
+      );
+    };
+    img.onerror = () => {
+      URL.revokeObjectURL(url);
+      reject(new Error('Could not read image'));
+    };
+    img.src = url;
+  });
+
+// Send the full-resolution original in chunks, resuming from the server's offset after errors
+export const uploadOriginal = async (upload: OriginalUpload, file: File) => {
+  const url = upload.url.replace(/^\/api/, '');
+  let offset = upload.received;
+  let retries = 0;
+
+  while (offset < upload.total) {
+    const end = Math.min(offset + upload.chunk_size, upload.total) - 1;
+    try {
+      const response = await api.put(url, file.slice(offset, end + 1), {
+        headers: {
+          'Content-Type': 'application/octet-stream',
+          'Content-Range': `bytes ${offset}-${end}/${upload.total}`,
+        },
+      });
+      offset = response.data.received;
+      retries = 0;
+    } catch (err: any) {
+      if (++retries > MAX_RETRIES) {
+        console.error('❌ Original upload gave up:', err);
+        return;
+      }
+      if (err.response?.status === 409 && err.response.data?.status !== 'pending') {
+        return; // already attached or no longer accepted
+      }
+      await new Promise((r) => setTimeout(r, 1000 * 2 ** retries));
+      try {
+        const state = await api.get(url);
+        offset = state.data.received;
+      } catch {
+        // keep the last known offset and retry
+      }
+    }
+  }
+  console.log('✓ Original uploaded');
+};
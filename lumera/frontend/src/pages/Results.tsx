@@ -55,7 +55,7 @@ const Results = () => {
     );
   }
 
-  const recommendations = JSON.parse(analysis.recommendations);
+  const recommendations = analysis.recommendations;
 
   return (
     <div className="min-h-[calc(100vh-4rem)] py-8 px-4">
@@ -94,6 +94,11 @@ const Results = () => {
                     {analysis.confidence}% confidence
                   </span>
                 </div>
+                {analysis.provisional && (
+                  <p className="text-sm text-gray-500 mt-2">
+                    Quick estimate while our servers are busy. It will be refined shortly.
+                  </p>
+                )}
               </div>
 
               <div className="mb-6">
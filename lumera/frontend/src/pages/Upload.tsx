@@ -1,6 +1,7 @@
 import { useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 import api from '../api/axios';
+import { makePreview, uploadOriginal } from '../api/originalUpload';
 import { AnalysisResponse } from '../types';
 
 const Upload = () => {
@@ -45,10 +46,12 @@ const Upload = () => {
     setLoading(true);
     setError('');
   
-    const formData = new FormData();
-    formData.append('image', selectedFile);
-  
     try {
+      // Analyze a small preview first; the original follows in the background
+      const formData = new FormData();
+      formData.append('image', await makePreview(selectedFile), 'preview.jpg');
+      formData.append('original_size', String(selectedFile.size));
+
       console.log('Uploading file:', {
         name: selectedFile.name,
         size: selectedFile.size,
@@ -66,6 +69,9 @@ const Upload = () => {
       );
       
       console.log('✓ Upload successful:', response.data);
+      if (response.data.original_upload) {
+        uploadOriginal(response.data.original_upload, selectedFile);
+      }
       navigate(`/results/${response.data.analysis.id}`);
     } catch (err: any) {
       console.error('❌ Upload error:', err);
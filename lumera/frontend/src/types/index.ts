@@ -11,7 +11,10 @@ export interface User {
     image_path: string;
     skin_type: string;
     confidence: number;
-    recommendations: string;
+    recommendations: string[];
+    model_version: string | null;
+    original_status: string | null;
+    provisional: boolean;
     created_at: string;
   }
   
@@ -21,7 +24,15 @@ export interface User {
     user: User;
   }
   
+  export interface OriginalUpload {
+    url: string;
+    total: number;
+    received: number;
+    chunk_size: number;
+  }
+  
   export interface AnalysisResponse {
     message: string;
     analysis: Analysis;
+    original_upload?: OriginalUpload;
   }
\ No newline at end of file